@@ -0,0 +1,82 @@
+"""
+Cloud Functions のエントリーポイントのコールドスタート・ウォームスタートの時間を計測する。
+
+    python benchmarks/bench_cold_start.py
+
+コールドスタート: 新しいプロセスでエントリーポイントのモジュールを読み込むまでの時間
+ウォームスタート: 読み込み済みのプロセスで実行コンテキストと Firestore クライアントを用意する時間
+（Firestore クライアントの初期化は認証情報がある場合のみ計測する）
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "core")
+sys.path.append(CORE_DIR)
+
+# 計測するエントリーポイントのモジュール
+ENTRY_MODULES = ["fetch_and_save", "intervention", "calculate_daily_mean"]
+
+# 計測の繰り返し回数
+REPEAT = 5
+
+IMPORT_SNIPPET = """
+import sys, time
+sys.path.insert(0, {core_dir!r})
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(elapsed, "streamlit" in sys.modules, "google.cloud.secretmanager" in sys.modules)
+"""
+
+
+# 新しいプロセスでモジュールを読み込む時間を計測する
+def measure_cold_import(module):
+    times = []
+    heavy = None
+    for _ in range(REPEAT):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET.format(core_dir=CORE_DIR, module=module)],
+            capture_output=True, text=True, check=True,
+        ).stdout.split()
+        times.append(float(output[0]))
+        heavy = {"streamlit": output[1] == "True", "secretmanager": output[2] == "True"}
+    return statistics.median(times), heavy
+
+
+# 読み込み済みのプロセスで1回の呼び出しの準備にかかる時間を計測する
+def measure_warm_start():
+    from runtime import RunContext
+    import firebase_auth
+
+    try:
+        started = time.perf_counter()
+        firebase_auth.initialize_firestore()
+        first = time.perf_counter() - started
+    except RuntimeError as e:
+        print(f"Firestore クライアントの初期化は計測できませんでした: {e}")
+        first = None
+
+    times = []
+    for _ in range(1000):
+        started = time.perf_counter()
+        run = RunContext()
+        if first is not None:
+            run.storage
+        times.append(time.perf_counter() - started)
+    return first, statistics.median(times)
+
+
+if __name__ == "__main__":
+    print("コールドスタート（モジュールの読み込み, 中央値）")
+    for module in ENTRY_MODULES:
+        elapsed, heavy = measure_cold_import(module)
+        print(f"  {module:<22} {elapsed * 1000:8.1f} ms  streamlit={heavy['streamlit']} secretmanager={heavy['secretmanager']}")
+
+    first, warm = measure_warm_start()
+    print("ウォームスタート")
+    if first is not None:
+        print(f"  Firestore クライアントの初回作成  {first * 1000:8.1f} ms")
+    print(f"  実行コンテキストの作成（2回目以降） {warm * 1e6:8.1f} us")
@@ -0,0 +1,481 @@
+"""
+データ処理の主要な経路（変換・統計量・グラフの準備・SQLite ストレージ）の速度とメモリを計測する。
+入力は benchmarks/synthetic.py の合成データ（シード固定）で、Firebase や Fitbit API は使わない。
+
+    python benchmarks/bench_suite.py                          # すべて計測して結果を表示
+    python benchmarks/bench_suite.py --quick                  # 大きいサイズ（7日分の心拍数・200ユーザなど）を除く
+    python benchmarks/bench_suite.py --filter chart/          # 名前に chart/ を含むものだけ
+    python benchmarks/bench_suite.py --save-baseline main     # 結果を benchmarks/baselines/main.json に保存
+    python benchmarks/bench_suite.py --compare main           # main.json と比較し、劣化があれば終了コード 1
+    python benchmarks/bench_suite.py --compare main --report report.md
+
+benchmarks/baselines/reference.json は開発用の Linux 環境で計測したもの（別の環境では自分で保存し直して比較する）。
+
+時間は同じ入力で繰り返し実行したときの最小値と中央値、メモリは tracemalloc で計測した実行中のピーク
+（入力データの作成分は含まない。SQLite の内部で確保したメモリは含まれない）。
+計測は --processes（既定 3）個の別々のプロセスで行い、ケースごとに各プロセスの結果の中央値を使う。
+ベースラインとの比較は最小値で行い、劣化と判定したケースは計測し直して、すべての計測で劣化した場合だけ失敗にする。
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime, timedelta, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCH_DIR, "..")
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, "core"))
+
+import numpy as np
+import pandas as pd
+import legacy_transforms
+import synthetic
+from baseline_store import JST, compute_stats, merge_all
+from compact_storage import group_by_hour
+from fetch_and_save import transform_activity_data
+from intervention_features import derive_features, hourly_stats_from_points
+from runtime import RunContext
+from services.chart_data import MAX_POINTS, lttb, prepare_chart_data
+from sqlite_storage import SQLiteStorage
+from transform_kernels import format_times
+
+# ベースラインの保存先
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+
+# 1つのケースを繰り返す回数（最小・最大）と、最小回数を超えて繰り返す合計時間（秒）
+MIN_REPEAT = 3
+MAX_REPEAT = 50
+MIN_TOTAL_SECONDS = 0.5
+
+# 劣化とみなす比率（最小時間・ピークメモリがベースラインの 1 + この値 倍を超えた場合）
+# 時間は他のプロセスの影響を受けにくい最小時間で比較する（中央値は負荷の高いマシンで大きく揺れる）
+DEFAULT_THRESHOLD = 0.25
+
+# 計測の誤差として無視する差（時間はミリ秒、メモリはKB）
+NOISE_FLOOR_MS = 1.0
+NOISE_FLOOR_KB = 64
+
+# 劣化と判定したケースを計測し直す回数（すべての計測で劣化した場合だけ劣化とする）
+CONFIRM_RUNS = 2
+
+# 計測を分けて実行するプロセス数（プロセスごとに速さが揺れるため、各プロセスの結果の中央値を使う）
+DEFAULT_PROCESSES = 3
+
+# 合成データのシード
+SEED = 0
+
+
+# --- 計測対象 ---
+
+# 1日ごとのレスポンスを取り込み時と同じ処理で変換する
+def transform_days(data_type, day_payloads):
+    return [transform_activity_data(data_type, payload) for payload in day_payloads]
+
+
+# 複数ユーザ・複数データタイプの1時間分を変換する（定期実行1回分の変換処理）
+def transform_users(user_payloads):
+    return {
+        (user_id, data_type): transform_days(data_type, day_payloads)
+        for data_type, users in user_payloads.items()
+        for user_id, day_payloads in users.items()
+    }
+
+
+# 取り込み時のロールアップの計算（時ごとの統計量と日の統計量）
+def day_rollup(seconds, values):
+    hours = {hour: compute_stats(hour_values) for hour, (_, hour_values) in group_by_hour(seconds, values).items()}
+    return hours, merge_all(hours.values())
+
+
+# 変換後の配列を保存済みのデータ点 [{"date", "time", "value"}] の形式にする
+def stored_points(date, seconds, values):
+    return [{"date": date, "time": time, "value": value} for time, value in zip(format_times(seconds), values.tolist())]
+
+
+# --- ケースの定義 ---
+
+# 計測するケースの一覧 [(名前, 入力を作成する関数, 計測する関数)] を作成する
+def build_cases(quick=False, workdir=None):
+    """
+    入力を作成する関数は (引数のタプル, 入力のデータ点の数) を返す。
+    """
+    cases = []
+
+    def add(name, setup, func):
+        cases.append((name, setup, func))
+
+    def count(day_payloads, data_type):
+        return sum(len(p[f"activities-{data_type}-intraday"]["dataset"]) for p in day_payloads)
+
+    def days(data_type, duration):
+        def setup():
+            day_payloads = synthetic.payloads(data_type, duration, SEED)
+            return (data_type, day_payloads), count(day_payloads, data_type)
+        return setup
+
+    def legacy_days(data_type, duration, func):
+        def setup():
+            day_payloads = synthetic.payloads(data_type, duration, SEED)
+            datasets = [p[f"activities-{data_type}-intraday"]["dataset"] for p in day_payloads]
+            return (func, datasets), count(day_payloads, data_type)
+        return setup
+
+    def run_legacy(func, datasets):
+        return [func(dataset) for dataset in datasets]
+
+    def legacy_heart(dataset):
+        return legacy_transforms.resample_to_5s(pd.DataFrame(dataset))
+
+    # 変換（取り込み時の5秒リサンプリング・1時間集計）
+    for duration in ("1h", "1d") + (() if quick else ("7d",)):
+        add(f"transform/heart_resample/{duration}", days("heart", duration), transform_days)
+    for duration in ("1h", "1d"):
+        add(f"transform/heart_resample_legacy/{duration}", legacy_days("heart", duration, legacy_heart), run_legacy)
+    for duration in ("1h", "1d", "7d", "30d"):
+        add(f"transform/sedentary_hourly/{duration}", days("minutesSedentary", duration), transform_days)
+    for duration in ("1d", "7d"):
+        add(f"transform/sedentary_hourly_legacy/{duration}",
+            legacy_days("minutesSedentary", duration, legacy_transforms.aggregate_sedentary_data), run_legacy)
+    for duration in ("1d", "30d"):
+        add(f"transform/steps/{duration}", days("steps", duration), transform_days)
+
+    for users in (10, 100) + (() if quick else (200,)):
+        def setup(users=users):
+            user_payloads = {
+                data_type: synthetic.user_payloads(data_type, "1h", users, SEED)
+                for data_type in ("heart", "steps", "minutesSedentary")
+            }
+            items = sum(count(p, data_type) for data_type, u in user_payloads.items() for p in u.values())
+            return (user_payloads,), items
+        add(f"transform/hourly_run/{users}users", setup, transform_users)
+
+    # 統計量（介入の特徴量・ロールアップ・従来の週次の平均と標準偏差）
+    def steps_points(duration):
+        def setup():
+            points = synthetic.to_points(synthetic.payloads("steps", duration, SEED), "steps")
+            return (points,), len(points)
+        return setup
+
+    for duration in ("7d",) + (() if quick else ("30d",)):
+        add(f"stats/hourly_from_points/steps_{duration}", steps_points(duration), hourly_stats_from_points)
+        add(f"stats/weekly_legacy/steps_{duration}", steps_points(duration), legacy_transforms.weekly_mean_and_std)
+
+    def features_setup():
+        points = synthetic.to_points(synthetic.payloads("steps", "7d", SEED), "steps")
+        last = points[-1]
+        now = datetime.strptime(f"{last['date']} 15:00", "%Y-%m-%d %H:%M").replace(tzinfo=JST)
+        return (RunContext(now=now), hourly_stats_from_points(points)), len(points)
+    add("stats/derive_features/steps_7d", features_setup, derive_features)
+
+    def rollup_setup():
+        _, seconds, values = transform_activity_data("heart", synthetic.payloads("heart", "1d", SEED)[0])
+        return (seconds, values), len(values)
+    add("stats/day_rollup/heart_1d", rollup_setup, day_rollup)
+
+    def merge_setup():
+        _, seconds, values = transform_activity_data("steps", synthetic.payloads("steps", "1d", SEED)[0])
+        hours, _ = day_rollup(seconds, values)
+        stats = list(hours.values()) * 30
+        return (stats,), len(stats)
+    add("stats/merge_hourly/30d", merge_setup, merge_all)
+
+    # グラフの準備（1日分の表示）
+    def chart_setup(data_type):
+        def setup():
+            date, seconds, values = transform_activity_data(data_type, synthetic.payloads(data_type, "1d", SEED)[0])
+            points = stored_points(date, seconds, values)
+            return (points, synthetic.interventions()), len(points)
+        return setup
+
+    for data_type in ("heart", "steps"):
+        add(f"chart/prepare/{data_type}_1d", chart_setup(data_type), prepare_chart_data)
+    add("chart/prepare_legacy/heart_1d", chart_setup("heart"), legacy_transforms.chart_frames)
+
+    def lttb_setup():
+        seconds = np.arange(0, 7 * 86400, 5)
+        values = np.random.default_rng(SEED).normal(80, 10, len(seconds))
+        return (seconds, values, MAX_POINTS), len(seconds)
+    add("chart/lttb/heart_7d", lttb_setup, lttb)
+
+    # SQLite ストレージ（書き込み・1日の読み込み・時間ごと/日ごとの集計）
+    if workdir is not None:
+        storage = SQLiteStorage(os.path.join(workdir, "bench.sqlite3"))
+        loaded = {}
+
+        def load(data_type, duration):
+            if (data_type, duration) not in loaded:
+                for payload in synthetic.payloads(data_type, duration, SEED):
+                    date, seconds, values = transform_activity_data(data_type, payload)
+                    storage.write_points("user000", "EX", data_type, date, seconds, values)
+                loaded[(data_type, duration)] = True
+
+        def write_setup():
+            date, seconds, values = transform_activity_data("heart", synthetic.payloads("heart", "1d", SEED)[0])
+            return ("user000", "EX_WRITE", "heart", date, seconds, values), len(values)
+        add("storage/sqlite_write/heart_1d", write_setup, storage.write_points)
+
+        def read_day_setup():
+            load("heart", "1d")
+            return ("EX", "heart", synthetic.START_DATE.isoformat()), 86400 // 5
+        add("storage/sqlite_read_day/heart_1d", read_day_setup, storage.read_day)
+
+        def hourly_setup():
+            load("steps", "30d")
+            end = datetime.combine(synthetic.START_DATE, datetime.min.time(), JST) + synthetic.DURATIONS["30d"]
+            return ("EX", "steps", end - synthetic.DURATIONS["7d"], end, timedelta(hours=1)), 7 * 1440
+        add("storage/sqlite_hourly_stats/steps_7d", hourly_setup, storage.query_rollups)
+
+        def daily_setup():
+            load("steps", "30d")
+            start = datetime.combine(synthetic.START_DATE, datetime.min.time(), JST)
+            return ("EX", "steps", start, start + synthetic.DURATIONS["30d"], timedelta(days=1)), 30 * 1440
+        add("storage/sqlite_daily_stats/steps_30d", daily_setup, storage.query_rollups)
+
+    return cases
+
+
+# --- 計測 ---
+
+# 1つのケースの時間とピークメモリを計測する
+def measure(setup, func):
+    args, items = setup()
+    func(*args)  # 初回の読み込みやキャッシュの影響を除く
+
+    times = []
+    started = time.perf_counter()
+    while len(times) < MIN_REPEAT or (time.perf_counter() - started < MIN_TOTAL_SECONDS and len(times) < MAX_REPEAT):
+        t0 = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "items": items,
+        "repeat": len(times),
+        "min_ms": min(times) * 1000,
+        "median_ms": statistics.median(times) * 1000,
+        "peak_kb": (peak - before) / 1024,
+    }
+
+
+# すべてのケースを計測する
+def run_suite(quick=False, name_filter=None, names=None, verbose=True):
+    """
+    names を指定した場合はそのケースだけを計測する。
+    """
+    warnings.simplefilter("ignore", FutureWarning)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, setup, func in build_cases(quick, workdir):
+            if name_filter and name_filter not in name:
+                continue
+            if names is not None and name not in names:
+                continue
+            results[name] = measure(setup, func)
+            if verbose:
+                print_result(name, results[name])
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.platform(),
+            "seed": SEED,
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+
+def print_result(name, result):
+    print(f"{name:<45} {result['median_ms']:10.2f} ms  (min {result['min_ms']:9.2f})  "
+          f"{result['peak_kb']:10.0f} KB  {result['items']:>9,} 点")
+
+
+# 別々のプロセスで計測し、ケースごとに各プロセスの結果の中央値をとる
+def run_suite_processes(quick=False, name_filter=None, names=None, processes=DEFAULT_PROCESSES):
+    """
+    同じコードでもプロセスごとに速さが 1.5 倍程度揺れることがあるため、1つのプロセスの結果では比較しない。
+    """
+    if processes <= 1:
+        return run_suite(quick, name_filter, names)
+
+    suites = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for i in range(processes):
+            output = os.path.join(workdir, f"suite{i}.json")
+            command = [sys.executable, os.path.abspath(__file__), "--worker-output", output]
+            if quick:
+                command.append("--quick")
+            if name_filter:
+                command += ["--filter", name_filter]
+            if names is not None:
+                command += ["--names", *sorted(names)]
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+            with open(output) as f:
+                suites.append(json.load(f))
+
+    results = {}
+    for name in suites[0]["results"]:
+        runs = [suite["results"][name] for suite in suites]
+        results[name] = {
+            "items": runs[0]["items"],
+            "repeat": sum(run["repeat"] for run in runs),
+            "processes": processes,
+            "min_ms": statistics.median(run["min_ms"] for run in runs),
+            "median_ms": statistics.median(run["median_ms"] for run in runs),
+            "peak_kb": statistics.median(run["peak_kb"] for run in runs),
+        }
+        print_result(name, results[name])
+    return {"meta": {**suites[0]["meta"], "processes": processes}, "results": results}
+
+
+# --- ベースラインと比較 ---
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(name, suite):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    with open(baseline_path(name), "w") as f:
+        json.dump(suite, f, indent=2, ensure_ascii=False)
+    print(f"ベースラインを保存しました: {baseline_path(name)}")
+
+
+def load_baseline(name):
+    with open(baseline_path(name)) as f:
+        return json.load(f)
+
+
+# ベースラインと比較して、ケースごとの比率と判定を返す
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    [{"name", "baseline_ms", "current_ms", "time_ratio", "baseline_kb", "current_kb", "memory_ratio", "status"}] を返す。
+    status は "regression"（時間かメモリが劣化）/ "improved"（時間が改善）/ "ok" / "new"（ベースラインにない）。
+    時間は最小時間（min_ms）で比較する。
+    """
+    rows = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            rows.append({"name": name, "current_ms": result["min_ms"], "current_kb": result["peak_kb"], "status": "new"})
+            continue
+        time_ratio = result["min_ms"] / base["min_ms"] if base["min_ms"] else float("inf")
+        memory_ratio = result["peak_kb"] / base["peak_kb"] if base["peak_kb"] > 0 else 1.0
+        slower = time_ratio > 1 + threshold and result["min_ms"] - base["min_ms"] > NOISE_FLOOR_MS
+        larger = memory_ratio > 1 + threshold and result["peak_kb"] - base["peak_kb"] > NOISE_FLOOR_KB
+        if slower or larger:
+            status = "regression"
+        elif time_ratio < 1 / (1 + threshold) and base["min_ms"] - result["min_ms"] > NOISE_FLOOR_MS:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append({
+            "name": name,
+            "baseline_ms": base["min_ms"],
+            "current_ms": result["min_ms"],
+            "time_ratio": time_ratio,
+            "baseline_kb": base["peak_kb"],
+            "current_kb": result["peak_kb"],
+            "memory_ratio": memory_ratio,
+            "status": status,
+        })
+    return rows
+
+
+# 劣化と判定したケースを計測し直し、良い方の結果で置き換えて比較し直す
+def confirm_regressions(baseline, suite, rows, quick=False, threshold=DEFAULT_THRESHOLD, runs=CONFIRM_RUNS,
+                        processes=DEFAULT_PROCESSES):
+    """
+    一時的な負荷による誤判定を除くため、すべての計測で劣化したケースだけを劣化として残す。
+    """
+    for _ in range(runs):
+        regressed = {row["name"] for row in rows if row["status"] == "regression"}
+        if not regressed:
+            break
+        print(f"\n劣化と判定した {len(regressed)} 件を計測し直します。")
+        for name, result in run_suite_processes(quick, names=regressed, processes=processes)["results"].items():
+            previous = suite["results"][name]
+            suite["results"][name] = {
+                **result,
+                "min_ms": min(result["min_ms"], previous["min_ms"]),
+                "median_ms": min(result["median_ms"], previous["median_ms"]),
+                "peak_kb": min(result["peak_kb"], previous["peak_kb"]),
+            }
+        rows = compare(baseline, suite, threshold)
+    return rows
+
+
+# 比較結果を Markdown の表にする
+def format_report(rows, baseline_name, baseline, threshold=DEFAULT_THRESHOLD):
+    lines = [
+        f"## ベンチマークの比較（ベースライン: {baseline_name}, 作成 {baseline['meta']['created_at']}）",
+        "",
+        f"最小時間（差が {NOISE_FLOOR_MS} ms を超える場合）またはピークメモリが {1 + threshold:.2f} 倍を超え、"
+        f"計測し直しても変わらなかったものを regression とする。",
+        "",
+        "| ケース | ベースライン (最小 ms) | 今回 (最小 ms) | 比率 | ベースライン (KB) | 今回 (KB) | 比率 | 判定 |",
+        "|---|---:|---:|---:|---:|---:|---:|---|",
+    ]
+    for row in rows:
+        if row["status"] == "new":
+            lines.append(f"| {row['name']} | - | {row['current_ms']:.2f} | - | - | {row['current_kb']:.0f} | - | new |")
+            continue
+        lines.append(
+            f"| {row['name']} | {row['baseline_ms']:.2f} | {row['current_ms']:.2f} | {row['time_ratio']:.2f} "
+            f"| {row['baseline_kb']:.0f} | {row['current_kb']:.0f} | {row['memory_ratio']:.2f} | {row['status']} |"
+        )
+    regressions = [row["name"] for row in rows if row["status"] == "regression"]
+    lines += ["", f"劣化: {len(regressions)} 件" + (f"（{', '.join(regressions)}）" if regressions else "")]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="データ処理の主要な経路の速度とメモリを計測する")
+    parser.add_argument("--quick", action="store_true", help="大きいサイズのケースを除く")
+    parser.add_argument("--filter", help="名前にこの文字列を含むケースだけを計測する")
+    parser.add_argument("--save-baseline", metavar="NAME", help="結果をベースラインとして保存する")
+    parser.add_argument("--compare", metavar="NAME", help="保存したベースラインと比較する")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="劣化とみなす比率")
+    parser.add_argument("--report", help="比較結果の Markdown を保存するパス")
+    parser.add_argument("--processes", type=int, default=DEFAULT_PROCESSES, help="計測を分けて実行するプロセス数")
+    # 子プロセスでの計測用（結果を JSON で保存して終了する）
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    parser.add_argument("--names", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker_output:
+        with open(args.worker_output, "w") as f:
+            json.dump(run_suite(args.quick, args.filter, args.names and set(args.names), verbose=False), f)
+        sys.exit(0)
+
+    suite = run_suite_processes(args.quick, args.filter, processes=args.processes)
+    if args.save_baseline:
+        save_baseline(args.save_baseline, suite)
+    if args.compare:
+        baseline = load_baseline(args.compare)
+        rows = confirm_regressions(baseline, suite, compare(baseline, suite, args.threshold), args.quick, args.threshold,
+                                   processes=args.processes)
+        report = format_report(rows, args.compare, baseline, args.threshold)
+        print()
+        print(report)
+        if args.report:
+            with open(args.report, "w") as f:
+                f.write(report + "\n")
+        if any(row["status"] == "regression" for row in rows):
+            sys.exit(1)
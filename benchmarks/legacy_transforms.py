@@ -0,0 +1,71 @@
+"""
+比較用に残している、pandas を使った従来の処理（core/fetch_and_save.py などから移動）。
+"""
+from datetime import timedelta, timezone
+import pandas as pd
+
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+
+# 座位時間を1時間ごとに集計する関数
+def aggregate_sedentary_data(dataset):
+    df = pd.DataFrame(dataset)
+    if df.empty:
+        return None  # データがない場合
+
+    # 時間をdatetime型に変換
+    df["datetime"] = pd.to_datetime(df["time"], format="%H:%M:%S").apply(lambda x: x.replace(tzinfo=JST))
+
+    # 1時間ごとに集計 (valueを合計)
+    df_resampled = df.set_index("datetime").resample("1h")["value"].sum().reset_index()
+
+    # 時間を文字列形式に変換 (HH:MM:SS 形式)
+    df_resampled["time"] = df_resampled["datetime"].dt.strftime("%H:00:00")
+
+    # 必要な列だけを抽出
+    return df_resampled[["time", "value"]].to_dict(orient="records")
+
+
+# 5秒ごとにリサンプリングする関数（線形補間）
+def resample_to_5s(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    心拍数データを5秒ごとに補間し、`time` 列をHH:MM:SS形式のみに統一する関数
+    """
+    # `time` を明示的に datetime 型に変換（ダミー日付を設定）
+    df["datetime"] = pd.to_datetime("2000-01-01 " + df["time"])
+
+    # インデックスを datetime に設定
+    df.set_index("datetime", inplace=True)
+
+    # 5秒ごとのデータに線形補間
+    df_resampled = df.resample("5s").interpolate(method="linear").reset_index()
+
+    # `time` カラムを HH:MM:SS 形式に戻し、datetime は削除
+    df_resampled["time"] = df_resampled["datetime"].dt.strftime("%H:%M:%S")
+
+    return df_resampled.drop(columns=["datetime"])
+
+
+# 1週間の平均値と標準偏差を計算する関数（core/calculate_weekly_mean_and_std.py の集計部分）
+def weekly_mean_and_std(data):
+    df = pd.DataFrame(data)
+    return df["value"].mean(), df["value"].std()
+
+
+# グラフ用のデータを作成する関数（services/show_data.py の間引き導入前の処理）
+def chart_frames(data, intervention_data):
+    df = pd.DataFrame(data)
+    df["time"] = pd.to_datetime(df["time"], format="%H:%M:%S")
+    df = df.sort_values(by="time")
+
+    df_intervention = pd.DataFrame(intervention_data)
+    df_intervention["time"] = pd.to_datetime(df_intervention["time"], format="%H:%M:%S")
+
+    # 介入時間ごとに、一番近い `df` の値を取得
+    df_intervention["value"] = df_intervention["time"].apply(
+        lambda t: df.loc[(df["time"] - t).abs().idxmin(), "value"]
+        if not df.empty else None
+    )
+    df_intervention.dropna(inplace=True)
+    return df, df_intervention
@@ -0,0 +1,228 @@
+"""
+ローカルのスタブサーバ（stub_apis.py）と SQLite のストレージに対して、データ取得と介入のエントリーポイントの負荷試験を行う。
+
+    python benchmarks/load_test.py --users 200
+    python benchmarks/load_test.py --users 200 --latency-ms 150 --expire-rate 0.05 --stale-tokens 0.2 --json result.json
+
+process_all_users / scheduled_intervention と同じ処理（run_ingestion / run_interventions）を呼び出し、
+ユーザごとの結果からスループット、ユーザごとの処理時間の p50 / p99、エラー率を集計する。
+データ取得のユーザごとの処理時間は、そのユーザの最初のエンドポイントの開始から最後のエンドポイントの終了までの時間
+（run_ingestion の elapsed。キューでの待機時間は含まない）で、エラーのあったユーザと処理しなかったユーザは除く。
+Cloud Functions の実行と同じく、データ取得 → 介入の順に1回ずつ実行する。
+
+介入の判定に必要な過去7日分の歩数と座位時間は、スタブと同じ合成データを事前にストレージへ書き込んでおく。
+アプリのログは --verbose を指定した場合のみ表示する。
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from stub_apis import StubServer, add_config_arguments, config_from_args, intraday_payload
+
+CORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "core")
+
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+# 事前に書き込む過去データのデータタイプ（介入の判定に使うもの）
+HISTORY_DATA_TYPES = ("steps", "minutesSedentary")
+
+
+# スタブとストレージの接続先を環境変数に設定してからアプリのモジュールを読み込む
+def load_app(stub, sqlite_path, max_workers):
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = sqlite_path
+    os.environ["FITBIT_API_BASE"] = stub.fitbit_base
+    os.environ["SLACK_API_BASE"] = stub.slack_base
+    os.environ["MAX_CONCURRENT_REQUESTS"] = str(max_workers)
+    os.environ["INTERVENTION_MAX_WORKERS"] = str(max_workers)
+    os.environ["HTTP_POOL_MAXSIZE"] = str(max(max_workers, 32))
+    sys.path.append(CORE_DIR)
+    import fetch_and_save
+    import intervention
+    from storage import get_storage
+    return fetch_and_save, intervention, get_storage()
+
+
+# 参加者を登録する（stale_tokens の割合のユーザは有効期限切れのトークンにする）
+def seed_users(storage, stub, users, stale_tokens, now):
+    user_ids = []
+    for i in range(users):
+        user_id = f"U{i:04d}"
+        token = stub.state.issue_tokens(user_id)
+        expires_at = now + timedelta(seconds=token["expires_in"])
+        if i < int(users * stale_tokens):
+            expires_at = now - timedelta(minutes=1)
+        storage.set_user(user_id, {
+            "experiment_id": f"exp{i:04d}",
+            "slack_dm_id": f"D{i:04d}",
+            "fitbit_access_token": token["access_token"],
+            "refresh_token": token["refresh_token"],
+            "fitbit_client_id": "load-test-client",
+            "fitbit_client_secret": "load-test-secret",
+            "token_expiration": token["expires_in"],
+            "token_expires_at": expires_at,
+        })
+        user_ids.append(user_id)
+    return user_ids
+
+
+# 介入の判定に使う過去の日のデータをスタブと同じ合成データで書き込む
+def seed_history(fetch_and_save, storage, user_ids, days, now, seed):
+    for i, user_id in enumerate(user_ids):
+        for offset in range(1, days + 1):
+            day = (now - timedelta(days=offset)).strftime("%Y-%m-%d")
+            for data_type in HISTORY_DATA_TYPES:
+                payload = intraday_payload(user_id, data_type, day, None, None, seed)
+                date, seconds, values = fetch_and_save.transform_activity_data(data_type, payload)
+                storage.write_points(user_id, f"exp{i:04d}", data_type, date, seconds, values)
+
+
+# 処理時間の分布を集計する（秒 → ミリ秒）
+def latency_summary(elapsed):
+    if not elapsed:
+        return {"p50_ms": None, "p99_ms": None, "max_ms": None}
+    values = np.array(elapsed) * 1000
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+# アプリのログを表示しない（--verbose の場合はそのまま表示する）
+def quiet(verbose):
+    if verbose:
+        return contextlib.nullcontext()
+    return contextlib.redirect_stdout(open(os.devnull, "w"))
+
+
+# データ取得（process_all_users の処理）を1回実行する
+def run_ingestion_phase(fetch_and_save, storage, stub, verbose):
+    before = stub.request_count()
+    started = time.perf_counter()
+    with quiet(verbose):
+        results = fetch_and_save.run_ingestion(storage, storage.list_users())
+    wall = time.perf_counter() - started
+
+    requests = stub.request_count() - before
+    failed = [result for result in results.values() if result["errors"]]
+    deferred = [result for result in results.values() if result["deferred"]]
+    completed = [result for result in results.values() if not result["errors"] and result["elapsed"] is not None]
+    endpoint_errors = sum(len(result["errors"]) for result in results.values())
+    endpoints = sum(len(result["saved"]) + len(result["errors"]) for result in results.values())
+    return {
+        "users": len(results),
+        "wall_s": wall,
+        "users_per_s": len(results) / wall if wall else None,
+        "requests": requests,
+        "requests_per_s": requests / wall if wall else None,
+        "latency": latency_summary([result["elapsed"] for result in completed]),
+        "user_error_rate": len(failed) / len(results) if results else 0.0,
+        "endpoint_error_rate": endpoint_errors / endpoints if endpoints else 0.0,
+        "deferred_users": len(deferred),
+        "errors": sorted({error for result in failed for error in result["errors"].values()})[:5],
+    }
+
+
+# 介入（scheduled_intervention の処理）を1回実行する
+def run_intervention_phase(intervention, storage, stub, now, verbose):
+    from runtime import RunContext
+
+    # 現在の時間帯を介入の時間帯にする
+    run = RunContext(now=now, storage=storage)
+    storage.set_schedule(run.date, [run.hour])
+
+    before = stub.request_count()
+    started = time.perf_counter()
+    with quiet(verbose):
+        if not intervention.should_intervene(run):
+            raise RuntimeError("介入の時間帯の設定に失敗しました")
+        results = intervention.run_interventions(run, storage.list_users(["experiment_id", "slack_dm_id"]))
+    wall = time.perf_counter() - started
+
+    requests = stub.request_count() - before
+    outcomes = {}
+    for result in results.values():
+        outcomes[result["outcome"]] = outcomes.get(result["outcome"], 0) + 1
+    evaluated = [result for result in results.values() if result["outcome"] != "skipped"]
+    sends = outcomes.get("sent", 0) + outcomes.get("send_failed", 0)
+    return {
+        "users": len(results),
+        "wall_s": wall,
+        "users_per_s": len(results) / wall if wall else None,
+        "requests": requests,
+        "requests_per_s": requests / wall if wall else None,
+        "latency": latency_summary([result["elapsed"] for result in evaluated]),
+        "outcomes": outcomes,
+        "error_rate": outcomes.get("error", 0) / len(evaluated) if evaluated else 0.0,
+        "send_failure_rate": outcomes.get("send_failed", 0) / sends if sends else 0.0,
+    }
+
+
+# 結果を表示する
+def print_report(report):
+    config = report["config"]
+    print(f"ユーザ数: {config['users']}, 並列数: {config['max_workers']}, 遅延: {config['latency_ms']:.0f}±{config['jitter_ms']:.0f} ms, "
+          f"期限切れ: {config['expire_rate']:.0%} (+期限切れトークン {config['stale_tokens']:.0%}), "
+          f"503: {config['error_rate']:.0%}, レート制限: {config['rate_limit']}/{config['rate_window']}s")
+    for name, label in (("ingestion", "データ取得"), ("intervention", "介入")):
+        phase = report[name]
+        latency = phase["latency"]
+        print(f"\n{label}")
+        print(f"  実行時間      {phase['wall_s']:8.2f} s")
+        print(f"  スループット  {phase['users_per_s']:8.1f} ユーザ/s  {phase['requests_per_s']:8.1f} リクエスト/s（{phase['requests']} 件）")
+        if latency["p50_ms"] is not None:
+            print(f"  ユーザごと    p50 {latency['p50_ms']:8.1f} ms  p99 {latency['p99_ms']:8.1f} ms  max {latency['max_ms']:8.1f} ms")
+        if name == "ingestion":
+            print(f"  エラー率      ユーザ {phase['user_error_rate']:.1%}  エンドポイント {phase['endpoint_error_rate']:.1%}")
+            print(f"  次回に回した  {phase['deferred_users']} ユーザ（レート制限）")
+            for error in phase["errors"]:
+                print(f"    {error}")
+        else:
+            print(f"  結果          {phase['outcomes']}")
+            print(f"  エラー率      {phase['error_rate']:.1%}  送信失敗 {phase['send_failure_rate']:.1%}")
+    print("\nスタブの応答")
+    for key, count in sorted(report["stub"].items()):
+        print(f"  {key:<16} {count:8d}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="データ取得と介入の負荷試験")
+    parser.add_argument("--users", type=int, default=200, help="参加者数")
+    parser.add_argument("--max-workers", type=int, default=16, help="データ取得と介入の並列数")
+    parser.add_argument("--stale-tokens", type=float, default=0.0, help="有効期限切れのトークンで登録するユーザの割合")
+    parser.add_argument("--history-days", type=int, default=7, help="事前に書き込む過去データの日数")
+    parser.add_argument("--sqlite-path", help="SQLite のファイル（省略時は一時ファイル）")
+    parser.add_argument("--json", help="結果を JSON で保存するファイル")
+    parser.add_argument("--verbose", action="store_true", help="アプリのログを表示する")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, StubServer(config_from_args(args)) as stub:
+        sqlite_path = args.sqlite_path or os.path.join(tmp, "load_test.sqlite3")
+        fetch_and_save, intervention, storage = load_app(stub, sqlite_path, args.max_workers)
+
+        now = datetime.now(JST)
+        print(f"スタブ: {stub.fitbit_base}, ストレージ: {sqlite_path}")
+        user_ids = seed_users(storage, stub, args.users, args.stale_tokens, now)
+        started = time.perf_counter()
+        seed_history(fetch_and_save, storage, user_ids, args.history_days, now, args.seed)
+        print(f"{len(user_ids)} ユーザと過去 {args.history_days} 日分のデータを登録しました（{time.perf_counter() - started:.1f} s）\n")
+
+        report = {
+            "config": {**vars(args), "users": args.users},
+            "ingestion": run_ingestion_phase(fetch_and_save, storage, stub, args.verbose),
+            "intervention": run_intervention_phase(intervention, storage, stub, datetime.now(JST), args.verbose),
+            "stub": dict(stub.state.counts),
+        }
+        print_report(report)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"\n結果を {args.json} に保存しました。")
@@ -0,0 +1,368 @@
+"""
+Fitbit API（intraday・端末一覧・トークン更新）と Slack の chat.postMessage を模したローカルのスタブサーバ。
+負荷試験（benchmarks/load_test.py）から使うほか、単体でも起動できる。
+
+    python benchmarks/stub_apis.py --port 8080 --latency-ms 80 --expire-rate 0.05 --rate-limit 150
+    FITBIT_API_BASE=http://127.0.0.1:8080 SLACK_API_BASE=http://127.0.0.1:8080/api python core/fetch_and_save.py
+
+対応するリクエスト:
+    GET  /1/user/-/activities/{resource}/date/{date}/1d/{detail}[/time/{HH:MM}/{HH:MM}].json
+    GET  /1/user/-/devices.json（最後の同期時刻は現在時刻）
+    POST /oauth2/token（grant_type=refresh_token）
+    POST /api/chat.postMessage
+    GET  /_stats（リクエスト数と応答の内訳）
+
+トークンは "access-{ユーザ}-{世代}" / "refresh-{ユーザ}-{世代}" の形式（issue_tokens で発行する）。
+知らないトークンは新しいユーザとして受け付ける。更新すると古いアクセストークンは 401 になり、
+使用済みのリフレッシュトークンは 400 (invalid_grant) になる（Fitbit と同じく1回しか使えない）。
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import synthetic
+
+# 日本時間のタイムゾーン（Fitbit のデータの日付と時刻はユーザのタイムゾーン）
+JST = timezone(timedelta(hours=9))
+
+# intraday のエンドポイント
+INTRADAY_PATH = re.compile(
+    r"^/1/user/-/activities/(?P<resource>\w+)/date/(?P<date>\d{4}-\d{2}-\d{2})/1d/(?P<detail>\w+)"
+    r"(?:/time/(?P<start>\d{2}:\d{2})/(?P<end>\d{2}:\d{2}))?\.json$"
+)
+
+# 端末一覧のエンドポイント
+DEVICES_PATH = "/1/user/-/devices.json"
+
+
+class StubConfig:
+    """
+    スタブの応答の設定。
+    latency_ms / jitter_ms: 応答までの遅延（平均と揺らぎ。Slack は slack_latency_ms）
+    expire_rate: 有効なアクセストークンでのリクエストが期限切れ（401）になる確率
+    token_ttl: アクセストークンの有効期間（秒）
+    rate_limit / rate_window: ユーザごとのリクエスト数の上限と時間枠（秒）。超えると 429
+    error_rate: intraday・端末一覧のリクエストが 503 になる確率
+    slack_error_rate: Slack への送信が 429 (ratelimited) になる確率
+    """
+
+    def __init__(self, latency_ms=50.0, jitter_ms=20.0, slack_latency_ms=80.0, expire_rate=0.0, token_ttl=28800,
+                 rate_limit=150, rate_window=3600, error_rate=0.0, slack_error_rate=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.slack_latency_ms = slack_latency_ms
+        self.expire_rate = expire_rate
+        self.token_ttl = token_ttl
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.error_rate = error_rate
+        self.slack_error_rate = slack_error_rate
+        self.seed = seed
+
+
+class StubState:
+    """
+    ユーザごとのトークン・レート制限の状態と、応答の集計。
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.Lock()
+        self._random = random.Random(config.seed)
+        self._users = {}
+        self.counts = {}
+
+    # 応答を集計する（例: "intraday 200", "token 400"）
+    def count(self, kind, status):
+        key = f"{kind} {status}"
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def chance(self, rate):
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def delay(self, mean_ms):
+        with self._lock:
+            jitter = self._random.uniform(-self.config.jitter_ms, self.config.jitter_ms)
+        time.sleep(max(mean_ms + jitter, 0) / 1000)
+
+    def _user(self, user):
+        state = self._users.get(user)
+        if state is None:
+            state = {"generation": 0, "access": None, "refresh": None, "issued_at": 0.0,
+                     "window_start": time.time(), "used": 0}
+            self._users[user] = state
+        return state
+
+    # ユーザの新しいトークンを発行する（古いトークンは使えなくなる）
+    def issue_tokens(self, user):
+        with self._lock:
+            state = self._user(user)
+            state["generation"] += 1
+            state["access"] = f"access-{user}-{state['generation']}"
+            state["refresh"] = f"refresh-{user}-{state['generation']}"
+            state["issued_at"] = time.time()
+            return {
+                "access_token": state["access"],
+                "refresh_token": state["refresh"],
+                "expires_in": self.config.token_ttl,
+                "token_type": "Bearer",
+                "user_id": user,
+            }
+
+    # アクセストークンを確認する（有効ならユーザを返す）
+    def authorize(self, access_token):
+        user = _token_user(access_token, "access")
+        with self._lock:
+            state = self._user(user)
+            if state["access"] is None:
+                # 知らないユーザは、このトークンを発行済みとして受け付ける
+                state["access"] = access_token
+                state["issued_at"] = time.time()
+            if access_token != state["access"] or time.time() - state["issued_at"] > self.config.token_ttl:
+                return None
+            return user
+
+    # 期限切れにしたアクセストークンを無効にする
+    def expire(self, user):
+        with self._lock:
+            self._user(user)["issued_at"] = 0.0
+
+    # リフレッシュトークンを確認する
+    def can_refresh(self, refresh_token):
+        user = _token_user(refresh_token, "refresh")
+        with self._lock:
+            state = self._user(user)
+            if state["refresh"] is None:
+                state["refresh"] = refresh_token
+            return user if refresh_token == state["refresh"] else None
+
+    # レート制限の残数を1つ使い、(許可するか, 応答ヘッダ) を返す
+    def consume(self, user):
+        with self._lock:
+            state = self._user(user)
+            now = time.time()
+            if now - state["window_start"] >= self.config.rate_window:
+                state["window_start"] = now
+                state["used"] = 0
+            allowed = state["used"] < self.config.rate_limit
+            if allowed:
+                state["used"] += 1
+            reset = max(int(state["window_start"] + self.config.rate_window - now), 1)
+            headers = {
+                "Fitbit-Rate-Limit-Limit": str(self.config.rate_limit),
+                "Fitbit-Rate-Limit-Remaining": str(self.config.rate_limit - state["used"]),
+                "Fitbit-Rate-Limit-Reset": str(reset),
+            }
+            if not allowed:
+                headers["Retry-After"] = str(reset)
+            return allowed, headers
+
+
+# トークンからユーザを取り出す（"access-{ユーザ}-{世代}" 以外の形式はトークン自体をユーザとみなす）
+def _token_user(token, kind):
+    if token.startswith(f"{kind}-"):
+        return token[len(kind) + 1:].rsplit("-", 1)[0]
+    return token
+
+
+# intraday のレスポンスを作成する（同じユーザ・日付・データタイプなら同じ値になる）
+def intraday_payload(user, resource, date_str, start, end, seed=0):
+    interval = synthetic.INTERVALS.get(resource, 60)
+    day = date.fromisoformat(date_str)
+    if start is None:
+        seconds = np.arange(0, 86400, interval)
+    else:
+        start_hour, start_minute = (int(part) for part in start.split(":"))
+        end_hour, end_minute = (int(part) for part in end.split(":"))
+        seconds = np.arange(start_hour * 3600 + start_minute * 60, end_hour * 3600 + end_minute * 60 + 60, interval)
+        # 現在時刻より後のデータはまだ同期されていない
+        now = datetime.now(JST)
+        if day == now.date():
+            seconds = seconds[seconds <= now.hour * 3600 + now.minute * 60 + now.second]
+    rng = np.random.default_rng(zlib.crc32(f"{seed}:{user}:{resource}:{date_str}".encode()))
+    data_type = resource if resource in synthetic.INTERVALS else "steps"
+    payload = synthetic.day_payload(data_type, day, seconds, rng)
+    return {
+        f"activities-{resource}": payload[f"activities-{data_type}"],
+        f"activities-{resource}-intraday": payload[f"activities-{data_type}-intraday"],
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep-alive でコネクションを再利用させる
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length).decode() if length else ""
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/_stats":
+            return self._send(200, self.state.counts)
+        match = INTRADAY_PATH.match(path)
+        kind = "intraday" if match else "devices" if path == DEVICES_PATH else None
+        if kind is None:
+            return self._send(404, {"errors": [{"errorType": "not_found", "message": path}]})
+
+        config = self.state.config
+        self.state.delay(config.latency_ms)
+        auth = self.headers.get("Authorization", "")
+        user = self.state.authorize(auth.removeprefix("Bearer "))
+        if user is None:
+            self.state.count(kind, 401)
+            return self._send(401, {"errors": [{"errorType": "expired_token", "message": "Access token expired"}]})
+
+        allowed, headers = self.state.consume(user)
+        if not allowed:
+            self.state.count(kind, 429)
+            return self._send(429, {"errors": [{"errorType": "system", "message": "Too Many Requests"}]}, headers)
+        if self.state.chance(config.expire_rate):
+            self.state.expire(user)
+            self.state.count(kind, 401)
+            return self._send(401, {"errors": [{"errorType": "expired_token", "message": "Access token expired"}]}, headers)
+        if self.state.chance(config.error_rate):
+            self.state.count(kind, 503)
+            return self._send(503, {"errors": [{"errorType": "system", "message": "Service Unavailable"}]}, headers)
+
+        if kind == "devices":
+            # スタブの intraday は現在時刻までのデータを返すため、常に現在時刻に同期済みとする
+            payload = [{"id": f"device-{user}", "type": "TRACKER", "deviceVersion": "Stub",
+                        "lastSyncTime": datetime.now(JST).strftime("%Y-%m-%dT%H:%M:%S.000")}]
+        else:
+            payload = intraday_payload(user, match["resource"], match["date"], match["start"], match["end"], config.seed)
+        self.state.count(kind, 200)
+        self._send(200, payload, headers)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._read_body()
+        if path == "/oauth2/token":
+            self.state.delay(self.state.config.latency_ms)
+            form = {key: values[0] for key, values in parse_qs(body).items()}
+            user = self.state.can_refresh(form.get("refresh_token", "")) \
+                if form.get("grant_type") == "refresh_token" and self.headers.get("Authorization") else None
+            if user is None:
+                self.state.count("token", 400)
+                return self._send(400, {"errors": [{"errorType": "invalid_grant", "message": "Refresh token invalid"}]})
+            self.state.count("token", 200)
+            return self._send(200, self.state.issue_tokens(user))
+
+        if path == "/api/chat.postMessage":
+            self.state.delay(self.state.config.slack_latency_ms)
+            message = json.loads(body or "{}")
+            if self.state.chance(self.state.config.slack_error_rate):
+                self.state.count("slack", 429)
+                return self._send(429, {"ok": False, "error": "ratelimited"}, {"Retry-After": "1"})
+            self.state.count("slack", 200)
+            return self._send(200, {"ok": True, "channel": message.get("channel"), "ts": f"{time.time():.6f}"})
+
+        self._send(404, {"ok": False, "error": "unknown_method"})
+
+
+class StubServer:
+    """
+    バックグラウンドのスレッドでスタブを起動する。
+
+        with StubServer(StubConfig(latency_ms=100)) as stub:
+            stub.fitbit_base, stub.slack_base
+    """
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.state = StubState(config or StubConfig())
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = self.state
+        self._thread = None
+
+    @property
+    def fitbit_base(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def slack_base(self):
+        return f"{self.fitbit_base}/api"
+
+    # これまでに受けたリクエスト数（/_stats を除く）
+    def request_count(self):
+        return sum(self.state.counts.values())
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# コマンドライン引数から設定を作成する（load_test.py と共通）
+def add_config_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Fitbit の応答の平均遅延（ミリ秒）")
+    parser.add_argument("--jitter-ms", type=float, default=20.0, help="遅延の揺らぎ（ミリ秒）")
+    parser.add_argument("--slack-latency-ms", type=float, default=80.0, help="Slack の応答の平均遅延（ミリ秒）")
+    parser.add_argument("--expire-rate", type=float, default=0.0, help="アクセストークンが期限切れ (401) になる確率")
+    parser.add_argument("--token-ttl", type=int, default=28800, help="アクセストークンの有効期間（秒）")
+    parser.add_argument("--rate-limit", type=int, default=150, help="ユーザごとの時間枠あたりのリクエスト数")
+    parser.add_argument("--rate-window", type=int, default=3600, help="レート制限の時間枠（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="intraday・端末一覧が 503 になる確率")
+    parser.add_argument("--slack-error-rate", type=float, default=0.0, help="Slack が 429 になる確率")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+
+
+def config_from_args(args):
+    return StubConfig(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, slack_latency_ms=args.slack_latency_ms,
+        expire_rate=args.expire_rate, token_ttl=args.token_ttl, rate_limit=args.rate_limit,
+        rate_window=args.rate_window, error_rate=args.error_rate, slack_error_rate=args.slack_error_rate,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fitbit API と Slack のスタブサーバ")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer(config_from_args(args), args.host, args.port)
+    print(f"FITBIT_API_BASE={server.fitbit_base} SLACK_API_BASE={server.slack_base}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,103 @@
+"""
+ベンチマーク用の Fitbit API のレスポンスを模した合成データ（シードを固定しているため毎回同じデータになる）。
+
+    heart: 1秒間隔の心拍数（ランダムウォーク）
+    steps: 1分間隔の歩数（歩行のまとまりがある。calories / distance / floors も同じ形で作る）
+    minutesSedentary: 1分間隔の座位（0 / 1 が続く）
+
+期間は DURATIONS のキー（"1h", "1d", "7d", "30d"）で指定し、1日ごとのレスポンスのリストを返す。
+"1h" は 10:00 ~ 10:59 の1時間分。
+"""
+from datetime import date, timedelta
+import numpy as np
+
+# 期間（1時間は1日分のレスポンスの一部として扱う）
+DURATIONS = {
+    "1h": timedelta(hours=1),
+    "1d": timedelta(days=1),
+    "7d": timedelta(days=7),
+    "30d": timedelta(days=30),
+}
+
+# データタイプごとのデータ点の間隔（秒）
+INTERVALS = {
+    "heart": 1,
+    "steps": 60,
+    "calories": 60,
+    "distance": 60,
+    "floors": 60,
+    "minutesSedentary": 60,
+}
+
+# 合成データの開始日
+START_DATE = date(2025, 1, 1)
+
+# "1h" のときの開始時刻（時）
+HOUR_START = 10
+
+
+# 0時からの秒数の配列を "HH:MM:SS" のリストにする
+def _format_times(seconds):
+    return [f"{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}" for second in seconds.tolist()]
+
+
+# 1日分（または1時間分）の値を作成する
+def _values(rng, data_type, size):
+    if data_type == "heart":
+        steps = rng.integers(-2, 3, size=size)
+        return np.clip(70 + np.cumsum(steps), 45, 180)
+    if data_type == "minutesSedentary":
+        # 座位（1が続く時間と0が続く時間が交互にある）
+        return np.repeat(rng.random(size // 30 + 1) < 0.7, 30)[:size].astype(np.int64)
+    # 歩行中（約2割の時間）だけ歩数がある
+    walking = np.repeat(rng.random(size // 10 + 1) < 0.2, 10)[:size]
+    return np.where(walking, rng.integers(60, 120, size=size), rng.integers(0, 5, size=size) * (rng.random(size) < 0.1))
+
+
+# 1日分のレスポンスを作成する
+def day_payload(data_type, day, seconds, rng):
+    values = _values(rng, data_type, len(seconds))
+    dataset = [{"time": time, "value": int(value)} for time, value in zip(_format_times(seconds), values.tolist())]
+    return {
+        f"activities-{data_type}": [{"dateTime": day.isoformat(), "value": str(int(values.sum()))}],
+        f"activities-{data_type}-intraday": {
+            "dataset": dataset,
+            "datasetInterval": INTERVALS[data_type],
+            "datasetType": "second" if INTERVALS[data_type] == 1 else "minute",
+        },
+    }
+
+
+# 期間分の1日ごとのレスポンスのリストを作成する
+def payloads(data_type, duration, seed=0):
+    rng = np.random.default_rng(seed)
+    interval = INTERVALS[data_type]
+    span = DURATIONS[duration]
+    if span < timedelta(days=1):
+        start = HOUR_START * 3600
+        seconds = np.arange(start, start + int(span.total_seconds()), interval)
+        return [day_payload(data_type, START_DATE, seconds, rng)]
+    seconds = np.arange(0, 86400, interval)
+    return [day_payload(data_type, START_DATE + timedelta(days=i), seconds, rng) for i in range(span.days)]
+
+
+# 複数ユーザ分のレスポンスを作成する（ユーザごとにシードを変える）
+def user_payloads(data_type, duration, users, seed=0):
+    return {f"user{i:03d}": payloads(data_type, duration, seed + i) for i in range(users)}
+
+
+# レスポンスを保存済みのデータ点 [{"date", "time", "value"}] の形式にする
+def to_points(day_payloads, data_type):
+    points = []
+    for payload in day_payloads:
+        day = payload[f"activities-{data_type}"][0]["dateTime"]
+        points.extend(
+            {"date": day, "time": data_point["time"], "value": float(data_point["value"])}
+            for data_point in payload[f"activities-{data_type}-intraday"]["dataset"]
+        )
+    return points
+
+
+# 介入の記録を作成する（グラフの介入点の計算に使う）
+def interventions(hours=(9, 13, 17, 21)):
+    return [{"time": f"{hour:02d}:00:00", "message": "順調です！この調子で続けていきましょう 💪😊"} for hour in hours]
@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import pandas as pd
+from datetime import datetime, timedelta, timezone
+from compact_storage import BUCKET_COLLECTION, RAW_COLLECTION, decode_bucket
+from endpoints import DATA_TYPES
+from firebase_auth import initialize_firestore
+from intervention_history import query_all_experiments
+from rollups import paginate
+from transform_kernels import format_times
+
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+# 分析用のローカルの保存先（Parquet を実験ID・データタイプ・日付で分割して保存する）
+# {MIRROR_DIR}/activity/experiment_id=.../data_type=.../date=.../data.parquet
+# {MIRROR_DIR}/daily_summary/experiment_id=.../data_type=.../date=.../data.parquet
+# {MIRROR_DIR}/interventions/experiment_id=.../date=.../data.parquet
+# {MIRROR_DIR}/participants.parquet
+MIRROR_DIR = os.environ.get("ANALYSIS_MIRROR_DIR", "analysis_mirror")
+
+# 同期済みの時刻を保存するファイル（次回はこの時刻以降に更新されたドキュメントだけを取得する）
+STATE_FILE = "_sync_state.json"
+
+# 1回に取得するドキュメント数（ページごとに Parquet に書き出して同期済みの時刻を保存する）
+PAGE_SIZE = 500
+
+# 同じデータ点を表す列（再同期や "both" 形式で重複した行は新しいものを残す）
+ACTIVITY_KEYS = ["user_id", "time"]
+# 日次集計はドキュメントIDでも区別する（以前の日次集計は自動IDで user_id を持たないため）
+SUMMARY_KEYS = ["user_id", "summary_id"]
+INTERVENTION_KEYS = ["record_id"]
+
+# 参加者の情報として同期するフィールド（トークンなどの秘密情報は同期しない）
+# group はアカウント作成画面で選択した実験の群。それ以前に登録した参加者は group がないため、
+# analysis_queries.connect に群の対応表（CSV）を渡して補う
+PARTICIPANT_FIELDS = ["experiment_id", "group"]
+
+
+# 同期済みの時刻を読み込む
+def load_state(root):
+    path = os.path.join(root, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {key: datetime.fromisoformat(value) for key, value in json.load(f).items()}
+
+
+# 同期済みの時刻を保存する
+def save_state(root, state):
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({key: value.isoformat() for key, value in state.items()}, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+# パーティションのディレクトリを返す
+def partition_dir(root, table, **partitions):
+    return os.path.join(root, table, *(f"{key}={value}" for key, value in partitions.items()))
+
+
+# パーティションに行を追加する（既存の行とマージし、同じキーの行は新しいものを残す）
+def write_partition(directory, rows, keys):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "data.parquet")
+    df = pd.DataFrame(rows)
+    if os.path.exists(path):
+        df = pd.concat([pd.read_parquet(path), df], ignore_index=True)
+    keys = list(keys)
+    # キーの列がない行（古い形式のドキュメント）は None として扱う
+    df = df.reindex(columns=list(df.columns) + [key for key in keys if key not in df.columns])
+    df = df.drop_duplicates(subset=keys, keep="last").sort_values(keys).reset_index(drop=True)
+    # 書き込み途中で中断しても壊れたファイルが残らないように、一時ファイルから置き換える
+    df.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    return len(df)
+
+
+# 活動データのドキュメントを行に変換する
+def activity_rows(root_collection, data):
+    if root_collection == BUCKET_COLLECTION:
+        offsets, values = decode_bucket(data)
+        seconds = data["hour"] * 3600 + offsets
+        return [
+            {"user_id": data.get("user_id"), "time": time, "second": int(second), "value": value}
+            for time, second, value in zip(format_times(seconds), seconds.tolist(), values.tolist())
+        ]
+    hours, minutes, seconds = (int(part) for part in data["time"].split(":"))
+    return [{
+        "user_id": data.get("user_id"),
+        "time": data["time"],
+        "second": hours * 3600 + minutes * 60 + seconds,
+        "value": data["value"],
+    }]
+
+
+# ページ内の行をパーティションごとに書き出す
+def flush(root, partitions):
+    written = 0
+    for (table, keys, partition), rows in partitions.items():
+        written += len(rows)
+        write_partition(partition_dir(root, table, **dict(partition)), rows, keys)
+    partitions.clear()
+    return written
+
+
+# 1つのデータタイプの活動データと日次集計を同期する
+def sync_data_type(db, root, state, data_type, page_size=PAGE_SIZE):
+    """
+    コレクショングループクエリで activity_buckets・activity_data・daily_summary を1回で読み込み、
+    ドキュメントのパスでどのコレクションかを判定する。
+    ※ コレクショングループでの timestamp の単一フィールドインデックスを有効にしておくこと。
+    """
+    state_key = f"activity:{data_type}"
+    query = db.collection_group(data_type)
+    if state_key in state:
+        # 同じ時刻に書き込まれたドキュメントを取りこぼさないよう、同じ時刻から取得し直す（重複は書き出し時に除く）
+        query = query.where("timestamp", ">=", state[state_key])
+    query = query.order_by("timestamp")
+
+    partitions = {}
+    synced = 0
+    last = None
+    for count, doc in enumerate(paginate(query, page_size), start=1):
+        root_collection, experiment_id = doc.reference.path.split("/")[:2]
+        data = doc.to_dict()
+        last = data["timestamp"]
+        if root_collection in (BUCKET_COLLECTION, RAW_COLLECTION):
+            partition = (("experiment_id", experiment_id), ("data_type", data_type), ("date", data["date"]))
+            partitions.setdefault(("activity", tuple(ACTIVITY_KEYS), partition), []) \
+                .extend(activity_rows(root_collection, data))
+        elif root_collection == "daily_summary":
+            partition = (("experiment_id", experiment_id), ("data_type", data_type), ("date", data["date"]))
+            summary = {"user_id": None, "summary_id": doc.id}
+            summary.update({key: value for key, value in data.items()
+                            if key not in ("experiment_id", "data_type", "date", "timestamp")})
+            partitions.setdefault(("daily_summary", tuple(SUMMARY_KEYS), partition), []).append(summary)
+
+        # ページごとに書き出して同期済みの時刻を保存する（中断しても次回はここから再開する）
+        if count % page_size == 0:
+            synced += flush(root, partitions)
+            state[state_key] = last
+            save_state(root, state)
+    synced += flush(root, partitions)
+    if last is not None:
+        state[state_key] = last
+        save_state(root, state)
+    return synced
+
+
+# 介入記録を同期する
+def sync_interventions(db, root, state, now=None):
+    """
+    前回同期した最後の記録の時刻から現在までの全実験の介入記録を query_all_experiments で取得する。
+    再実行で同じ時間帯の記録を書き直した場合も記録の時刻が進むため取得し直される（重複は記録IDで除く）。
+    """
+    state_key = "interventions"
+    start = state.get(state_key, datetime.fromtimestamp(0, JST))
+    records = query_all_experiments(db, start, now or datetime.now(JST))
+
+    partitions = {}
+    for data in records:
+        partition = (("experiment_id", data["experiment_id"]), ("date", data["date"]))
+        record = {key: value for key, value in data.items() if key not in ("experiment_id", "date", "created_at")}
+        partitions.setdefault(("interventions", tuple(INTERVENTION_KEYS), partition), []).append(record)
+    synced = flush(root, partitions)
+    if records:
+        state[state_key] = records[-1]["timestamp"]
+        save_state(root, state)
+    return synced
+
+
+# 参加者の実験IDとグループを同期する（件数が少ないため毎回すべて取得し直す）
+def sync_participants(db, root):
+    users = db.collection("users").select(PARTICIPANT_FIELDS).stream()
+    rows = [{field: user.to_dict().get(field) for field in PARTICIPANT_FIELDS} for user in users]
+    os.makedirs(root, exist_ok=True)
+    pd.DataFrame(rows, columns=PARTICIPANT_FIELDS).to_parquet(os.path.join(root, "participants.parquet"), index=False)
+    return len(rows)
+
+
+# Firestore のデータをローカルの Parquet に同期する
+def run_sync(db, root=MIRROR_DIR, data_types=DATA_TYPES, restart=False):
+    state = {} if restart else load_state(root)
+    results = {"participants": sync_participants(db, root)}
+    for data_type in data_types:
+        results[data_type] = sync_data_type(db, root, state, data_type)
+        print(f"{data_type}: {results[data_type]} 行を同期しました。")
+    results["interventions"] = sync_interventions(db, root, state)
+    print(f"同期が完了しました: {results}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Firestoreのデータを分析用のParquetファイルに同期する")
+    parser.add_argument("--output", default=MIRROR_DIR, help="保存先のディレクトリ")
+    parser.add_argument("--data-types", nargs="+", default=DATA_TYPES, help="対象のデータタイプ")
+    parser.add_argument("--restart", action="store_true", help="同期済みの時刻を無視してすべて取得し直す")
+    args = parser.parse_args()
+
+    run_sync(initialize_firestore(), args.output, args.data_types, args.restart)
@@ -0,0 +1,137 @@
+import argparse
+import glob
+import math
+import os
+from analysis_mirror import MIRROR_DIR
+
+# duckdb は分析のときだけ使うため、必要になった時点でインポートする（pip install duckdb）
+
+
+# 同期した Parquet をテーブルとして参照できる DuckDB の接続を作成する
+def connect(root=MIRROR_DIR, groups_file=None):
+    """
+    activity / daily_summary / interventions / participants のビューを作成する（同期していないものは作成しない）。
+    パーティションの列（experiment_id, data_type, date）はディレクトリ名から読み込まれる。
+    groups_file は実験IDと群の対応表の CSV（列: experiment_id, group）。指定した場合はユーザ情報の group より優先する
+    （group はアカウント作成時に保存するため、それ以前に登録した参加者はこの対応表で群を指定する）。
+    """
+    import duckdb
+
+    con = duckdb.connect()
+    for table in ("activity", "daily_summary", "interventions"):
+        pattern = os.path.join(root, table, "**", "*.parquet")
+        if not glob.glob(pattern, recursive=True):
+            continue
+        con.execute(
+            f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{pattern}', hive_partitioning = true, union_by_name = true)"
+        )
+    participants = f"read_parquet('{os.path.join(root, 'participants.parquet')}')"
+    if groups_file is None:
+        con.execute(f"CREATE VIEW participants AS SELECT * FROM {participants}")
+    else:
+        con.execute(f"""
+            CREATE VIEW participants AS
+            SELECT experiment_id, COALESCE(g."group", p."group") AS "group"
+            FROM {participants} p
+            FULL OUTER JOIN read_csv('{groups_file}', header = true, all_varchar = true) g USING (experiment_id)
+        """)
+    return con
+
+
+# 実験ID・日ごとの合計と平均（歩数やカロリーの1日の合計など）
+def daily_totals(con, data_type="steps", start_date=None, end_date=None):
+    return con.execute("""
+        SELECT experiment_id, CAST(date AS VARCHAR) AS date, SUM(value) AS total, AVG(value) AS mean, COUNT(*) AS count
+        FROM activity
+        WHERE data_type = ?
+          AND (? IS NULL OR CAST(date AS VARCHAR) >= ?)
+          AND (? IS NULL OR CAST(date AS VARCHAR) <= ?)
+        GROUP BY ALL
+        ORDER BY experiment_id, date
+    """, [data_type, start_date, start_date, end_date, end_date]).df()
+
+
+# 時間帯ごとの平均（運動のタイミングの分析）
+def hourly_profile(con, data_type="steps", start_date=None, end_date=None):
+    return con.execute("""
+        SELECT p."group", experiment_id, second // 3600 AS hour, AVG(value) AS mean, SUM(value) AS total
+        FROM activity
+        LEFT JOIN participants p USING (experiment_id)
+        WHERE data_type = ?
+          AND (? IS NULL OR CAST(date AS VARCHAR) >= ?)
+          AND (? IS NULL OR CAST(date AS VARCHAR) <= ?)
+        GROUP BY ALL
+        ORDER BY p."group", experiment_id, hour
+    """, [data_type, start_date, start_date, end_date, end_date]).df()
+
+
+# グループ間の比較（参加者ごとの1日の合計の平均を比較する Welch の t 検定）
+def group_comparison(con, data_type="steps", start_date=None, end_date=None):
+    """
+    参加者ごとに期間中の1日の合計の平均を求め、グループ（A: 通知のみ / B: 通知＋可視化）ごとに
+    平均・標準偏差・人数を集計する。グループが2つの場合は Welch の t 値と自由度も返す。
+    """
+    per_group = con.execute("""
+        WITH per_day AS (
+            SELECT experiment_id, date, SUM(value) AS total
+            FROM activity
+            WHERE data_type = ?
+              AND (? IS NULL OR CAST(date AS VARCHAR) >= ?)
+              AND (? IS NULL OR CAST(date AS VARCHAR) <= ?)
+            GROUP BY ALL
+        ), per_participant AS (
+            SELECT experiment_id, AVG(total) AS daily_total FROM per_day GROUP BY ALL
+        )
+        SELECT p."group", AVG(daily_total) AS mean, STDDEV_SAMP(daily_total) AS std, COUNT(*) AS n
+        FROM per_participant JOIN participants p USING (experiment_id)
+        WHERE p."group" IS NOT NULL
+        GROUP BY ALL
+        ORDER BY p."group"
+    """, [data_type, start_date, start_date, end_date, end_date]).df()
+
+    result = {"groups": per_group, "t": None, "df": None}
+    if len(per_group) == 2 and (per_group["n"] > 1).all():
+        a, b = per_group.iloc[0], per_group.iloc[1]
+        va, vb = a["std"] ** 2 / a["n"], b["std"] ** 2 / b["n"]
+        if va + vb > 0:
+            result["t"] = (a["mean"] - b["mean"]) / math.sqrt(va + vb)
+            result["df"] = (va + vb) ** 2 / (va ** 2 / (a["n"] - 1) + vb ** 2 / (b["n"] - 1))
+    return result
+
+
+# 介入前後の変化（介入の前後 window_minutes 分の平均を比較する）
+def intervention_response(con, data_type="steps", window_minutes=60):
+    return con.execute("""
+        WITH i AS (
+            SELECT experiment_id, CAST(date AS VARCHAR) AS date, record_id, outcome, message,
+                   CAST(substr(time, 1, 2) AS INTEGER) * 3600 + CAST(substr(time, 4, 2) AS INTEGER) * 60
+                   + CAST(substr(time, 7, 2) AS INTEGER) AS second
+            FROM interventions
+        )
+        SELECT i.experiment_id, i.date, i.record_id, i.outcome, i.message,
+               AVG(a.value) FILTER (WHERE a.second < i.second) AS mean_before,
+               AVG(a.value) FILTER (WHERE a.second >= i.second) AS mean_after
+        FROM i
+        JOIN activity a
+          ON a.experiment_id = i.experiment_id
+         AND CAST(a.date AS VARCHAR) = i.date
+         AND a.data_type = ?
+         AND a.second BETWEEN i.second - ? AND i.second + ?
+        GROUP BY ALL
+        ORDER BY i.experiment_id, i.date
+    """, [data_type, window_minutes * 60, window_minutes * 60]).df()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="同期したParquetファイルを使って標準の分析を行う")
+    parser.add_argument("--input", default=MIRROR_DIR, help="同期先のディレクトリ")
+    parser.add_argument("--data-type", default="steps", help="対象のデータタイプ")
+    parser.add_argument("--start", help="開始日 (YYYY-MM-DD)")
+    parser.add_argument("--end", help="終了日 (YYYY-MM-DD)")
+    parser.add_argument("--groups", help="実験IDと群の対応表の CSV（列: experiment_id, group）")
+    args = parser.parse_args()
+
+    con = connect(args.input, args.groups)
+    comparison = group_comparison(con, args.data_type, args.start, args.end)
+    print(comparison["groups"])
+    print(f"Welch t = {comparison['t']}, df = {comparison['df']}")
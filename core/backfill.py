@@ -0,0 +1,128 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from fetch_and_save import ENDPOINTS, build_day_endpoint, fetch_with_token_renewal, get_user_last_sync, load_user, save_activity_data
+from rate_limiter import RATE_LIMITER, RateLimitExceeded
+from storage import get_storage, progress_id
+from watermark import JST, is_complete_day
+
+# 並列に処理するタスク（ユーザ×日付×データタイプ）の数
+MAX_WORKERS = 8
+
+# 定期実行のために残しておくレート制限の残数（1回の定期実行で6リクエスト × 2回分）
+RATE_LIMIT_RESERVE = 12
+
+# レート制限の回復を待つ最大秒数。これより先にしか回復しない組み合わせは失敗として終了する
+MAX_WAIT_SECONDS = 3600
+
+
+# 開始日から終了日までの日付のリストを作成する
+def date_range(start_date, end_date):
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end - start).days + 1)]
+
+
+# 1ユーザ・1日・1データタイプ分を取得して保存する
+def backfill_day(storage, user, endpoint_info, date):
+    data_type = endpoint_info["data_type"]
+    endpoint = build_day_endpoint(endpoint_info, date)
+    activity_data = fetch_with_token_renewal(storage, user, endpoint, reserve=RATE_LIMIT_RESERVE)
+
+    # 定期実行と同じ変換（5秒リサンプリング・1時間集計）を通して保存する
+    written = save_activity_data(storage, user["user_id"], user["experiment_id"], data_type, activity_data, user["slack_dm_id"])
+
+    # 再実行時に完了済みの日をスキップするため、進捗を記録する
+    # （端末がまだ同期していない日は途中までのデータなので、再実行時に取得し直す）
+    if is_complete_day(date, get_user_last_sync(storage, user), datetime.now(JST)):
+        storage.mark_backfill_done(user["experiment_id"], data_type, date, written)
+    # 他のプロセス（定期実行）とレート制限の残数を共有する
+    RATE_LIMITER.save_state(storage, [user["user_id"]])
+    return written
+
+
+# 指定したユーザ・データタイプ・期間のデータを取得して保存する
+def run_backfill(storage, experiment_ids, data_types, start_date, end_date, max_workers=MAX_WORKERS, restart=False,
+                 max_wait=MAX_WAIT_SECONDS):
+    """
+    ユーザ×日付×データタイプの組み合わせを並列に処理する。
+    完了した組み合わせはストレージに記録し、restart=False の場合はスキップする。
+    レート制限の残数がない組み合わせはワーカーで待たずに後回しにし、
+    全体が一巡してから残数の回復を待って（max_wait 秒まで）取得し直す。
+    """
+    user_records = [(experiment_id, storage.get_user(experiment_id)) for experiment_id in experiment_ids]
+    users = [load_user(user_id, user_data) for user_id, user_data in user_records if user_data is not None]
+    endpoints = [endpoint_info for endpoint_info in ENDPOINTS if endpoint_info["data_type"] in data_types]
+    dates = date_range(start_date, end_date)
+    RATE_LIMITER.load_state(storage, [user["user_id"] for user in users])
+
+    completed = set() if restart else storage.load_backfill_progress(experiment_ids)
+    # 同じユーザのリクエストが固まらないよう、日付ごとにユーザを交互に並べる
+    tasks = [
+        (user, endpoint_info, date)
+        for date in dates
+        for endpoint_info in endpoints
+        for user in users
+        if progress_id(user["experiment_id"], endpoint_info["data_type"], date) not in completed
+    ]
+    total = len(tasks)
+    print(f"バックフィル対象: {total} 件（完了済み {len(completed)} 件をスキップ）")
+
+    started = time.monotonic()
+    done = 0
+    written = 0
+    errors = {}
+    pending = tasks
+    while pending:
+        deferred = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(backfill_day, storage, *task): task for task in pending}
+            for future in as_completed(futures):
+                user, endpoint_info, date = futures[future]
+                key = progress_id(user["experiment_id"], endpoint_info["data_type"], date)
+                try:
+                    written += future.result()
+                    status = f"完了（経過 {time.monotonic() - started:.1f} 秒）"
+                except RateLimitExceeded as e:
+                    deferred.append((futures[future], e.retry_at))
+                    continue
+                except Exception as e:
+                    errors[key] = str(e)
+                    status = f"失敗 {e}"
+                done += 1
+                print(f"[{done}/{total}] {key}: {status}")
+        if not deferred:
+            break
+
+        # 最も早く回復するユーザのリセットまで待ってから、後回しにした組み合わせを取得し直す
+        wait = min(retry_at or 0 for _, retry_at in deferred) - time.time()
+        if wait > max_wait:
+            for (user, endpoint_info, date), _ in deferred:
+                errors[progress_id(user["experiment_id"], endpoint_info["data_type"], date)] = "レート制限の残数が回復しませんでした"
+            print(f"レート制限の回復まで {int(wait)} 秒かかるため、残り {len(deferred)} 件を中断します。")
+            break
+        print(f"レート制限のため {len(deferred)} 件を後回しにしました。{max(int(wait), 0)} 秒後に再開します。")
+        RATE_LIMITER.save_state(storage, [user["user_id"] for user in users])
+        time.sleep(max(wait, 0.1))
+        pending = [task for task, _ in deferred]
+
+    # ダッシュボードのキャッシュを更新させるため、過去の日付のデータを保存した実験の更新時刻を記録する
+    storage.mark_backfilled({user["experiment_id"] for user, _, _ in tasks})
+    print(f"バックフィルが完了しました。保存件数: {written}, 失敗: {len(errors)} 件")
+    return {"tasks": total, "written": written, "errors": errors}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="過去のFitbitデータを取得して保存する")
+    parser.add_argument("--experiment-ids", nargs="+", required=True, help="対象の実験ID")
+    parser.add_argument("--data-types", nargs="+", default=[e["data_type"] for e in ENDPOINTS], help="対象のデータタイプ")
+    parser.add_argument("--start", required=True, help="開始日 (YYYY-MM-DD)")
+    parser.add_argument("--end", required=True, help="終了日 (YYYY-MM-DD)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="並列数")
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT_SECONDS, help="レート制限の回復を待つ最大秒数")
+    parser.add_argument("--restart", action="store_true", help="完了済みの日も取得し直す")
+    args = parser.parse_args()
+
+    run_backfill(get_storage(), args.experiment_ids, args.data_types, args.start, args.end, args.workers, args.restart,
+                 args.max_wait)
@@ -0,0 +1,99 @@
+import math
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from firebase_admin import firestore
+
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+# 時間ごと・日ごとの集計値（ロールアップ）を保存するコレクション名
+# activity_stats/{experiment_id}/{data_type}/{YYYY-MM-DD} に
+# {"hours": {"HH": 統計量}, "day": 統計量} を保存する（統計量は count, mean, m2, sum, min, max）
+STATS_COLLECTION = "activity_stats"
+
+# 介入の基準値に使う時間帯（9:00 ~ 21:59）
+BASELINE_HOURS = range(9, 22)
+
+
+# 値の配列から統計量（件数・平均・偏差平方和・合計・最小・最大）を計算する
+def compute_stats(values):
+    values = np.asarray(values, dtype=np.float64)
+    mean = float(values.mean())
+    return {
+        "count": int(len(values)),
+        "mean": mean,
+        "m2": float(((values - mean) ** 2).sum()),
+        "sum": float(values.sum()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+    }
+
+
+# 2つの統計量を合成する（Welford / Chan の並列アルゴリズム）
+def merge_stats(a, b):
+    if a["count"] == 0:
+        return dict(b)
+    if b["count"] == 0:
+        return dict(a)
+    count = a["count"] + b["count"]
+    delta = b["mean"] - a["mean"]
+    merged = {
+        "count": count,
+        "mean": a["mean"] + delta * b["count"] / count,
+        "m2": a["m2"] + b["m2"] + delta * delta * a["count"] * b["count"] / count,
+    }
+    # 合計・最小・最大がない（古い形式の）統計量と合成した場合は、それらを持たない
+    if all(key in a and key in b for key in ("sum", "min", "max")):
+        merged.update({"sum": a["sum"] + b["sum"], "min": min(a["min"], b["min"]), "max": max(a["max"], b["max"])})
+    return merged
+
+
+# 複数の統計量を合成する
+def merge_all(stats_list):
+    total = {"count": 0, "mean": 0.0, "m2": 0.0}
+    for stats in stats_list:
+        total = merge_stats(total, stats)
+    return total
+
+
+# 十分統計量から平均と標準偏差（不偏）を返す
+def mean_and_std(stats):
+    if stats["count"] == 0:
+        return None, None
+    std = math.sqrt(stats["m2"] / (stats["count"] - 1)) if stats["count"] > 1 else float("nan")
+    return stats["mean"], std
+
+
+# 統計量のドキュメント参照を返す
+def stats_ref(db, experiment_id, data_type, date):
+    return db.collection(STATS_COLLECTION) \
+        .document(experiment_id) \
+        .collection(data_type) \
+        .document(date)
+
+
+# 書き込んだ時間ごとのデータから時間と日のロールアップを更新する
+def update_hourly_stats(db, user_id, experiment_id, data_type, date, hours, writer):
+    """
+    hours は {時: (オフセット秒, 値)} で、その時のすべてのデータ点を含むこと。
+    時ごとの統計量を上書きするため、同じ時間帯を何度取り込んでも二重に数えられない。
+    日の統計量は既存の時ごとの統計量と合わせて計算し直す。
+    """
+    new_hours = {f"{hour:02d}": compute_stats(values) for hour, (_, values) in hours.items() if len(values)}
+    if not new_hours:
+        return
+    ref = stats_ref(db, experiment_id, data_type, date)
+    existing = ref.get()
+    all_hours = existing.to_dict().get("hours", {}) if existing.exists else {}
+    all_hours.update(new_hours)
+
+    writer.set(ref, {
+        "user_id": user_id,
+        "experiment_id": experiment_id,
+        "data_type": data_type,
+        "date": date,
+        "hours": new_hours,
+        "day": merge_all(all_hours.values()),
+        "timestamp": firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+
@@ -0,0 +1,117 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core import exceptions
+
+# Firestoreの1バッチあたりの書き込み上限
+MAX_BATCH_SIZE = 500
+
+# 同時にコミットするバッチ数の上限（これを超えると set() の呼び出し側が待たされる）
+MAX_IN_FLIGHT = 4
+
+# 再試行の設定
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 16.0
+
+# 競合やタイムアウトなど、再試行すれば成功する可能性があるエラー
+RETRYABLE_ERRORS = (
+    exceptions.Aborted,
+    exceptions.DeadlineExceeded,
+    exceptions.ServiceUnavailable,
+    exceptions.ResourceExhausted,
+    exceptions.InternalServerError,
+)
+
+
+class BulkWriteError(Exception):
+    """一部のバッチの書き込みに失敗した場合に送出する例外"""
+
+    def __init__(self, written, errors):
+        super().__init__(f"{len(errors)} 件のバッチの書き込みに失敗しました（成功: {written} 件）: {errors[0]}")
+        self.written = written
+        self.errors = errors
+
+
+class BulkWriter:
+    """
+    書き込みを500件以下のバッチに分割し、複数のバッチを並列にコミットする。
+    close() で残りを書き込み、書き込んだドキュメント数を返す。
+    """
+
+    def __init__(self, db, batch_size=MAX_BATCH_SIZE, max_in_flight=MAX_IN_FLIGHT, max_retries=MAX_RETRIES):
+        self.db = db
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_retries = max_retries
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._futures = []
+        self.written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(wait=True)
+
+    # 書き込みを追加する（バッチサイズに達したらコミットを開始する）
+    def set(self, ref, data, merge=False):
+        with self._lock:
+            self._pending.append((ref, data, merge))
+            if len(self._pending) < self.batch_size:
+                return
+            ops, self._pending = self._pending, []
+        self._submit(ops)
+
+    # バッチのコミットをスレッドプールに投入する
+    def _submit(self, ops):
+        # 実行中のバッチ数が上限に達している場合は空くまで待つ（バックプレッシャー）
+        self._slots.acquire()
+        future = self._executor.submit(self._commit, ops)
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            self._futures.append(future)
+
+    # 1バッチ分をコミットする（一時的なエラーは指数バックオフで再試行する）
+    def _commit(self, ops):
+        for attempt in range(self.max_retries + 1):
+            batch = self.db.batch()
+            for ref, data, merge in ops:
+                batch.set(ref, data, merge=merge)
+            try:
+                batch.commit()
+                return len(ops)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX)
+                print(f"バッチの書き込みを再試行します（{attempt + 1}回目, {delay:.1f}秒後）: {e}")
+                time.sleep(delay * random.uniform(0.5, 1.0))
+
+    # 残りの書き込みをコミットし、全バッチの完了を待つ
+    def close(self):
+        with self._lock:
+            ops, self._pending = self._pending, []
+        if ops:
+            self._submit(ops)
+
+        written = 0
+        errors = []
+        for future in self._futures:
+            try:
+                written += future.result()
+            except Exception as e:
+                errors.append(e)
+        self._futures = []
+        self._executor.shutdown(wait=True)
+
+        self.written += written
+        if errors:
+            raise BulkWriteError(self.written, errors)
+        return self.written
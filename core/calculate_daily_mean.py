@@ -1,71 +1,83 @@
-import pandas as pd
-from firebase_admin import firestore
-from datetime import datetime, timedelta, timezone
-from firebase_auth import initialize_firestore
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from endpoints import DATA_TYPES
+from metrics import METRICS
+from runtime import RunContext
 
-# Firestoreの初期化
-db = initialize_firestore()
+# 1日あたりのデータ点の数（カバー率の計算に使う。指定のないデータタイプは1分ごと）
+POINTS_PER_DAY = {
+    "heart": 86400 // 5,  # 5秒ごとに補間して保存している
+    "minutesSedentary": 24,  # 1時間ごとに集計して保存している
+}
 
-# 日本時間のタイムゾーン
-JST = timezone(timedelta(hours=9))
 
-# 現在の日本時間
-now_jst = datetime.now(JST)
+# 統計量から保存する集計値を作成する
+def summary_from_stats(stats, data_type):
+    count = stats["count"]
+    return {
+        "average_value": stats["mean"],
+        "sum": stats.get("sum", stats["mean"] * count),
+        "min": stats.get("min"),
+        "max": stats.get("max"),
+        "std": math.sqrt(stats["m2"] / (count - 1)) if count > 1 else None,
+        "count": count,
+        "coverage": min(count / POINTS_PER_DAY.get(data_type, 1440), 1.0),
+    }
 
-# 前日の日付を取得
-yesterday = (now_jst - timedelta(days=1)).strftime("%Y-%m-%d")
 
-# 保存先のコレクション名
-DAILY_SUMMARY = "daily_summary"
+# 1つのデータタイプの全実験の1日分を集計する
+def summarize_data_type(storage, data_type, date, experiment_ids):
+    """
+    {(experiment_id, user_id): 集計値} を返す。
+    """
+    with METRICS.stage("aggregate", data_type=data_type) as stage:
+        stats = storage.day_stats_by_user(experiment_ids, data_type, date)
+        stage.add(items=len(stats))
+    return {key: summary_from_stats(value, data_type) for key, value in stats.items()}
+
+
+# 集計値を保存する（同じユーザ・日は同じIDにして、再実行しても重複しないようにする）
+def store_summaries(storage, data_type, date, summaries):
+    with METRICS.stage("write_summaries", data_type=data_type) as stage:
+        written = storage.write_summaries(data_type, date, summaries)
+        stage.add(items=len(summaries))
+    for (experiment_id, _), summary in summaries.items():
+        print(f"{experiment_id} - {data_type}: 平均値 {summary['average_value']} （{summary['count']} 件）を保存しました。")
+    return written
 
-# 取得するデータタイプ
-DATA_TYPES = ["steps", "heart", "calories", "distance", "floors", "active_minutes"]
 
 def calculate_and_store_daily_mean(data, context=None):
     """
-    日次の平均値を計算してFirestoreに保存する
+    日次の集計値を計算して保存する
     """
-    # 全ユーザを取得する
-    users = list(db.collection("users").stream())
-    
-    for user_doc in users:
-        user_data = user_doc.to_dict()
-        experiment_id = user_data.get("experiment_id")
-        print(f"実験ID: {experiment_id}")
-        
-        for data_type in DATA_TYPES:
-            print(f"データタイプ: {data_type}")
-            # Firestoreから前日のデータを取得
-            activity_data_yesterday = db.collection("activity_data") \
-                                        .document(experiment_id) \
-                                        .collection(data_type) \
-                                        .where("date", "==", yesterday) \
-                                        .stream()
-            data = [doc.to_dict() for doc in activity_data_yesterday]
-            print(f"取得データ数: {len(data)}")  # ここでデータ件数を出力
-            
-            if not data:
-                print(f"{experiment_id} - {data_type}: データが見つかりませんでした。")
-                continue
-            
-            # dfに変換する
-            df = pd.DataFrame(data)
-            # 平均値の計算を行う
-            average_value = df["value"].mean()
-            
-            # 結果をFirestoreに保存
-            summury_ref = db.collection(DAILY_SUMMARY) \
-                            .document(experiment_id) \
-                            .collection(data_type) \
-                            .document()
-            summury_ref.set({
-                "date": yesterday,
-                "average_value": average_value,
-                "timestamp": firestore.SERVER_TIMESTAMP
-            })
-            print(f"{experiment_id} - {data_type}: 平均値 {average_value} を保存しました。")
-            
+    # 呼び出し時点の時刻を基準に前日の日付を決める
+    run = RunContext()
+    storage = run.storage
+    yesterday = run.yesterday
+
+    with METRICS.run("daily_summary"):
+        # 集計対象の実験IDを取得する
+        users = storage.list_users(["experiment_id"])
+        experiment_ids = sorted({user_data.get("experiment_id") for _, user_data in users} - {None})
+
+        # データタイプごとに並列に集計する
+        def process(data_type):
+            summaries = summarize_data_type(storage, data_type, yesterday, experiment_ids)
+            return store_summaries(storage, data_type, yesterday, summaries)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=len(DATA_TYPES)) as executor:
+            futures = {executor.submit(process, data_type): data_type for data_type in DATA_TYPES}
+            for future in as_completed(futures):
+                data_type = futures[future]
+                try:
+                    results[data_type] = future.result()
+                except Exception as e:
+                    print(f"{data_type} の集計に失敗しました: {e}")
+                    results[data_type] = str(e)
+
+    print(f"{yesterday} の集計結果: {results}")
     return "ok", 200
 
 if __name__ == "__main__":
-    calculate_and_store_daily_mean()
\ No newline at end of file
+    calculate_and_store_daily_mean(None)
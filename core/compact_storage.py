@@ -0,0 +1,178 @@
+import os
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from firebase_admin import firestore
+from transform_kernels import format_times
+
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+# 1時間分のデータを1ドキュメントにまとめて保存するコレクション名
+# activity_buckets/{experiment_id}/{data_type}/{YYYY-MM-DD}T{HH}
+BUCKET_COLLECTION = "activity_buckets"
+
+# 従来の1データ点1ドキュメントのコレクション名
+RAW_COLLECTION = "activity_data"
+
+# 保存形式: "bucket"（1時間1ドキュメント）/ "raw"（1データ点1ドキュメント）/ "both"
+STORAGE_FORMAT = os.environ.get("ACTIVITY_STORAGE_FORMAT", "bucket")
+
+
+# バケットのドキュメントIDを作成する
+def bucket_id(date, hour):
+    return f"{date}T{hour:02d}"
+
+
+# バケットのドキュメントから (オフセット秒, 値) の配列を取り出す
+def decode_bucket(bucket):
+    offsets = np.frombuffer(bytes(bucket["offsets"]), dtype="<i4").astype(np.int32)
+    values = np.frombuffer(bytes(bucket["values"]), dtype="<f8").astype(np.float64)
+    return offsets, values
+
+
+# 秒数の配列を時ごとの (オフセット秒, 値) に分ける（秒数は昇順であること）
+def group_by_hour(seconds, values):
+    hours = seconds // 3600
+    groups = {}
+    boundaries = np.flatnonzero(np.diff(hours)) + 1
+    for start, end in zip(np.r_[0, boundaries], np.r_[boundaries, len(hours)]):
+        if start == end:
+            continue
+        hour = int(hours[start])
+        groups[hour] = (seconds[start:end] - hour * 3600, values[start:end])
+    return groups
+
+
+# 既存のデータ点と新しいデータ点をマージする（同じオフセットは新しい値を優先する）
+def merge_points(old_offsets, old_values, offsets, values):
+    all_offsets = np.concatenate([old_offsets, offsets])[::-1]
+    all_values = np.concatenate([old_values, values])[::-1]
+    merged_offsets, index = np.unique(all_offsets, return_index=True)
+    return merged_offsets, all_values[index]
+
+
+# バケットのドキュメントの内容を作成する
+def encode_bucket(user_id, experiment_id, data_type, date, hour, offsets, values):
+    return {
+        "user_id": user_id,
+        "experiment_id": experiment_id,
+        "data_type": data_type,
+        "date": date,
+        "hour": hour,
+        "start": datetime.strptime(date, "%Y-%m-%d").replace(hour=hour, tzinfo=JST),
+        "count": len(offsets),
+        # 時の先頭からの秒数と値を並列の配列としてリトルエンディアンのバイト列に詰める
+        "offsets": np.asarray(offsets, dtype="<i4").tobytes(),
+        "values": np.asarray(values, dtype="<f8").tobytes(),
+        "timestamp": firestore.SERVER_TIMESTAMP,
+    }
+
+
+# バケットのドキュメント参照を返す
+def bucket_ref(db, experiment_id, data_type, date, hour):
+    return db.collection(BUCKET_COLLECTION) \
+        .document(experiment_id) \
+        .collection(data_type) \
+        .document(bucket_id(date, hour))
+
+
+# 1日分のデータを時間ごとのバケットにまとめて保存する
+def write_buckets(db, user_id, experiment_id, data_type, date, seconds, values, writer):
+    """
+    seconds は0時からの秒数、values は値の配列（transform_kernels の出力をそのまま渡す）。
+    既に同じ時間のバケットがある場合は既存のデータ点とマージして上書きする。
+    既存のバケットは get_all でまとめて読み込む（時間ごとに読み込むと往復の回数だけ待つため）。
+    書き込みは writer（BulkWriter）に追加し、マージ後の {時: (オフセット秒, 値)} を返す。
+    """
+    groups = group_by_hour(seconds, values)
+    refs = {hour: bucket_ref(db, experiment_id, data_type, date, hour) for hour in groups}
+    # get_all の結果は順不同のため、ドキュメントIDで対応づける
+    existing = {doc.id: doc.to_dict() for doc in db.get_all(list(refs.values())) if doc.exists} if refs else {}
+
+    merged = {}
+    for hour, (offsets, hour_values) in groups.items():
+        ref = refs[hour]
+        if ref.id in existing:
+            old_offsets, old_values = decode_bucket(existing[ref.id])
+            offsets, hour_values = merge_points(old_offsets, old_values, offsets, hour_values)
+        writer.set(ref, encode_bucket(user_id, experiment_id, data_type, date, hour, offsets, hour_values))
+        merged[hour] = (offsets, hour_values)
+    return merged
+
+
+# 1日分のデータを従来形式（1データ点1ドキュメント）で保存する
+def write_raw(db, user_id, experiment_id, data_type, date, seconds, values, writer):
+    for time_str, value in zip(format_times(seconds), values.tolist()):
+        # 同じデータ点は同じIDになるようにして、再実行しても重複しないようにする
+        doc_ref = db.collection(RAW_COLLECTION) \
+            .document(experiment_id) \
+            .collection(data_type) \
+            .document(f"{user_id}_{date}_{time_str.replace(':', '')}")
+
+        writer.set(doc_ref, {
+            "user_id": user_id,
+            "experiment_id": experiment_id,
+            "data_type": data_type,
+            "date": date,
+            "time": time_str,
+            "value": value,
+            "timestamp": firestore.SERVER_TIMESTAMP
+        })
+
+
+# バケットのドキュメントを [{"date", "time", "value"}] の形式に展開する
+def expand_bucket(bucket):
+    offsets, values = decode_bucket(bucket)
+    times = format_times(bucket["hour"] * 3600 + offsets)
+    return [{"date": bucket["date"], "time": time, "value": value} for time, value in zip(times, values.tolist())]
+
+
+# 指定した日のデータを取得する（バケットがなければ従来形式のドキュメントから取得する）
+def read_day(db, experiment_id, data_type, date):
+    buckets = db.collection(BUCKET_COLLECTION) \
+        .document(experiment_id) \
+        .collection(data_type) \
+        .where("date", "==", date) \
+        .stream()
+    data = []
+    for bucket in buckets:
+        data.extend(expand_bucket(bucket.to_dict()))
+    if data:
+        return sorted(data, key=lambda d: d["time"])
+
+    docs = db.collection(RAW_COLLECTION) \
+        .document(experiment_id) \
+        .collection(data_type) \
+        .where("date", "==", date) \
+        .stream()
+    return [doc.to_dict() for doc in docs]
+
+
+# 指定した期間 [start, end) のデータを取得する（start, end は JST の datetime）
+def read_range(db, experiment_id, data_type, start, end):
+    start_hour = start.replace(minute=0, second=0, microsecond=0)
+    buckets = db.collection(BUCKET_COLLECTION) \
+        .document(experiment_id) \
+        .collection(data_type) \
+        .where("start", ">=", start_hour) \
+        .where("start", "<", end) \
+        .select(["date", "hour", "offsets", "values"]) \
+        .stream()
+    data = []
+    for bucket in buckets:
+        data.extend(expand_bucket(bucket.to_dict()))
+
+    if not data:
+        # 従来形式のドキュメントは日付で絞り込んでから時刻で判定する
+        docs = db.collection(RAW_COLLECTION) \
+            .document(experiment_id) \
+            .collection(data_type) \
+            .where("date", ">=", start.strftime("%Y-%m-%d")) \
+            .where("date", "<=", end.strftime("%Y-%m-%d")) \
+            .select(["date", "time", "value"]) \
+            .stream()
+        data = [doc.to_dict() for doc in docs]
+
+    start_key = start.strftime("%Y-%m-%d %H:%M:%S")
+    end_key = end.strftime("%Y-%m-%d %H:%M:%S")
+    return [d for d in data if start_key <= f"{d['date']} {d['time']}" < end_key]
@@ -1,9 +1,14 @@
-import requests
+import http_client
 from firebase_auth import initialize_firestore
 from firebase_admin import firestore
 from datetime import datetime, timedelta, timezone
-import base64
 import pandas as pd
+from intervention_history import record_intervention
+from metrics import METRICS
+from fetch_and_save import fetch_fitbit_activity_data
+from rate_limiter import RateLimitExceeded
+from storage import get_storage
+from token_manager import TOKEN_MANAGER
 
 SLACK_TOKEN = ""  # Botのトークン ベタガキなのはセキュリティ上の理由でよくない
 user_id = ""  # 送信先ユーザーのSlack ID
@@ -78,53 +83,12 @@ ENDPOINTS = [
 ]
 
 
-# Fitbit APIからデータを取得
-def fetch_fitbit_activity_data(access_token, endpoint):
-    url = f"https://api.fitbit.com{endpoint}"
-    headers = {
-        "Authorization": f"Bearer {access_token}"
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        return response.json()
-    elif response.status_code == 401:
-        return "token_expired"
-    else:
-        print(f"エラー: {endpoint} のデータ取得に失敗しました")
-        print("ステータスコード:", response.status_code)
-        print("レスポンス内容:", response.json())
-        return None
-
-# トークンの更新処理
-def refresh_access_token(refresh_token, client_id, client_secret):
-    url = "https://api.fitbit.com/oauth2/token"
-    # client_id と client_secret を Base64 エンコード
-    auth_string = f"{client_id}:{client_secret}"
-    auth_header = base64.b64encode(auth_string.encode()).decode()
-
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Authorization": f"Basic {auth_header}",  # ここでAuthorizationヘッダーを追加
-    }
-    data = {
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-    }
-    response = requests.post(url, headers=headers, data=data)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print("トークン更新エラー:", response.json())
-        return None
-
 # データを整形してFirestoreに保存
 def save_data_to_firestore(db, user_id, experiment_id, data_type, activity_data, slack_dm_id):
     try:
         dataset = activity_data.get(f"activities-{data_type}-intraday", {}).get("dataset", [])
         date = activity_data.get(f"activities-{data_type}", [{}])[0].get("dateTime", "unknown_date")
-        print(f"データの日付: {date}, データ数: {len(dataset)}") # デバッグ用
-        print(f"data-type:{data_type}, activity_data:{activity_data}") # デバッグ用
-        
+
         # heart_rateの場合は5秒ごとのデータを取得
         if data_type == "heart":
             df = pd.DataFrame(dataset)
@@ -155,23 +119,26 @@ def save_data_to_firestore(db, user_id, experiment_id, data_type, activity_data,
                 message = "歩数は平均値の範囲内です。"
                 send_dm(SLACK_TOKEN, experiment_id, slack_dm_id, message)
 
-        batch = db.batch()
-        for data_point in dataset:
-            doc_ref = db.collection("activity_data") \
-                .document(experiment_id) \
-                .collection(data_type) \
-                .document()
-                
-            batch.set(doc_ref, {
-                "user_id": user_id,
-                "experiment_id": experiment_id,
-                "data_type": data_type,
-                "date": date,
-                "time": data_point["time"],
-                "value": data_point["value"],
-                "timestamp": firestore.SERVER_TIMESTAMP
-            })
-        batch.commit()
+        # データの日付と件数は書き込みのメトリクスに記録する
+        with METRICS.stage("write", date=date) as stage:
+            batch = db.batch()
+            for data_point in dataset:
+                doc_ref = db.collection("activity_data") \
+                    .document(experiment_id) \
+                    .collection(data_type) \
+                    .document()
+
+                batch.set(doc_ref, {
+                    "user_id": user_id,
+                    "experiment_id": experiment_id,
+                    "data_type": data_type,
+                    "date": date,
+                    "time": data_point["time"],
+                    "value": data_point["value"],
+                    "timestamp": firestore.SERVER_TIMESTAMP
+                })
+            batch.commit()
+            stage.add(items=len(dataset))
         print(f"ユーザー {user_id} の {data_type} データを保存しました。")
     except Exception as e:
         print(f"Firestoreの保存中にエラーが発生しました: {e}")
@@ -248,7 +215,7 @@ def send_dm(token, experiment_id, channel, text):
     """
     Botから指定のIDのDMに対してメッセージを送る
     """
-    url = "https://slack.com/api/chat.postMessage"
+    url = f"{http_client.SLACK_API_BASE}/chat.postMessage"
     headers = {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
@@ -258,7 +225,7 @@ def send_dm(token, experiment_id, channel, text):
         "text": text
     }
     
-    response = requests.post(url, json=payload, headers=headers)
+    response = http_client.post(url, json=payload, headers=headers)
     
     # レスポンスの内容をログに出力
     print("Slack response:", response.json())
@@ -272,56 +239,50 @@ def add_intervention(experiment_id, message):
     介入ログをFirestoreに保存する
     """
     db = initialize_firestore()
-    now_jst = datetime.now(JST) # 最新の日本時間を取得
-    date = now_jst.strftime("%Y-%m-%d")  # YYYY-MM-DD 形式
-    interventions_ref = db.collection("interventions").document(experiment_id).collection(date).document()
-    interventions_ref.set({
-        "date": date,
-        "time": now_jst.strftime("%H:%M:%S"),  # HH:MM:SS 形式
-        "message": message,
-        "timestamp": firestore.SERVER_TIMESTAMP  # Firestoreのサーバー時間も一応保存
-    })
+    # 実験ごとの介入履歴のコレクションに保存する
+    record_intervention(db, experiment_id, message, "sent", source="data_crawler")
     
 # 全ユーザーのデータを取得
 def process_all_users(data, context=None):
-    db = initialize_firestore()
-    users = db.collection("users").stream()
-
-    for user_doc in users:
-        user_data = user_doc.to_dict()
-        user_id = user_doc.id
-        access_token = user_data["fitbit_access_token"]
-        refresh_token = user_data["refresh_token"]
-        client_id = user_data["fitbit_client_id"]
-        client_secret = user_data["fitbit_client_secret"]
-        experiment_id = user_data.get("experiment_id", "default_experiment")
-        slack_dm_id = user_data["slack_dm_id"]
-
-        for endpoint_info in ENDPOINTS:
-            data_type = endpoint_info["data_type"]
-            endpoint = endpoint_info["endpoint"]
-
-            # Fitbit APIからデータを取得
-            activity_data = fetch_fitbit_activity_data(access_token, endpoint)
-
-            if activity_data == "token_expired":
-                # トークンが期限切れの場合は更新
-                token_response = refresh_access_token(refresh_token, client_id, client_secret)
-                if token_response:
-                    # Firestoreに新しいトークンを保存
-                    db.collection("users").document(user_id).update({
-                        "fitbit_access_token": token_response["access_token"],
-                        "refresh_token": token_response["refresh_token"]
-                    })
-                    access_token = token_response["access_token"]
-                    # 再度データ取得を試みる
-                    activity_data = fetch_fitbit_activity_data(access_token, endpoint)
-
-            if activity_data and activity_data != "token_expired":
-                # Firestoreにデータを保存
-                save_data_to_firestore(db, user_id, experiment_id, data_type, activity_data, slack_dm_id)
-
-        return("データの取得および保存が完了しました。", 200)
+    # 処理段階ごとの処理時間（データの日付と件数を含む）を実行の終わりにまとめて出力する
+    with METRICS.run("data_crawler"):
+        db = initialize_firestore()
+        storage = get_storage()
+        users = db.collection("users").stream()
+
+        for user_doc in users:
+            user_data = user_doc.to_dict()
+            user_id = user_doc.id
+            # トークンはトークンマネージャで管理する（期限切れの更新はユーザごとに1回にまとめる）
+            TOKEN_MANAGER.register(user_id, user_data)
+            experiment_id = user_data.get("experiment_id", "default_experiment")
+            slack_dm_id = user_data["slack_dm_id"]
+
+            for endpoint_info in ENDPOINTS:
+                data_type = endpoint_info["data_type"]
+                endpoint = endpoint_info["endpoint"]
+
+                try:
+                    # Fitbit APIからデータを取得
+                    access_token = TOKEN_MANAGER.get_token(storage, user_id)
+                    activity_data = fetch_fitbit_activity_data(access_token, endpoint, user_id)
+
+                    if activity_data == "token_expired":
+                        # トークンが期限切れの場合は更新して再度データ取得を試みる
+                        access_token = TOKEN_MANAGER.invalidate(storage, user_id, access_token)
+                        if access_token:
+                            activity_data = fetch_fitbit_activity_data(access_token, endpoint, user_id)
+                except RateLimitExceeded as e:
+                    # レート制限に達したユーザの残りのエンドポイントは次回の実行に回し、他のユーザの取得を続ける
+                    print(f"ユーザー {user_id} の {data_type} 以降の取得を次回に回します: {e}")
+                    break
+
+                if activity_data and activity_data != "token_expired":
+                    # Firestoreにデータを保存
+                    with METRICS.labels(experiment_id=experiment_id, data_type=data_type):
+                        save_data_to_firestore(db, user_id, experiment_id, data_type, activity_data, slack_dm_id)
+
+    return("データの取得および保存が完了しました。", 200)
 
 # メイン処理
 if __name__ == "__main__":
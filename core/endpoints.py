@@ -0,0 +1,13 @@
+# Fitbit APIで取得するデータタイプをリストで管理
+# （データ取得と日次集計・分析用のミラーで共有する。日次集計のコールドスタートを短くするため、重いモジュールは読み込まない）
+ENDPOINTS = [
+    {"data_type": "steps", "resource": "steps", "detail_level": "1min"},  # 歩数
+    {"data_type": "heart", "resource": "heart", "detail_level": "1sec"},  # 心拍数 (5秒おきに変更)
+    {"data_type": "calories", "resource": "calories", "detail_level": "1min"},  # 消費カロリー
+    {"data_type": "distance", "resource": "distance", "detail_level": "1min"},  # 距離
+    {"data_type": "floors", "resource": "floors", "detail_level": "1min"},  # 上った階数
+    {"data_type": "minutesSedentary", "resource": "minutesSedentary", "detail_level": "1min"},  # 静止時間
+]
+
+# 取得するデータタイプ
+DATA_TYPES = [endpoint_info["data_type"] for endpoint_info in ENDPOINTS]
@@ -1,224 +1,292 @@
-import requests
-from firebase_auth import initialize_firestore
-from firebase_admin import firestore
+import http_client
 from datetime import datetime, timedelta, timezone
-import base64
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import threading
+import time
+from endpoints import ENDPOINTS
+from metrics import METRICS
+from rate_limiter import RATE_LIMITER, RateLimitExceeded
+from storage import get_storage
+from token_manager import TOKEN_MANAGER
+from transform_kernels import hourly_sum, resample_linear, to_arrays
+from watermark import ingestion_window, last_sync_time, last_timestamp, split_by_date
 
 # 日本時間のタイムゾーン
 JST = timezone(timedelta(hours=9))
 
-# 現在の日本時間
-now_jst = datetime.now(JST)
-
-# 1時間前の時刻を取得
-one_hour_ago = now_jst - timedelta(hours=1)
-
-# 日付、開始時刻、終了時刻を指定
-date = one_hour_ago.strftime("%Y-%m-%d")  # 日付
-start_time = one_hour_ago.strftime("%H:%M")  # 1時間前の時刻 (HH:MM形式)
-end_time = now_jst.strftime("%H:%M")  # 現在の時刻 (HH:MM形式)
-
-# Fitbit APIのエンドポイントをリストで管理
-ENDPOINTS = [
-    {
-        "data_type": "steps",  # 歩数
-        "endpoint": f"/1/user/-/activities/steps/date/{date}/1d/1min/time/{start_time}/{end_time}.json",
-        "start_time": start_time,
-        "end_time": end_time
-    },
-    {
-        "data_type": "heart",  # 心拍数 (5秒おきに変更)
-        "endpoint": f"/1/user/-/activities/heart/date/{date}/1d/1sec/time/{start_time}/{end_time}.json",
-        "start_time": start_time,
-        "end_time": end_time
-    },
-    {
-        "data_type": "calories",  # 消費カロリー
-        "endpoint": f"/1/user/-/activities/calories/date/{date}/1d/1min/time/{start_time}/{end_time}.json",
-        "start_time": start_time,
-        "end_time": end_time
-    },
-    {
-        "data_type": "distance",  # 距離
-        "endpoint": f"/1/user/-/activities/distance/date/{date}/1d/1min/time/{start_time}/{end_time}.json",
-        "start_time": start_time,
-        "end_time": end_time
-    },
-    {
-        "data_type": "floors",  # 上った階数
-        "endpoint": f"/1/user/-/activities/floors/date/{date}/1d/1min/time/{start_time}/{end_time}.json",
-        "start_time": start_time,
-        "end_time": end_time
-    },
-        {
-        "data_type": "minutesSedentary",  # 静止時間
-        "endpoint": f"/1/user/-/activities/minutesSedentary/date/{date}/1d/1min/time/{start_time}/{end_time}.json",
-        "start_time": start_time,
-        "end_time": end_time
-    },
-]
+# 同時に実行する Fitbit API リクエスト数の上限
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", "16"))
+
+# 端末の一覧（最後に同期した時刻）を取得するエンドポイント
+DEVICES_ENDPOINT = "/1/user/-/devices.json"
+
+# 端末の一覧の取得に必要なスコープ（settings を認可していないトークンでは 403 になる）
+DEVICES_SCOPE = "settings"
+
+# 端末の一覧が 403 になったことを記録するユーザ情報のフィールド
+# （アカウント作成画面で再認可するとユーザ情報が作り直されて消える）
+DEVICES_FORBIDDEN_FIELD = "devices_forbidden"
+
+
+class InsufficientScope(RuntimeError):
+    """トークンに必要なスコープが認可されていない（403）場合に送出する例外"""
+
+# 日付と時間帯を指定したエンドポイントを作成する
+def build_endpoint(endpoint_info, date, start_time, end_time):
+    return (
+        f"/1/user/-/activities/{endpoint_info['resource']}/date/{date}"
+        f"/1d/{endpoint_info['detail_level']}/time/{start_time}/{end_time}.json"
+    )
+
+# 1日分のデータを取得するエンドポイントを作成する（バックフィル用）
+def build_day_endpoint(endpoint_info, date):
+    return f"/1/user/-/activities/{endpoint_info['resource']}/date/{date}/1d/{endpoint_info['detail_level']}.json"
 
 
 # Fitbit APIからデータを取得
-def fetch_fitbit_activity_data(access_token, endpoint):
-    url = f"https://api.fitbit.com{endpoint}"
+def fetch_fitbit_activity_data(access_token, endpoint, user_id=None, reserve=0):
+    """
+    user_id を指定した場合はユーザごとのレート制限の残数を確認してからリクエストする。
+    残数がない場合や 429 が返ってきた場合は待機せずに RateLimitExceeded を送出する（呼び出し側でユーザを後回しにする）。
+    reserve はレート制限の残数のうち、この呼び出しでは使わずに残しておく数。
+    """
+    url = f"{http_client.FITBIT_API_BASE}{endpoint}"
     headers = {
         "Authorization": f"Bearer {access_token}"
     }
-    response = requests.get(url, headers=headers)
+    if user_id is not None:
+        RATE_LIMITER.acquire(user_id, reserve)
+    with METRICS.stage("fetch") as stage:
+        response = http_client.get(url, headers=headers)
+        stage.labels["status"] = response.status_code
+        stage.error = response.status_code != 200
+        stage.add(bytes=len(response.content))
+    if user_id is not None:
+        RATE_LIMITER.update(user_id, response.headers)
+
     if response.status_code == 200:
         return response.json()
     elif response.status_code == 401:
         return "token_expired"
+    elif response.status_code == 403:
+        raise InsufficientScope(f"{endpoint} に必要なスコープが認可されていません")
+    elif response.status_code == 429 and user_id is not None:
+        # リセットまで残数を0にして、このユーザの以降のリクエストも送らずに後回しにさせる
+        retry_at = RATE_LIMITER.on_rate_limited(user_id, response.headers)
+        raise RateLimitExceeded(f"{endpoint} はレート制限に達しました（リセットまで {int(retry_at - time.time())} 秒）", retry_at)
     else:
         print(f"エラー: {endpoint} のデータ取得に失敗しました")
         print("ステータスコード:", response.status_code)
         print("レスポンス内容:", response.json())
         return None
 
-# トークンの更新処理
-def refresh_access_token(refresh_token, client_id, client_secret):
-    url = "https://api.fitbit.com/oauth2/token"
-    # client_id と client_secret を Base64 エンコード
-    auth_string = f"{client_id}:{client_secret}"
-    auth_header = base64.b64encode(auth_string.encode()).decode()
+# レスポンスを (日付, 0時からの秒数, 値) の配列に変換する
+def transform_activity_data(data_type, activity_data):
+    dataset = activity_data.get(f"activities-{data_type}-intraday", {}).get("dataset", [])
+    date = activity_data.get(f"activities-{data_type}", [{}])[0].get("dateTime", "unknown_date")
 
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Authorization": f"Basic {auth_header}",  # ここでAuthorizationヘッダーを追加
-    }
-    data = {
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-    }
-    response = requests.post(url, headers=headers, data=data)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print("トークン更新エラー:", response.json())
-        return None
-    
-# 座位時間を1時間ごとに集計する関数
-def aggregate_sedentary_data(dataset):
-    df = pd.DataFrame(dataset)
-    if df.empty:
-        return None  # データがない場合
-
-    # 時間をdatetime型に変換
-    df["datetime"] = pd.to_datetime(df["time"], format="%H:%M:%S").apply(lambda x: x.replace(tzinfo=JST))
-
-    # 1時間ごとに集計 (valueを合計)
-    df_resampled = df.set_index("datetime").resample("1H")["value"].sum().reset_index()
-    
-    # 時間を文字列形式に変換 (HH:MM:SS 形式)
-    df_resampled["time"] = df_resampled["datetime"].dt.strftime("%H:00:00")
-    
-    # 必要な列だけを抽出
-    return df_resampled[["time", "value"]].to_dict(orient="records")
-
-# データを整形してFirestoreに保存
-def save_data_to_firestore(db, user_id, experiment_id, data_type, activity_data, slack_dm_id):
-    try:
-        dataset = activity_data.get(f"activities-{data_type}-intraday", {}).get("dataset", [])
-        date = activity_data.get(f"activities-{data_type}", [{}])[0].get("dateTime", "unknown_date")
-        print(f"データの日付: {date}, データ数: {len(dataset)}") # デバッグ用
-        print(f"data-type:{data_type}, activity_data:{activity_data}") # デバッグ用
+    # 変換から書き込みまで (秒数, 値) の配列のまま扱う
+    seconds, values = to_arrays(dataset)
+
+    # heart_rateの場合は5秒ごとのデータに線形補間
+    if data_type == "heart":
+        seconds, values = resample_linear(seconds, values, step=5)
         
-        # heart_rateの場合は5秒ごとのデータを取得
-        if data_type == "heart":
-            df = pd.DataFrame(dataset)
-            df_resampled = resample_to_5s(df)
-            dataset = df_resampled.to_dict(orient="records") # レコードのリストに変換
-            
-        # sedentaryの場合は1時間ごとに集計
-        if data_type == "minutesSedentary":
-            dataset = aggregate_sedentary_data(dataset)
-            if dataset is None:
-                print("座位時間のデータがありません。")
-                return
-
-        batch = db.batch()
-        for data_point in dataset:
-            doc_ref = db.collection("activity_data") \
-                .document(experiment_id) \
-                .collection(data_type) \
-                .document()
-                
-            batch.set(doc_ref, {
-                "user_id": user_id,
-                "experiment_id": experiment_id,
-                "data_type": data_type,
-                "date": date,
-                "time": data_point["time"],
-                "value": data_point["value"],
-                "timestamp": firestore.SERVER_TIMESTAMP
-            })
-        batch.commit()
-        print(f"ユーザー {user_id} の {data_type} データを保存しました。")
-    except Exception as e:
-        print(f"Firestoreの保存中にエラーが発生しました: {e}")
+    # sedentaryの場合は1時間ごとに集計
+    if data_type == "minutesSedentary" and len(seconds):
+        seconds, values = hourly_sum(seconds, values)
+    return date, seconds, values
+
+# データを整形してストレージに保存
+def save_activity_data(storage, user_id, experiment_id, data_type, activity_data, slack_dm_id):
+    """
+    保存した件数を返す。書き込みに失敗した場合は例外を送出する。
+    変換と書き込みの処理時間・件数はメトリクスに記録する（データの内容はログに出力しない）。
+    """
+    with METRICS.labels(experiment_id=experiment_id, data_type=data_type):
+        with METRICS.stage("transform") as stage:
+            date, seconds, values = transform_activity_data(data_type, activity_data)
+            stage.add(items=len(seconds), bytes=seconds.nbytes + values.nbytes)
+        if data_type == "minutesSedentary" and len(seconds) == 0:
+            print(f"ユーザー {user_id} の座位時間のデータがありません。")
+            return 0
+
+        # データ点と介入の基準値に使う時間ごとの統計量を保存する
+        with METRICS.stage("write", date=date) as stage:
+            written = storage.write_points(user_id, experiment_id, data_type, date, seconds, values)
+            stage.add(items=written)
+        return written
         
-# 5秒ごとにリサンプリングする関数（線形補間）
-def resample_to_5s(df: pd.DataFrame) -> pd.DataFrame:
+# ユーザのトークンで端末の一覧を取得できるか（スコープを保存していない以前のユーザは 403 になるまで試す）
+def can_read_devices(user_data):
+    if user_data.get(DEVICES_FORBIDDEN_FIELD):
+        return False
+    scope = user_data.get("fitbit_scope")
+    return scope is None or DEVICES_SCOPE in scope.split()
+
+# ユーザ情報から取得処理に必要な情報をまとめる
+def load_user(user_id, user_data):
+    # トークンはトークンマネージャで管理する（有効期限の確認と更新もここで行う）
+    TOKEN_MANAGER.register(user_id, user_data)
+    return {
+        "user_id": user_id,
+        "experiment_id": user_data.get("experiment_id", "default_experiment"),
+        "slack_dm_id": user_data["slack_dm_id"],
+        "can_read_devices": can_read_devices(user_data),
+        # ユーザごとの状態（ウォーターマークなど）を並行して読み込まないようにするためのロック
+        "lock": threading.Lock(),
+    }
+
+# トークンの期限切れ時は更新して再取得する
+def fetch_with_token_renewal(storage, user, endpoint, reserve=0):
+    access_token = TOKEN_MANAGER.get_token(storage, user["user_id"])
+    if access_token is None:
+        raise RuntimeError("トークンの更新に失敗しました")
+    activity_data = fetch_fitbit_activity_data(access_token, endpoint, user["user_id"], reserve)
+
+    if activity_data == "token_expired":
+        # トークンが期限切れの場合は更新して再度データ取得を試みる（同じユーザの更新は1回にまとめる）
+        access_token = TOKEN_MANAGER.invalidate(storage, user["user_id"], access_token)
+        if access_token is None:
+            raise RuntimeError("トークンの更新に失敗しました")
+        activity_data = fetch_fitbit_activity_data(access_token, endpoint, user["user_id"], reserve)
+
+    if activity_data == "token_expired":
+        raise RuntimeError("更新後のトークンでも認証に失敗しました")
+    if not activity_data:
+        raise RuntimeError(f"{endpoint} のデータ取得に失敗しました")
+    return activity_data
+
+# ユーザのウォーターマークを取得する（ユーザごとに1回だけ読み込む）
+def get_user_watermark(storage, user, data_type):
+    with user["lock"]:
+        if "watermarks" not in user:
+            user["watermarks"] = storage.get_watermarks(user["user_id"])
+        return user["watermarks"].get(data_type)
+
+# ユーザの端末が最後に同期した時刻を取得する（ユーザごとに1回だけ取得する。取得できない場合は None）
+def get_user_last_sync(storage, user):
+    with user["lock"]:
+        if "last_sync" not in user:
+            user["last_sync"] = None
+            if not user["can_read_devices"]:
+                return None
+            try:
+                user["last_sync"] = last_sync_time(fetch_with_token_renewal(storage, user, DEVICES_ENDPOINT))
+            except InsufficientScope as e:
+                # 再認可するまで毎回の実行でリクエストを消費しないように記録する
+                print(f"ユーザー {user['user_id']} は settings のスコープを再認可する必要があります: {e}")
+                storage.update_user(user["user_id"], {DEVICES_FORBIDDEN_FIELD: True})
+            except RuntimeError as e:
+                print(f"ユーザー {user['user_id']} の端末の同期時刻を取得できませんでした: {e}")
+        return user["last_sync"]
+
+# 1ユーザ・1データタイプ分のデータをウォーターマーク以降から取得して保存する
+def process_endpoint(storage, user, endpoint_info, now):
+    data_type = endpoint_info["data_type"]
+    # このスレッドで記録する取得・変換・書き込みのメトリクスに実験IDとデータタイプを付ける
+    with METRICS.labels(experiment_id=user["experiment_id"], data_type=data_type):
+        watermark = get_user_watermark(storage, user, data_type)
+        start, end = ingestion_window(watermark, now)
+        # データより先に同期時刻を取得する（取得の間に同期されたデータは次回に取得し直す）
+        last_sync = get_user_last_sync(storage, user)
+
+        # 日付をまたぐ場合や実行が止まっていた場合は日付ごとに分けて取得する
+        for date, start_time, end_time in split_by_date(start, end):
+            endpoint = build_endpoint(endpoint_info, date, start_time, end_time)
+            activity_data = fetch_with_token_renewal(storage, user, endpoint)
+
+            # ストレージにデータを保存
+            save_activity_data(storage, user["user_id"], user["experiment_id"], data_type, activity_data, user["slack_dm_id"])
+
+            # 端末が同期済みの時刻までのデータの最後の時刻までウォーターマークを進める
+            dataset = activity_data.get(f"activities-{data_type}-intraday", {}).get("dataset", [])
+            last = last_timestamp(activity_data.get(f"activities-{data_type}", [{}])[0].get("dateTime", date), dataset,
+                                  last_sync, now)
+            if last and (watermark is None or last > watermark):
+                storage.set_watermark(user["user_id"], data_type, last)
+                watermark = last
+
+# 開始時刻を記録してから1ユーザ・1データタイプ分の処理を行う（ユーザごとの処理時間の計測用）
+def timed_process_endpoint(result, storage, user, endpoint_info, now):
+    started = time.monotonic()
+    with user["lock"]:
+        if result["started"] is None or started < result["started"]:
+            result["started"] = started
+    process_endpoint(storage, user, endpoint_info, now)
+
+# ユーザ×エンドポイントの組み合わせを並列に処理し、ユーザごとの結果を返す
+def run_ingestion(storage, user_records, endpoints=None, max_workers=MAX_CONCURRENT_REQUESTS):
     """
-    心拍数データを5秒ごとに補間し、`time` 列をHH:MM:SS形式のみに統一する関数
+    user_records は [(user_id, ユーザ情報)]（storage.list_users() の結果）。
+    全ユーザ・全エンドポイントの取得をスレッドプールで並列に実行する。
+    同時リクエスト数は max_workers で制限し、結果とエラーをユーザごとに集計する。
+    elapsed はユーザの最初のエンドポイントの開始から最後のエンドポイントの終了までの時間
+    （キューで待機していた時間は含まない。処理しなかったユーザは None）。
+    レート制限の残数がないデータタイプは待機せずに deferred に入れ、次回の実行でウォーターマークから取得し直す。
     """
-    # `time` を明示的に datetime 型に変換（ダミー日付を設定）
-    df["datetime"] = pd.to_datetime("2000-01-01 " + df["time"])
+    endpoints = ENDPOINTS if endpoints is None else endpoints
+    now = datetime.now(JST)
+    results = {}
+    users = []
+    for user_id, user_data in user_records:
+        results[user_id] = {"saved": [], "deferred": [], "errors": {}, "started": None, "finished": None, "elapsed": None}
+        try:
+            users.append(load_user(user_id, user_data))
+        except KeyError as e:
+            results[user_id]["errors"]["user"] = f"ユーザ情報に {e} がありません"
 
-    # インデックスを datetime に設定
-    df.set_index("datetime", inplace=True)
+    # 前回の実行やバックフィルで消費したレート制限の残数を引き継ぎ、
+    # 残数の多いユーザから先に処理する（残数のないユーザはリクエストを送らずに次回の実行に回す）
+    user_ids = [user["user_id"] for user in users]
+    RATE_LIMITER.load_state(storage, user_ids)
+    users.sort(key=lambda user: RATE_LIMITER.remaining(user["user_id"]), reverse=True)
 
-    # 5秒ごとのデータに線形補間
-    df_resampled = df.resample("5S").interpolate(method="linear").reset_index()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(timed_process_endpoint, results[user["user_id"]], storage, user, endpoint_info, now): (user, endpoint_info["data_type"])
+            for user in users
+            for endpoint_info in endpoints
+        }
+        for future in as_completed(futures):
+            user, data_type = futures[future]
+            result = results[user["user_id"]]
+            result["experiment_id"] = user["experiment_id"]
+            try:
+                future.result()
+                result["saved"].append(data_type)
+            except RateLimitExceeded as e:
+                print(f"ユーザー {user['user_id']} の {data_type} は次回の実行で取得します: {e}")
+                result["deferred"].append(data_type)
+            except Exception as e:
+                print(f"ユーザー {user['user_id']} の {data_type} の処理に失敗しました: {e}")
+                result["errors"][data_type] = str(e)
+            # ユーザの最初のエンドポイントの開始から最後のエンドポイントの終了までの時間
+            result["finished"] = time.monotonic()
+            result["elapsed"] = result["finished"] - result["started"]
 
-    # `time` カラムを HH:MM:SS 形式に戻し、datetime は削除
-    df_resampled["time"] = df_resampled["datetime"].dt.strftime("%H:%M:%S")
+    RATE_LIMITER.save_state(storage, user_ids)
+    # ダッシュボードのキャッシュを更新させるため、データを保存した実験の更新時刻を記録する
+    storage.mark_ingested([result["experiment_id"] for result in results.values() if result["saved"]])
+    return results
 
-    return df_resampled.drop(columns=["datetime"])
-    
 # 全ユーザーのデータを取得
 def process_all_users(data, context=None):
-    db = initialize_firestore()
-    users = db.collection("users").stream()
-
-    for user_doc in users:
-        user_data = user_doc.to_dict()
-        user_id = user_doc.id
-        access_token = user_data["fitbit_access_token"]
-        refresh_token = user_data["refresh_token"]
-        client_id = user_data["fitbit_client_id"]
-        client_secret = user_data["fitbit_client_secret"]
-        experiment_id = user_data.get("experiment_id", "default_experiment")
-        slack_dm_id = user_data["slack_dm_id"]
-
-        for endpoint_info in ENDPOINTS:
-            data_type = endpoint_info["data_type"]
-            endpoint = endpoint_info["endpoint"]
-
-            # Fitbit APIからデータを取得
-            activity_data = fetch_fitbit_activity_data(access_token, endpoint)
-
-            if activity_data == "token_expired":
-                # トークンが期限切れの場合は更新
-                token_response = refresh_access_token(refresh_token, client_id, client_secret)
-                if token_response:
-                    # Firestoreに新しいトークンを保存
-                    db.collection("users").document(user_id).update({
-                        "fitbit_access_token": token_response["access_token"],
-                        "refresh_token": token_response["refresh_token"]
-                    })
-                    access_token = token_response["access_token"]
-                    # 再度データ取得を試みる
-                    activity_data = fetch_fitbit_activity_data(access_token, endpoint)
-
-            if activity_data and activity_data != "token_expired":
-                # Firestoreにデータを保存
-                save_data_to_firestore(db, user_id, experiment_id, data_type, activity_data, slack_dm_id)
-
-        return("データの取得および保存が完了しました。", 200)
+    with METRICS.run("ingestion"):
+        storage = get_storage()
+        with METRICS.stage("list_users") as stage:
+            user_records = storage.list_users()
+            stage.add(items=len(user_records))
+        results = run_ingestion(storage, user_records)
+    failed = [user_id for user_id, result in results.items() if result["errors"]]
+    for user_id in failed:
+        print(f"ユーザー {user_id} のエラー: {results[user_id]['errors']}")
+    deferred = [user_id for user_id, result in results.items() if result["deferred"]]
+
+    return(f"データの取得および保存が完了しました。ユーザ数: {len(results)}, エラーのあったユーザ数: {len(failed)}, "
+           f"レート制限で次回に回したユーザ数: {len(deferred)}", 200)
 
 # メイン処理
 if __name__ == "__main__":
-    process_all_users()
+    process_all_users(None)
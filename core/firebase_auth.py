@@ -1,27 +1,36 @@
-from google.cloud import secretmanager
 import firebase_admin
 from firebase_admin import credentials, firestore
+from functools import lru_cache
 import os
 import json
-import streamlit as st
+import threading
 
-# Google Secret Managerから秘密情報を取得する関数(定期実行を行うGCPの方では使用するがこっちでは使用しない)
-def access_secret_version():
+# secretmanager は読み込みに時間がかかるため、必要になった時点でインポートする
+# （Cloud Functions の定期実行では Firestore しか使わないため、コールドスタートが短くなる）
+# Streamlit の secrets は gui.py で読み込んで credentials_info として渡す（core のモジュールでは streamlit を読み込まない）
+
+# サービスアカウントの鍵を保存した Secret Manager のプロジェクトとシークレットのID
+# 設定しない場合は実行環境のデフォルト認証情報（Cloud Functions のサービスアカウント）を使う
+SECRET_PROJECT_ID = os.environ.get("FIREBASE_SECRET_PROJECT_ID") or os.environ.get("GOOGLE_CLOUD_PROJECT")
+SECRET_ID = os.environ.get("FIREBASE_SECRET_ID")
+
+# プロセス内で共有する Firestore クライアント（ウォームインスタンスでは再利用される）
+_db = None
+_db_lock = threading.Lock()
+
+# Google Secret Managerから秘密情報を取得する関数
+@lru_cache(maxsize=None)
+def access_secret_version(project_id, secret_id):
     """
-    Google Secret Managerから最新のシークレットを取得
+    Google Secret Managerから最新のシークレットを取得（プロセス内でキャッシュする）
     """
+    from google.cloud import secretmanager
+
     # Secret Managerクライアントを初期化
     client = secretmanager.SecretManagerServiceClient()
-    
-    # Streamlit secrets から設定を取得
-    PROJECT_ID = st.secrets["firebase"]["project_id"]
-    SECRET_ID = st.secrets["firebase"]["secret_id"]
-
-    if not PROJECT_ID or not SECRET_ID:
-        raise EnvironmentError("PROJECT_ID または SECRET_ID が設定されていません。")
 
     # Secretのパスを作成
-    name = f"projects/{PROJECT_ID}/secrets/{SECRET_ID}/versions/latest"
+    name = f"projects/{project_id}/secrets/{secret_id}/versions/latest"
 
     # Secretを取得
     response = client.access_secret_version(request={"name": name})
@@ -31,28 +40,49 @@ def access_secret_version():
     return secret_payload
 
 # Firebase Admin SDKの初期化
-def initialize_firestore():
+def initialize_firestore(credentials_info=None):
     """
     Firebase Admin SDKを初期化し、Firestoreクライアントを返す
+    2回目以降は同じクライアントを返す
+    credentials_info（サービスアカウントの鍵の辞書）を渡さない場合は、FIREBASE_SECRET_ID が設定されていれば
+    Secret Manager の鍵を、設定されていなければ実行環境のデフォルト認証情報を使う
     """
-    # Firebaseアプリが既に初期化されているか確認
-    if not firebase_admin._apps:
-        try:
-            firebase_credentials = dict(st.secrets["firebase"])  # TOML を辞書に変換
-            
-            # Firebase Admin SDKを初期化
-            cred = credentials.Certificate(firebase_credentials)
-            firebase_admin.initialize_app(cred)
-            print("Firebase Admin SDKの初期化に成功しました。")  # デバッグ用ログ
+    global _db
+    if _db is not None:
+        return _db
 
-        except Exception as e:
-            print(f"Firebase Admin SDKの初期化中にエラーが発生しました: {e}")  # エラー内容をログに出力
-            raise RuntimeError(f"Firebase Admin SDKの初期化中にエラーが発生しました: {e}")
+    with _db_lock:
+        if _db is not None:
+            return _db
+
+        # Firebaseアプリが既に初期化されているか確認
+        if not firebase_admin._apps:
+            try:
+                if credentials_info is None and SECRET_ID:
+                    if not SECRET_PROJECT_ID:
+                        raise EnvironmentError("FIREBASE_SECRET_PROJECT_ID が設定されていません。")
+                    credentials_info = json.loads(access_secret_version(SECRET_PROJECT_ID, SECRET_ID))
+
+                if credentials_info is None:
+                    firebase_admin.initialize_app()
+                else:
+                    # Firebase Admin SDKを初期化
+                    cred = credentials.Certificate(credentials_info)
+                    firebase_admin.initialize_app(cred)
+                print("Firebase Admin SDKの初期化に成功しました。")  # デバッグ用ログ
 
-    # Firestoreクライアントを作成
-    db = firestore.client()
-    print("Firestoreクライアントの作成に成功しました。")
-    return db
+            except Exception as e:
+                print(f"Firebase Admin SDKの初期化中にエラーが発生しました: {e}")  # エラー内容をログに出力
+                raise RuntimeError(f"Firebase Admin SDKの初期化中にエラーが発生しました: {e}")
+
+        # Firestoreクライアントを作成（デフォルト認証情報が見つからない場合はここで失敗する）
+        try:
+            _db = firestore.client()
+        except Exception as e:
+            print(f"Firestoreクライアントの作成中にエラーが発生しました: {e}")
+            raise RuntimeError(f"Firestoreクライアントの作成中にエラーが発生しました: {e}")
+        print("Firestoreクライアントの作成に成功しました。")
+        return _db
 
 # アクセストークンをFirestoreに保存
 def save_user_token(db, user_id, experiment_id, token_data):
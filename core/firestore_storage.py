@@ -0,0 +1,200 @@
+from firebase_admin import firestore
+from baseline_store import update_hourly_stats
+from bulk_writer import BulkWriter
+from compact_storage import STORAGE_FORMAT, group_by_hour, read_day, read_range, write_buckets, write_raw
+from ingestion_status import get_data_version, mark_backfilled, mark_ingested, mark_intervened
+from intervention_history import history_for_date, query_all_experiments, query_history, record_intervention
+from rate_limiter import RATE_LIMIT_COLLECTION
+from rollups import day_stats_from_documents, get_day_rollups, paginate, query_rollups
+from storage import Storage, progress_id
+from watermark import get_watermarks, set_watermark
+
+# ユーザ情報のコレクション名
+USERS_COLLECTION = "users"
+
+# 日次集計のコレクション名
+# daily_summary/{experiment_id}/{data_type}/{user_id}_{date}
+SUMMARY_COLLECTION = "daily_summary"
+
+# 介入スケジュールのコレクション名
+# intervene_schedule/{YYYY-MM-DD}
+SCHEDULE_COLLECTION = "intervene_schedule"
+
+# バックフィルの進捗を保存するコレクション名
+# backfill_progress/{experiment_id}_{data_type}_{date}
+PROGRESS_COLLECTION = "backfill_progress"
+
+
+class FirestoreStorage(Storage):
+    """
+    Firestore に保存する実装。コレクションの構成は各モジュール（compact_storage, baseline_store など）のとおり。
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    # --- ユーザ ---
+
+    def list_users(self, fields=None):
+        query = self.db.collection(USERS_COLLECTION)
+        if fields:
+            query = query.select(fields)
+        return [(doc.id, doc.to_dict()) for doc in query.stream()]
+
+    def get_user(self, user_id):
+        doc = self.db.collection(USERS_COLLECTION).document(user_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def set_user(self, user_id, data):
+        self.db.collection(USERS_COLLECTION).document(user_id).set(data)
+
+    def update_user(self, user_id, fields):
+        self.db.collection(USERS_COLLECTION).document(user_id).update(fields)
+
+    # --- 活動データ ---
+
+    def write_points(self, user_id, experiment_id, data_type, date, seconds, values):
+        # 500件以下のバッチに分割して並列に書き込む
+        with BulkWriter(self.db) as writer:
+            # 1時間分を1ドキュメントにまとめて保存
+            if STORAGE_FORMAT in ("bucket", "both"):
+                hours = write_buckets(self.db, user_id, experiment_id, data_type, date, seconds, values, writer)
+            else:
+                # 取り込み期間は時の先頭から始まるため、各時のデータはそろっている
+                hours = group_by_hour(seconds, values)
+
+            # 従来形式（1データ点1ドキュメント）で保存
+            if STORAGE_FORMAT in ("raw", "both"):
+                write_raw(self.db, user_id, experiment_id, data_type, date, seconds, values, writer)
+
+            # 介入の基準値に使う時間ごとの統計量を更新
+            update_hourly_stats(self.db, user_id, experiment_id, data_type, date, hours, writer)
+        return writer.written
+
+    def read_day(self, experiment_id, data_type, date):
+        return read_day(self.db, experiment_id, data_type, date)
+
+    def read_range(self, experiment_id, data_type, start, end):
+        return read_range(self.db, experiment_id, data_type, start, end)
+
+    def query_rollups(self, experiment_id, data_type, start, end, resolution):
+        return query_rollups(self.db, experiment_id, data_type, start, end, resolution)
+
+    def day_stats_by_user(self, experiment_ids, data_type, date):
+        """
+        取り込み時に作成している日のロールアップを1回の読み込みでまとめて取得する。
+        ロールアップのない実験（ロールアップ導入前のデータ）がある場合だけ、元のデータを集計する。
+        """
+        rollups = get_day_rollups(self.db, experiment_ids, data_type, date)
+        stats = {
+            (experiment_id, rollup.get("user_id")): rollup["day"]
+            for experiment_id, rollup in rollups.items()
+        }
+        if len(rollups) < len(experiment_ids):
+            for key, value in day_stats_from_documents(self.db, data_type, date).items():
+                if key[0] not in rollups:
+                    stats[key] = value
+        return stats
+
+    # --- 日次集計 ---
+
+    def write_summaries(self, data_type, date, summaries):
+        # 同じユーザ・日は同じIDにして、再実行しても重複しないようにする
+        with BulkWriter(self.db) as writer:
+            for (experiment_id, user_id), summary in summaries.items():
+                summary_ref = self.db.collection(SUMMARY_COLLECTION) \
+                    .document(experiment_id) \
+                    .collection(data_type) \
+                    .document(f"{user_id}_{date}")
+                writer.set(summary_ref, {
+                    "user_id": user_id,
+                    "experiment_id": experiment_id,
+                    "data_type": data_type,
+                    "date": date,
+                    **summary,
+                    "timestamp": firestore.SERVER_TIMESTAMP
+                })
+        return writer.written
+
+    def read_summaries(self, experiment_id, data_type, start_date, end_date):
+        query = self.db.collection(SUMMARY_COLLECTION) \
+            .document(experiment_id) \
+            .collection(data_type) \
+            .where("date", ">=", start_date) \
+            .where("date", "<=", end_date) \
+            .order_by("date")
+        return [doc.to_dict() for doc in paginate(query)]
+
+    # --- 介入スケジュール・介入記録 ---
+
+    def get_schedule(self, date):
+        doc = self.db.collection(SCHEDULE_COLLECTION).document(date).get()
+        return doc.to_dict().get("hours") if doc.exists else None
+
+    def set_schedule(self, date, hours):
+        self.db.collection(SCHEDULE_COLLECTION).document(date).set({
+            "date": date,
+            "hours": hours,
+            "timestamp": firestore.SERVER_TIMESTAMP
+        })
+
+    def record_intervention(self, experiment_id, message, outcome, step_result=None, sedentary_result=None,
+                            source="intervention", now=None):
+        return record_intervention(self.db, experiment_id, message, outcome, step_result, sedentary_result, source, now)
+
+    def interventions_for_date(self, experiment_id, date):
+        return history_for_date(self.db, experiment_id, date)
+
+    def query_history(self, experiment_id, start, end):
+        return query_history(self.db, experiment_id, start, end)
+
+    def query_all_experiments(self, start, end, hour=None):
+        return query_all_experiments(self.db, start, end, hour)
+
+    # --- 取り込みの状態 ---
+
+    def get_watermarks(self, user_id):
+        return get_watermarks(self.db, user_id)
+
+    def set_watermark(self, user_id, data_type, timestamp):
+        set_watermark(self.db, user_id, data_type, timestamp)
+
+    def load_rate_limits(self, user_ids):
+        states = {}
+        for user_id in user_ids:
+            doc = self.db.collection(RATE_LIMIT_COLLECTION).document(user_id).get()
+            if doc.exists:
+                states[user_id] = doc.to_dict()
+        return states
+
+    def save_rate_limits(self, states):
+        for user_id, state in states.items():
+            self.db.collection(RATE_LIMIT_COLLECTION).document(user_id).set(state)
+
+    def mark_ingested(self, experiment_ids):
+        mark_ingested(self.db, experiment_ids)
+
+    def mark_intervened(self, experiment_id):
+        mark_intervened(self.db, experiment_id)
+
+    def mark_backfilled(self, experiment_ids):
+        mark_backfilled(self.db, experiment_ids)
+
+    def get_data_version(self, experiment_id):
+        return get_data_version(self.db, experiment_id)
+
+    def load_backfill_progress(self, experiment_ids):
+        completed = set()
+        for experiment_id in experiment_ids:
+            docs = self.db.collection(PROGRESS_COLLECTION).where("experiment_id", "==", experiment_id).stream()
+            completed.update(doc.id for doc in docs)
+        return completed
+
+    def mark_backfill_done(self, experiment_id, data_type, date, written):
+        self.db.collection(PROGRESS_COLLECTION).document(progress_id(experiment_id, data_type, date)).set({
+            "experiment_id": experiment_id,
+            "data_type": data_type,
+            "date": date,
+            "written": written,
+            "timestamp": firestore.SERVER_TIMESTAMP,
+        })
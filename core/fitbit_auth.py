@@ -1,7 +1,9 @@
-import requests
+import http_client
 from firebase_auth import initialize_firestore
 from firebase_admin import firestore
 from urllib.parse import quote
+from storage import get_storage
+from token_manager import TOKEN_MANAGER
 
 
 # 認証URL生成
@@ -9,13 +11,13 @@ def generate_auth_url(CLIENT_ID, REDIRECT_URI):
     # Fitbit認証URLの生成
     auth_url = (
         f"https://www.fitbit.com/oauth2/authorize?"
-        f"response_type=code&client_id={CLIENT_ID}&redirect_uri={quote(REDIRECT_URI)}&scope={quote('activity heartrate profile')}"
+        f"response_type=code&client_id={CLIENT_ID}&redirect_uri={quote(REDIRECT_URI)}&scope={quote('activity heartrate profile settings')}"
     )
     return auth_url
 
 # トークン取得
 def get_access_token(auth_code, CLIENT_ID, CLIENT_SECRET, REDIRECT_URI):
-    url = "https://api.fitbit.com/oauth2/token"
+    url = f"{http_client.FITBIT_API_BASE}/oauth2/token"
     headers = {
         "Content-Type": "application/x-www-form-urlencoded",
     }
@@ -25,7 +27,7 @@ def get_access_token(auth_code, CLIENT_ID, CLIENT_SECRET, REDIRECT_URI):
         "redirect_uri": REDIRECT_URI,
         "code": auth_code,
     }
-    response = requests.post(url, headers=headers, data=data, auth=(CLIENT_ID, CLIENT_SECRET))
+    response = http_client.post(url, headers=headers, data=data, auth=(CLIENT_ID, CLIENT_SECRET))
     if response.status_code == 200:
         return response.json()
     else:
@@ -43,11 +45,11 @@ ENDPOINTS = [
 
 # Fitbit APIからデータを取得
 def fetch_fitbit_activity_data(access_token, endpoint):
-    url = f"https://api.fitbit.com{endpoint}"
+    url = f"{http_client.FITBIT_API_BASE}{endpoint}"
     headers = {
         "Authorization": f"Bearer {access_token}"
     }
-    response = requests.get(url, headers=headers)
+    response = http_client.get(url, headers=headers)
     if response.status_code == 200:
         return response.json()
     elif response.status_code == 401:
@@ -58,25 +60,6 @@ def fetch_fitbit_activity_data(access_token, endpoint):
         print("レスポンス内容:", response.json())
         return None
 
-# トークンの更新処理
-def refresh_access_token(refresh_token, client_id, client_secret):
-    url = "https://api.fitbit.com/oauth2/token"
-    auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Authorization": f"Basic {auth_header}"
-    }
-    data = {
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-    }
-    response = requests.post(url, headers=headers, data=data)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"トークン更新エラー: ステータスコード={response.status_code}, 内容={response.text}")
-        return None
-
 # データを整形してFirestoreに保存
 def save_data_to_firestore(db, user_id, experiment_id, data_type, activity_data):
     try:
@@ -103,15 +86,14 @@ def save_data_to_firestore(db, user_id, experiment_id, data_type, activity_data)
 # 全ユーザーのデータを取得
 def process_all_users():
     db = initialize_firestore()
+    storage = get_storage()
     users = db.collection("users").stream()
 
     for user_doc in users:
         user_data = user_doc.to_dict()
         user_id = user_doc.id
-        access_token = user_data["fitbit_access_token"]
-        refresh_token = user_data["refresh_token"]
-        client_id = user_data["client_id"]
-        client_secret = user_data["client_secret"]
+        # トークンはトークンマネージャで管理する（期限切れの更新はユーザごとに1回にまとめる）
+        TOKEN_MANAGER.register(user_id, user_data)
         experiment_id = user_data.get("experiment_id", "default_experiment")
 
         for endpoint_info in ENDPOINTS:
@@ -119,19 +101,13 @@ def process_all_users():
             endpoint = endpoint_info["endpoint"]
 
             # Fitbit APIからデータを取得
+            access_token = TOKEN_MANAGER.get_token(storage, user_id)
             activity_data = fetch_fitbit_activity_data(access_token, endpoint)
 
             if activity_data == "token_expired":
-                # トークンが期限切れの場合は更新
-                token_response = refresh_access_token(refresh_token, client_id, client_secret)
-                if token_response:
-                    # Firestoreに新しいトークンを保存
-                    db.collection("users").document(user_id).update({
-                        "fitbit_access_token": token_response["access_token"],
-                        "refresh_token": token_response["refresh_token"]
-                    })
-                    access_token = token_response["access_token"]
-                    # 再度データ取得を試みる
+                # トークンが期限切れの場合は更新して再度データ取得を試みる
+                access_token = TOKEN_MANAGER.invalidate(storage, user_id, access_token)
+                if access_token:
                     activity_data = fetch_fitbit_activity_data(access_token, endpoint)
 
             if activity_data and activity_data != "token_expired":
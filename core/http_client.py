@@ -0,0 +1,69 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# タイムアウト（秒）: (接続, 読み込み)
+CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "30"))
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+# ホストごとに保持するコネクション数（並列実行数に合わせる）
+POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "32"))
+
+# 再試行の設定
+MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "3"))
+BACKOFF_FACTOR = float(os.environ.get("HTTP_BACKOFF_FACTOR", "0.5"))
+
+# API のベースURL（負荷試験ではローカルのスタブサーバに向ける）
+FITBIT_API_BASE = os.environ.get("FITBIT_API_BASE", "https://api.fitbit.com")
+SLACK_API_BASE = os.environ.get("SLACK_API_BASE", "https://slack.com/api")
+
+_session = None
+_session_lock = threading.Lock()
+
+
+# 再試行とコネクションプールを設定したセッションを作成する
+def create_session():
+    """
+    5xx と接続エラーは指数バックオフで再試行する。
+    429 はレート制限側（rate_limiter）で扱うため、ここでは再試行しない。
+    POST は接続確立前のエラーのみ再試行する（トークン更新や Slack 送信の二重実行を防ぐため）。
+    """
+    retry = Retry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=MAX_RETRIES,
+        status=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+    )
+    # urllib3 がホスト（api.fitbit.com, slack.com など）ごとにプールを分けて keep-alive する
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# プロセス内で共有するセッションを返す
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def get(url, **kwargs):
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    return get_session().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    return get_session().post(url, **kwargs)
@@ -0,0 +1,38 @@
+from firebase_admin import firestore
+from bulk_writer import BulkWriter
+
+# 実験ごとのデータの更新時刻を保存するコレクション名
+# ingestion_status/{experiment_id} に {"last_ingested_at", "last_intervened_at", "last_backfilled_at"} を保存する
+# （ダッシュボードはこの時刻が変わった場合だけデータを読み直す。バックフィルの時刻は過去の日付のデータに使う）
+STATUS_COLLECTION = "ingestion_status"
+
+
+# データを取り込んだ実験の更新時刻を記録する
+def mark_ingested(db, experiment_ids):
+    with BulkWriter(db) as writer:
+        for experiment_id in set(experiment_ids):
+            writer.set(db.collection(STATUS_COLLECTION).document(experiment_id),
+                       {"last_ingested_at": firestore.SERVER_TIMESTAMP}, merge=True)
+
+
+# 介入を記録した実験の更新時刻を記録する
+def mark_intervened(db, experiment_id):
+    db.collection(STATUS_COLLECTION).document(experiment_id) \
+        .set({"last_intervened_at": firestore.SERVER_TIMESTAMP}, merge=True)
+
+
+# バックフィルでデータを保存した実験の更新時刻を記録する
+def mark_backfilled(db, experiment_ids):
+    with BulkWriter(db) as writer:
+        for experiment_id in set(experiment_ids):
+            writer.set(db.collection(STATUS_COLLECTION).document(experiment_id),
+                       {"last_backfilled_at": firestore.SERVER_TIMESTAMP}, merge=True)
+
+
+# 実験のデータのバージョン（更新時刻の組）を返す
+def get_data_version(db, experiment_id):
+    doc = db.collection(STATUS_COLLECTION).document(experiment_id).get()
+    if not doc.exists:
+        return None
+    status = doc.to_dict()
+    return tuple(str(status.get(field)) for field in ("last_ingested_at", "last_intervened_at", "last_backfilled_at"))
@@ -1,14 +1,20 @@
 from enum import Enum
-import requests
-from firebase_admin import firestore
-from datetime import datetime, timedelta, timezone
-from firebase_auth import initialize_firestore
-import pandas as pd
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import http_client
+from datetime import timedelta, timezone
+from intervention_features import extract_features
+from metrics import METRICS
+from runtime import RunContext
 
 # 日本時間のタイムゾーン
 JST = timezone(timedelta(hours=9))
 SLACK_TOKEN = ""
 
+# 介入の判定を並列に実行するユーザ数（ストレージの読み込みと Slack への送信を重ねる）
+MAX_INTERVENTION_WORKERS = int(os.environ.get("INTERVENTION_MAX_WORKERS", "16"))
+
 class StepResult(Enum):
     BELOW_THRESHOLD = "Below Threshold"
     WITHIN_THRESHOLD = "Within Threshold"
@@ -25,91 +31,42 @@ class InterventionMessage(Enum):
     NORMAL = "順調です！この調子で続けていきましょう 💪😊"
 
 # 介入スケジュールを取得する関数
-def get_intervention_schedule(date_str):
-    db = initialize_firestore()
-    doc_ref = db.collection("intervene_schedule").document(date_str)
-    doc = doc_ref.get()
-
-    if doc.exists:
-        data = doc.to_dict()
-        print(f"{date_str} の介入時刻:", data.get("hours"))
-        return data.get("hours")
+def get_intervention_schedule(storage, date_str):
+    hours = storage.get_schedule(date_str)
+
+    if hours is not None:
+        print(f"{date_str} の介入時刻:", hours)
+        return hours
     else:
         print(f"{date_str} の介入スケジュールは存在しません。")
         return None
 
 # 指定の時間帯に介入を行うかを判定する関数
-def should_intervene():
-    now_jst = datetime.now(JST)
-    date_str = now_jst.strftime("%Y-%m-%d")
-    current_hour = now_jst.hour
-
-    intervene_hours = get_intervention_schedule(date_str)
+def should_intervene(run):
+    intervene_hours = get_intervention_schedule(run.storage, run.date)
     if intervene_hours:
-        return current_hour in intervene_hours
+        return run.hour in intervene_hours
     return False
 
-# 直近1時間の平均を計算
-def calculate_recent_mean(experiment_id: str, data_type: str):
-    db = initialize_firestore()
-    now_jst = datetime.now(JST)
-    one_hour_ago = now_jst - timedelta(hours=1)
-    
-    # 現在の時刻の直前の1時間の範囲を指定
-    end_time = now_jst.replace(minute=0, second=0, microsecond=0)  # 直前の00分の時刻 (例: 10:00)
-    start_time = end_time - timedelta(hours=1)  # 1時間前 (例: 09:00)
-    print(f"取得対象: {start_time} 〜 {end_time}")
-
-    docs = db.collection("activity_data") \
-        .document(experiment_id) \
-        .collection(data_type) \
-        .where("timestamp", ">=", start_time) \
-        .where("timestamp", "<", end_time) \
-        .stream()
-    
-    data = [doc.to_dict() for doc in docs]
-    if not data:
-        return None
-
-    df = pd.DataFrame(data)
-    return df["value"].mean()
-
-# 過去1週間の平均と標準偏差を計算
-def calculate_weekly_mean_and_std(experiment_id: str, data_type: str):
-    db = initialize_firestore()
-    now_jst = datetime.now(JST)
-    one_week_ago = now_jst - timedelta(days=7)
-
-    docs = db.collection("activity_data") \
-        .document(experiment_id) \
-        .collection(data_type) \
-        .where("timestamp", ">=", one_week_ago) \
-        .stream()
-
-    data = [doc.to_dict() for doc in docs]
-    if not data:
-        return None, None
-    
-    # Python 側で `time` フィルタリング（9:00 ~ 21:59 の範囲）
-    filtered_data = [d for d in data if "09:00:00" <= d["time"] <= "21:59:59"]
-
-    df = pd.DataFrame(filtered_data)
-    return df["value"].mean(), df["value"].std()
-
 # 介入を実行する関数
-def should_execute_intervention(experiment_id: str, slack_dm_id: str):
-    step_mean_1h = calculate_recent_mean(experiment_id, "steps")
-    sedentary_mean_1h = calculate_recent_mean(experiment_id, "minutesSedentary")
-
-    step_mean_week, step_std_week = calculate_weekly_mean_and_std(experiment_id, "steps")
-    sedentary_mean_week, sedentary_std_week = calculate_weekly_mean_and_std(experiment_id, "minutesSedentary")
+def should_execute_intervention(run, experiment_id: str, slack_dm_id: str):
+    """
+    介入した場合は送信の結果（"sent" / "send_failed"）を、介入しない場合は None を返す。
+    """
+    # 歩数と座位時間の7日分をそれぞれ1回だけ読み込み、直近1時間と1週間の特徴量を計算する
+    with METRICS.stage("features"):
+        features = extract_features(run, experiment_id)
+    step_mean_1h = features["steps"]["recent_mean"]
+    sedentary_mean_1h = features["minutesSedentary"]["recent_mean"]
+    step_mean_week, step_std_week = features["steps"]["weekly_mean"], features["steps"]["weekly_std"]
+    sedentary_mean_week, sedentary_std_week = features["minutesSedentary"]["weekly_mean"], features["minutesSedentary"]["weekly_std"]
 
     if step_mean_1h is None or sedentary_mean_1h is None:
-        return False
+        return None
 
     if (step_mean_week is None or step_std_week is None or
         sedentary_mean_week is None or sedentary_std_week is None):
-        return False
+        return None
 
     step_threshold_low = step_mean_week - 0.5 * step_std_week
     step_threshold_high = step_mean_week + 0.5 * step_std_week
@@ -141,35 +98,29 @@ def should_execute_intervention(experiment_id: str, slack_dm_id: str):
         message = InterventionMessage.NORMAL.value
 
     # Slack DMを送信
-    send_dm(SLACK_TOKEN, experiment_id, slack_dm_id, message)
+    with METRICS.stage("send_dm") as stage:
+        response = send_dm(SLACK_TOKEN, experiment_id, slack_dm_id, message)
+        stage.error = not response.get("ok")
+    outcome = "sent" if response.get("ok") else "send_failed"
 
-    save_intervention_log(experiment_id, step_result, sedentary_result, message)
+    with METRICS.stage("save_log"):
+        save_intervention_log(run, experiment_id, step_result, sedentary_result, message, outcome)
     
-    return True
+    return outcome
 
 # 介入ログを保存する関数
-def save_intervention_log(experiment_id, step_result, sedentary_result, message):
-    db = initialize_firestore()
-    now_jst = datetime.now(JST)
-    date = now_jst.strftime("%Y-%m-%d")
-    
-    logs_ref = db.collection("intervention_logs").document(experiment_id).collection(date).document()
-    logs_ref.set({
-        "experiment_id": experiment_id,
-        "step_result": step_result.value,
-        "sedentary_result": sedentary_result.value,
-        "message": message,
-        "time": now_jst.strftime("%H:%M:%S"),
-        "timestamp": firestore.SERVER_TIMESTAMP
-    })
-    print(f"Log saved successfully: {experiment_id} - {step_result.value} / {sedentary_result.value} - {message}")
+def save_intervention_log(run, experiment_id, step_result, sedentary_result, message, outcome="sent"):
+    # 実験ごとの介入履歴のコレクションに保存する
+    run.storage.record_intervention(experiment_id, message, outcome, step_result, sedentary_result)
+    run.storage.mark_intervened(experiment_id)
+    print(f"Log saved successfully: {experiment_id} - {step_result.value} / {sedentary_result.value} - {outcome} - {message}")
 
 # Slack DM に送信する関数
 def send_dm(token, experiment_id, channel, text):
     """
     Botから指定のIDのDMに対してメッセージを送る
     """
-    url = "https://slack.com/api/chat.postMessage"
+    url = f"{http_client.SLACK_API_BASE}/chat.postMessage"
     headers = {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
@@ -179,34 +130,83 @@ def send_dm(token, experiment_id, channel, text):
         "text": text
     }
     
-    response = requests.post(url, json=payload, headers=headers)
-    
-    # レスポンスの内容をログに出力
-    print("Slack response:", response.json())
+    response = http_client.post(url, json=payload, headers=headers)
+
+    # 送信に失敗した場合のみレスポンスの内容をログに出力（送信の処理時間と成否はメトリクスに記録する）
+    result = response.json()
+    if not result.get("ok"):
+        print("Slack response:", result)
 
-    return response.json()  # APIのレスポンスを返す
+    return result  # APIのレスポンスを返す
     
+# 1ユーザの介入の判定と送信を行い、結果と処理時間を返す
+def evaluate_user(run, user):
+    started = time.monotonic()
+    result = {"experiment_id": user["experiment_id"]}
+    with METRICS.labels(experiment_id=user["experiment_id"]):
+        try:
+            outcome = should_execute_intervention(run, user["experiment_id"], user["slack_dm_id"])
+            result["outcome"] = outcome or "not_sent"
+        except Exception as e:
+            print(f"ユーザー {user['user_id']} の介入の処理に失敗しました: {e}")
+            result["outcome"] = "error"
+            result["error"] = str(e)
+        result["elapsed"] = time.monotonic() - started
+        METRICS.record("evaluate_user", result["elapsed"], error=result["outcome"] == "error", outcome=result["outcome"])
+    return result
+
+# 介入対象のユーザをスレッドプールで並列に処理する
+def run_interventions(run, user_records, max_workers=MAX_INTERVENTION_WORKERS):
+    """
+    user_records は [(user_id, ユーザ情報)]（storage.list_users() の結果）。
+    ユーザごとの結果 {user_id: {"experiment_id", "outcome", "elapsed"}} を返す。
+    outcome は "sent" / "send_failed"（Slack への送信に失敗）/ "not_sent" / "error" / "skipped"（実験IDまたはDMのIDがない）。
+    """
+    results = {}
+    users = []
+    for user_id, user_data in user_records:
+        experiment_id = user_data.get("experiment_id")
+        slack_dm_id = user_data.get("slack_dm_id")
+        if not experiment_id or not slack_dm_id:
+            results[user_id] = {"experiment_id": experiment_id, "outcome": "skipped", "elapsed": 0.0}
+            continue
+        users.append({"user_id": user_id, "experiment_id": experiment_id, "slack_dm_id": slack_dm_id})
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(evaluate_user, run, user): user["user_id"] for user in users}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
+
 # Cloud Functions で定期実行されるエントリーポイント関数
 def scheduled_intervention(data, context=None):
     """
     Cloud Functions で定期実行されるエントリーポイント関数。
     1時間に1回（例：毎時00分）実行するように設定する。
     """
-    # Firestoreの初期化
-    db = initialize_firestore()
-    users = db.collection("users").stream()
-    
-    results = []
-    for user_doc in users:
-        user_data = user_doc.to_dict()
-        experiment_id = user_data.get("experiment_id")
-        slack_dm_id = user_data["slack_dm_id"]
-        
-        if experiment_id and should_intervene():
-            triggered = should_execute_intervention(experiment_id, slack_dm_id)
-            results.append((experiment_id, triggered))
-    
-    return f"Checked interventions for all users. Results: {results}", 200
+    # 呼び出しごとの実行コンテキスト（時刻と共有のストレージ）
+    run = RunContext()
+    started = time.monotonic()
+
+    with METRICS.run("intervention"):
+        # 介入スケジュールは1回だけ確認し、介入しない時間帯ならユーザのデータを読まずに終了する
+        with METRICS.stage("schedule"):
+            intervene = should_intervene(run)
+        if not intervene:
+            return f"{run.date} {run.hour}時は介入の時間帯ではありません。", 200
+
+        with METRICS.stage("list_users") as stage:
+            users = run.storage.list_users(["experiment_id", "slack_dm_id"])
+            stage.add(items=len(users))
+        results = run_interventions(run, users)
+
+    for user_id, result in results.items():
+        print(f"ユーザー {user_id}: {result['outcome']} ({result['elapsed']:.2f}秒)")
+    sent = sum(1 for result in results.values() if result["outcome"] == "sent")
+    send_failed = sum(1 for result in results.values() if result["outcome"] == "send_failed")
+    failed = sum(1 for result in results.values() if result["outcome"] == "error")
+    return (f"Checked interventions for all users. 対象ユーザ数: {len(results)}, 送信: {sent}, 送信失敗: {send_failed}, "
+            f"エラー: {failed}, 処理時間: {time.monotonic() - started:.2f}秒"), 200
 
 # メイン処理
 if __name__ == "__main__":
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+from baseline_store import BASELINE_HOURS, JST, compute_stats, mean_and_std, merge_stats
+
+# 特徴量の計算に使う期間（直近1時間はこの期間に含まれる）
+FEATURE_WINDOW = timedelta(days=7)
+
+# 介入の判定に使うデータタイプ
+FEATURE_DATA_TYPES = ("steps", "minutesSedentary")
+
+_EMPTY = {"count": 0, "mean": 0.0, "m2": 0.0}
+
+
+# データ点 [{"date", "time", "value"}] を時間ごとの統計量 [(時の先頭の時刻, 統計量)] にまとめる
+def hourly_stats_from_points(data):
+    groups = {}
+    for data_point in data:
+        groups.setdefault((data_point["date"], data_point["time"][:2]), []).append(data_point["value"])
+    hourly = []
+    for (date, hour), values in groups.items():
+        hour_start = datetime.strptime(date, "%Y-%m-%d").replace(hour=int(hour), tzinfo=JST)
+        hourly.append((hour_start, compute_stats(values)))
+    return sorted(hourly, key=lambda item: item[0])
+
+
+# 連続する日付を [(開始時刻, 終了時刻)) の期間にまとめる
+def date_ranges(dates):
+    ranges = []
+    for date in dates:
+        day = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=JST)
+        if ranges and ranges[-1][1] == day:
+            ranges[-1] = (ranges[-1][0], day + timedelta(days=1))
+        else:
+            ranges.append((day, day + timedelta(days=1)))
+    return ranges
+
+
+# 1つのデータタイプの7日分の時間ごとの統計量を取得する
+def load_window(run, experiment_id, data_type):
+    """
+    期間は7日前の時の先頭から現在の時の終わりまで（時の区切りに揃えて query_rollups で時の段階を使う）。
+    統計量のない日は元のデータを読み込んで補う（連続する日は1回の読み込みにまとめる）。
+    一部の日だけ統計量がある場合に、少ない日数から基準値を計算しないようにするため。
+    """
+    start = (run.now - FEATURE_WINDOW).replace(minute=0, second=0, microsecond=0)
+    end = run.hour_start + timedelta(hours=1)
+    _, rows, missing = run.storage.query_rollups(experiment_id, data_type, start, end, timedelta(hours=1))
+    hourly = [(row.pop("start"), row) for row in rows]
+    for range_start, range_end in date_ranges(missing):
+        data = run.storage.read_range(experiment_id, data_type, max(range_start, start), min(range_end, run.now))
+        hourly.extend(hourly_stats_from_points(data))
+    return sorted(hourly, key=lambda item: item[0])
+
+
+# 時間ごとの統計量から介入の判定に使う特徴量を計算する
+def derive_features(run, hourly):
+    """
+    新しい特徴量はここに追加する（読み込み済みの統計量から計算するため、ストレージの読み込みは増えない）。
+    """
+    recent_start = run.hour_start - timedelta(hours=1)
+    recent = _EMPTY
+    weekly = _EMPTY
+    for hour_start, stats in hourly:
+        # 直近1時間（例: 10:23 の実行なら 09:00 ~ 10:00）
+        if hour_start == recent_start:
+            recent = merge_stats(recent, stats)
+        # 1週間のうち介入の時間帯（9:00 ~ 21:59）
+        if hour_start.hour in BASELINE_HOURS:
+            weekly = merge_stats(weekly, stats)
+
+    recent_mean, _ = mean_and_std(recent)
+    weekly_mean, weekly_std = mean_and_std(weekly)
+    return {
+        "recent_mean": recent_mean,
+        "weekly_mean": weekly_mean,
+        "weekly_std": weekly_std,
+    }
+
+
+# ユーザ（実験ID）の特徴量をデータタイプごとに計算する（データタイプごとに1回の読み込み）
+def extract_features(run, experiment_id, data_types=FEATURE_DATA_TYPES):
+    return {data_type: derive_features(run, load_window(run, experiment_id, data_type)) for data_type in data_types}
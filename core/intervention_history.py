@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta, timezone
+from firebase_admin import firestore
+from rollups import paginate
+from storage import intervention_id
+
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+# 介入の記録を実験ごとに1つのコレクションにまとめて保存する
+# intervention_history/{experiment_id}/intervention_records/{YYYY-MM-DD}T{HH}-{記録元}
+# （日付ごとのサブコレクションではないため、期間や時間帯での検索が1回のクエリで済む）
+HISTORY_COLLECTION = "intervention_history"
+RECORDS_COLLECTION = "intervention_records"
+
+# 従来の日付ごとのサブコレクション（読み込み時のフォールバックに使う）
+LEGACY_COLLECTIONS = ["interventions", "intervention_logs"]
+
+
+# 実験の介入記録のコレクションを返す
+def records_collection(db, experiment_id):
+    return db.collection(HISTORY_COLLECTION).document(experiment_id).collection(RECORDS_COLLECTION)
+
+
+# 介入を記録する
+def record_intervention(db, experiment_id, message, outcome, step_result=None, sedentary_result=None,
+                        source="intervention", now=None):
+    """
+    outcome は "sent"（送信成功）/ "send_failed"（Slack への送信に失敗）など。
+    step_result, sedentary_result は判定結果の Enum（判定を伴わない介入では None）。
+    IDは介入の時間帯と記録元（source）から作るため、再実行しても重複せず、
+    同じ時間帯に別の記録元（data_crawler と intervention など）が記録しても上書きしない。
+    """
+    now = now or datetime.now(JST)
+    record = {
+        "experiment_id": experiment_id,
+        "timestamp": now,
+        "date": now.strftime("%Y-%m-%d"),
+        "time": now.strftime("%H:%M:%S"),
+        "hour": now.hour,
+        "outcome": outcome,
+        "message": message,
+        "step_result": step_result.value if step_result else None,
+        "sedentary_result": sedentary_result.value if sedentary_result else None,
+        "source": source,
+        "created_at": firestore.SERVER_TIMESTAMP,
+    }
+    records_collection(db, experiment_id).document(intervention_id(record["date"], now.hour, source)).set(record)
+    return record
+
+
+# ドキュメントを記録ID付きの介入記録にする
+def _to_record(doc):
+    return {"record_id": doc.id, **doc.to_dict()}
+
+
+# 実験の期間 [start, end) の介入記録を時刻順に取得する
+def query_history(db, experiment_id, start, end):
+    docs = records_collection(db, experiment_id) \
+        .where("timestamp", ">=", start) \
+        .where("timestamp", "<", end) \
+        .order_by("timestamp") \
+        .stream()
+    return [_to_record(doc) for doc in docs]
+
+
+# 指定した日の介入記録を取得する（新しい形式になければ従来のサブコレクションから取得する）
+def history_for_date(db, experiment_id, date):
+    start = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=JST)
+    records = query_history(db, experiment_id, start, start + timedelta(days=1))
+    if records:
+        return records
+
+    for collection in LEGACY_COLLECTIONS:
+        docs = db.collection(collection).document(experiment_id).collection(date).stream()
+        records.extend(doc.to_dict() for doc in docs)
+    return sorted(records, key=lambda record: record.get("time", ""))
+
+
+# 全実験の期間 [start, end) の介入記録を時刻順に取得する（hour を指定した場合はその時間帯のみ）
+def query_all_experiments(db, start, end, hour=None):
+    """
+    コレクショングループクエリのため、hour を指定する場合は hour と timestamp の複合インデックスが必要。
+    件数が多くなる（分析用の同期など）ため、ページに分けて読み込む。
+    """
+    query = db.collection_group(RECORDS_COLLECTION)
+    if hour is not None:
+        query = query.where("hour", "==", hour)
+    query = query.where("timestamp", ">=", start) \
+        .where("timestamp", "<", end) \
+        .order_by("timestamp")
+    return [_to_record(doc) for doc in paginate(query)]
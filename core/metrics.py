@@ -0,0 +1,216 @@
+"""
+処理の段階（取得・変換・書き込み・介入・ダッシュボードのクエリなど）ごとの処理時間・件数・バイト数を記録する。
+
+    with METRICS.run("ingestion"):
+        with METRICS.labels(experiment_id="exp001", data_type="steps"):
+            with METRICS.stage("fetch") as stage:
+                response = http_client.get(url)
+                stage.add(bytes=len(response.content))
+
+実行の終わりに段階ごとの集計を1行の JSON ログ（Cloud Logging の構造化ログ）で出力する。
+METRICS_LOG=stage を指定した場合は、デバッグ用に段階ごとのログも出力する。
+METRICS_PROM_DIR を指定した場合は、実行ごとの集計を Prometheus のテキスト形式（{実行名}.prom）でも保存する。
+
+ラベル（experiment_id, data_type など）は METRICS.labels で設定し、同じスレッド内の段階に引き継がれる。
+段階ごとのログにはすべてのラベルを付けるが、集計は AGGREGATE_LABELS のラベルごとにまとめる
+（実験IDごとに分けると参加者数に比例して系列が増えるため）。
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+# ログの出力: "summary"（実行の集計のみ。既定）/ "stage"（段階ごとと実行の集計。デバッグ用）/ "off"
+METRICS_LOG = os.environ.get("METRICS_LOG", "summary")
+
+# Prometheus のテキスト形式で集計を保存するディレクトリ（未指定なら保存しない）
+METRICS_PROM_DIR = os.environ.get("METRICS_PROM_DIR")
+
+# 集計に使うラベル
+AGGREGATE_LABELS = ("data_type", "query")
+
+# Prometheus のメトリクス名の接頭辞
+METRIC_PREFIX = "fitbit_tracker"
+
+# 現在のスレッド（コンテキスト）のラベル
+_labels = contextvars.ContextVar("metrics_labels", default={})
+
+
+class Stage:
+    """
+    1回の段階の記録。件数とバイト数は add で加算し、失敗した場合は error を True にする。
+    """
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.items = 0
+        self.bytes = 0
+        self.error = False
+        self.seconds = 0.0
+
+    def add(self, items=0, bytes=0):
+        self.items += items
+        self.bytes += bytes
+
+
+class Metrics:
+    """
+    段階ごとの集計 {(段階, 集計ラベル): {"calls", "seconds", "max_seconds", "items", "bytes", "errors"}} を保持する。
+    集計は METRICS.run で実行ごとに作り直す（ウォームインスタンスでも前回の実行の値を含めない）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._run = None
+        self._totals = {}
+
+    # 現在のラベルに追加したラベルで処理を実行する
+    @contextmanager
+    def labels(self, **labels):
+        token = _labels.set(_current_labels(labels))
+        try:
+            yield
+        finally:
+            _labels.reset(token)
+
+    # 段階の処理時間を計測する（例外が発生した場合は失敗として記録して送出する）
+    @contextmanager
+    def stage(self, name, **labels):
+        stage = Stage(name, _current_labels(labels))
+        started = time.perf_counter()
+        try:
+            yield stage
+        except BaseException:
+            stage.error = True
+            raise
+        finally:
+            stage.seconds = time.perf_counter() - started
+            self._record(stage)
+
+    # 計測済みの処理時間を記録する（別の方法で時間を計測した場合）
+    def record(self, name, seconds, items=0, bytes=0, error=False, **labels):
+        stage = Stage(name, _current_labels(labels))
+        stage.add(items, bytes)
+        stage.seconds = seconds
+        stage.error = error
+        self._record(stage)
+
+    def _record(self, stage):
+        key = (stage.name, tuple((label, stage.labels[label]) for label in AGGREGATE_LABELS if label in stage.labels))
+        with self._lock:
+            total = self._totals.setdefault(key, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "items": 0, "bytes": 0, "errors": 0})
+            total["calls"] += 1
+            total["seconds"] += stage.seconds
+            total["max_seconds"] = max(total["max_seconds"], stage.seconds)
+            total["items"] += stage.items
+            total["bytes"] += stage.bytes
+            total["errors"] += int(stage.error)
+            run = self._run
+        if METRICS_LOG == "stage":
+            _log({
+                "message": f"stage {stage.name}",
+                "run": run,
+                "stage": stage.name,
+                "seconds": round(stage.seconds, 6),
+                "items": stage.items,
+                "bytes": stage.bytes,
+                "error": stage.error,
+                **stage.labels,
+            }, "ERROR" if stage.error else "INFO")
+
+    # 段階ごとの集計を返す
+    def snapshot(self):
+        with self._lock:
+            return [
+                {"stage": name, **dict(labels), **total}
+                for (name, labels), total in sorted(self._totals.items(), key=lambda item: -item[1]["seconds"])
+            ]
+
+    # 1回の実行（エントリーポイントの呼び出し）の集計を作り、終わりに出力する
+    @contextmanager
+    def run(self, name):
+        with self._lock:
+            self._run = name
+            self._totals = {}
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - started
+            stages = self.snapshot()
+            if METRICS_LOG != "off":
+                _log({"message": f"run {name}", "run": name, "seconds": round(seconds, 6), "stages": stages})
+            if METRICS_PROM_DIR:
+                try:
+                    write_prometheus(os.path.join(METRICS_PROM_DIR, f"{name}.prom"), name, seconds, stages)
+                except OSError as e:
+                    print(f"メトリクスの保存に失敗しました: {e}")
+            with self._lock:
+                self._run = None
+
+
+# 現在のラベルに追加したラベルを返す（値が None のラベルは付けない）
+def _current_labels(labels):
+    return {**_labels.get(), **{key: value for key, value in labels.items() if value is not None}}
+
+
+# 構造化ログを1行の JSON で出力する
+def _log(entry, severity="INFO"):
+    print(json.dumps({"severity": severity, "time": datetime.now(JST).isoformat(), **entry}, ensure_ascii=False, default=str))
+
+
+# Prometheus のラベルの値をエスケープする
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _series(name, labels, value):
+    text = ",".join(f'{key}="{_escape(labels[key])}"' for key in labels)
+    return f"{METRIC_PREFIX}_{name}{{{text}}} {value}"
+
+
+# 実行の集計を Prometheus のテキスト形式で保存する（node_exporter の textfile collector で読み込める）
+def write_prometheus(path, run, seconds, stages):
+    metrics = [
+        ("stage_seconds", "summary", "各段階の処理時間（秒）", None),
+        ("stage_max_seconds", "gauge", "各段階の1回あたりの最大の処理時間（秒）", "max_seconds"),
+        ("stage_items", "gauge", "各段階で処理した件数", "items"),
+        ("stage_bytes", "gauge", "各段階で処理したバイト数", "bytes"),
+        ("stage_errors", "gauge", "各段階で失敗した回数", "errors"),
+    ]
+    lines = [
+        f"# HELP {METRIC_PREFIX}_run_seconds 直近の実行の処理時間（秒）",
+        f"# TYPE {METRIC_PREFIX}_run_seconds gauge",
+        _series("run_seconds", {"run": run}, seconds),
+        f"# HELP {METRIC_PREFIX}_run_timestamp_seconds 直近の実行の終了時刻（UNIX 時間）",
+        f"# TYPE {METRIC_PREFIX}_run_timestamp_seconds gauge",
+        _series("run_timestamp_seconds", {"run": run}, time.time()),
+    ]
+    for name, kind, help_text, field in metrics:
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+        for stage in stages:
+            labels = {"run": run, "stage": stage["stage"], **{label: stage[label] for label in AGGREGATE_LABELS if label in stage}}
+            if field is None:
+                lines.append(_series(f"{name}_sum", labels, stage["seconds"]))
+                lines.append(_series(f"{name}_count", labels, stage["calls"]))
+            else:
+                lines.append(_series(name, labels, stage[field]))
+
+    # 書き込み途中のファイルを読まれないように、一時ファイルに書いてから置き換える
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temporary, path)
+
+
+# プロセス内で共有するメトリクス
+METRICS = Metrics()
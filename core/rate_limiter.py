@@ -0,0 +1,121 @@
+import threading
+import time
+
+# Fitbit APIはユーザトークンごとに1時間あたり約150リクエストまで
+DEFAULT_LIMIT = 150
+
+# 残数のリセット周期（秒）。Fitbitは毎時00分にリセットされる
+RESET_PERIOD = 3600
+
+# バケットの状態を保存するコレクション名（定期実行とバックフィルで同じ残数を共有する）
+RATE_LIMIT_COLLECTION = "rate_limits"
+
+
+class RateLimitExceeded(Exception):
+    """
+    レート制限の残数がない場合に送出する例外。
+    retry_at は残数が回復する時刻（Unix時刻）。呼び出し側でユーザを後回しにするために使う。
+    """
+
+    def __init__(self, message, retry_at=None):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+
+# 次の毎時00分（Unix時刻）を返す
+def _next_reset(now):
+    return (int(now) // RESET_PERIOD + 1) * RESET_PERIOD
+
+
+class RateLimiter:
+    """
+    ユーザごとのトークンバケット。
+    Fitbit のレスポンスヘッダ（Fitbit-Rate-Limit-Remaining / Fitbit-Rate-Limit-Reset）で残数とリセット時刻を補正する。
+    """
+
+    def __init__(self, limit=DEFAULT_LIMIT):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    # ユーザのバケットを取得する（リセット時刻を過ぎていれば満タンに戻す）
+    def _bucket(self, user_id, now):
+        bucket = self._buckets.get(user_id)
+        if bucket is None or now >= bucket["reset_at"]:
+            bucket = {"remaining": self.limit, "reset_at": _next_reset(now)}
+            self._buckets[user_id] = bucket
+        return bucket
+
+    # 現在の残数を返す
+    def remaining(self, user_id):
+        with self._lock:
+            return self._bucket(user_id, time.time())["remaining"]
+
+    # リクエスト1回分の残数を確保する。残数がなければ待機せずに RateLimitExceeded を送出する
+    def acquire(self, user_id, reserve=0):
+        """
+        reserve を指定すると、残数がその値を下回らない範囲でのみ確保する。
+        バックフィルなど優先度の低い処理が定期実行の分を使い切らないようにするために使う。
+        ワーカーのスレッドを待機で塞がないよう、残数の回復は呼び出し側で待つ（ユーザを後回しにする）。
+        """
+        with self._lock:
+            now = time.time()
+            bucket = self._bucket(user_id, now)
+            if bucket["remaining"] > reserve:
+                bucket["remaining"] -= 1
+                return
+            reset_at = bucket["reset_at"]
+        raise RateLimitExceeded(f"ユーザ {user_id} のレート制限の残数がありません（リセットまで {int(reset_at - now)} 秒）", reset_at)
+
+    # レスポンスヘッダから残数とリセット時刻を反映する
+    def update(self, user_id, headers):
+        remaining = headers.get("Fitbit-Rate-Limit-Remaining")
+        reset = headers.get("Fitbit-Rate-Limit-Reset")
+        if remaining is None or reset is None:
+            return
+
+        with self._lock:
+            now = time.time()
+            bucket = self._bucket(user_id, now)
+            reset_at = now + int(reset)
+            if reset_at > bucket["reset_at"] + 60:
+                # 新しい時間枠に入っている場合はサーバ側の値をそのまま使う
+                bucket["remaining"] = int(remaining)
+            else:
+                # 並列に送信中のリクエストがあるため、小さい方を採用する
+                bucket["remaining"] = min(bucket["remaining"], int(remaining))
+            bucket["reset_at"] = reset_at
+            limit = headers.get("Fitbit-Rate-Limit-Limit")
+            if limit is not None:
+                self.limit = int(limit)
+
+    # 429 が返ってきた場合はリセットまで残数を0にし、リセットの時刻を返す
+    def on_rate_limited(self, user_id, headers):
+        reset = headers.get("Fitbit-Rate-Limit-Reset") or headers.get("Retry-After")
+        with self._lock:
+            now = time.time()
+            bucket = self._bucket(user_id, now)
+            bucket["remaining"] = 0
+            bucket["reset_at"] = now + int(reset) if reset is not None else _next_reset(now)
+            return bucket["reset_at"]
+
+    # ストレージに保存された残数を読み込む
+    def load_state(self, storage, user_ids):
+        now = time.time()
+        for user_id, state in storage.load_rate_limits(user_ids).items():
+            if state.get("reset_at", 0) <= now:
+                continue
+            with self._lock:
+                bucket = self._bucket(user_id, now)
+                bucket["remaining"] = min(bucket["remaining"], state["remaining"])
+                bucket["reset_at"] = state["reset_at"]
+
+    # 現在の残数をストレージに保存する
+    def save_state(self, storage, user_ids):
+        with self._lock:
+            states = {user_id: dict(self._buckets[user_id]) for user_id in user_ids if user_id in self._buckets}
+        storage.save_rate_limits(states)
+
+
+# プロセス内で共有するレートリミッタ
+RATE_LIMITER = RateLimiter()
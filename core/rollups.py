@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+from baseline_store import JST, STATS_COLLECTION, compute_stats, merge_stats
+from compact_storage import BUCKET_COLLECTION, RAW_COLLECTION, decode_bucket, read_range
+from storage import choose_tier
+
+# ページングで1回に取得するドキュメント数
+PAGE_SIZE = 31
+
+# ロールアップのない日の集計に必要なフィールド（バケットと従来形式の両方）
+DAY_STATS_FIELDS = ["user_id", "value", "offsets", "values"]
+
+_EMPTY_STATS = {"count": 0, "mean": 0.0, "m2": 0.0}
+
+
+# ロールアップのドキュメント（1日1ドキュメント）を日付順に取得する（field は "hours" か "day"）
+def _load_stats_docs(db, experiment_id, data_type, start, end, field):
+    query = db.collection(STATS_COLLECTION) \
+        .document(experiment_id) \
+        .collection(data_type) \
+        .where("date", ">=", start.strftime("%Y-%m-%d")) \
+        .where("date", "<=", (end - timedelta(microseconds=1)).strftime("%Y-%m-%d")) \
+        .order_by("date") \
+        .select(["date", field])
+    return [doc.to_dict() for doc in paginate(query)]
+
+
+# 期間 [start, end) に含まれる日付のリストを返す
+def _dates_between(start, end):
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    dates = []
+    while day < end:
+        dates.append(day.strftime("%Y-%m-%d"))
+        day += timedelta(days=1)
+    return dates
+
+
+# 期間 [start, end) の集計値を resolution 以下の間隔で取得する
+def query_rollups(db, experiment_id, data_type, start, end, resolution):
+    """
+    start, end は JST の datetime、resolution は timedelta。
+    日・時の段階では [{"start", "count", "mean", "sum", "min", "max", ...}] を、
+    raw の段階では [{"date", "time", "value"}] を返す。
+    日・時の段階はどちらも1日1ドキュメントを読むだけなので、1週間でも7件の読み込みで済む。
+    ロールアップのドキュメント（またはその段階のフィールド）がない日付は、集計値のない日付として返す。
+    """
+    tier = choose_tier(start, end, resolution)
+    if tier == "raw":
+        return tier, read_range(db, experiment_id, data_type, start, end), []
+
+    field = "day" if tier == "day" else "hours"
+    rows = []
+    covered = set()
+    for data in _load_stats_docs(db, experiment_id, data_type, start, end, field):
+        if field not in data:
+            continue
+        covered.add(data["date"])
+        day = datetime.strptime(data["date"], "%Y-%m-%d").replace(tzinfo=JST)
+        if tier == "day":
+            rows.append({"start": day, **data["day"]})
+            continue
+        for hour, stats in data["hours"].items():
+            hour_start = day + timedelta(hours=int(hour))
+            if start <= hour_start < end:
+                rows.append({"start": hour_start, **stats})
+    missing = [date for date in _dates_between(start, end) if date not in covered]
+    return tier, sorted(rows, key=lambda row: row["start"]), missing
+
+
+# 複数の実験の指定した日の日ロールアップをまとめて取得する（1回の読み込み）
+def get_day_rollups(db, experiment_ids, data_type, date):
+    """
+    {experiment_id: ロールアップのドキュメント} を返す（ロールアップのない実験は含まない）。
+    """
+    refs = [
+        db.collection(STATS_COLLECTION).document(experiment_id).collection(data_type).document(date)
+        for experiment_id in experiment_ids
+    ]
+    rollups = {}
+    # get_all の結果は順不同のため、パスから実験IDを取り出す
+    for doc in db.get_all(refs) if refs else []:
+        if doc.exists and "day" in doc.to_dict():
+            rollups[doc.reference.path.split("/")[1]] = doc.to_dict()
+    return rollups
+
+
+# ロールアップのない実験のために、全実験・全ユーザの1日分の統計量を1回のストリームで集計する
+def day_stats_from_documents(db, data_type, date):
+    """
+    コレクショングループクエリで activity_buckets と activity_data の両方を1回で読み込み、
+    ドキュメントのパスでどちらのコレクションかを判定する。
+    同じユーザ・日にバケットがある場合はバケットを優先する（"both" 形式での二重集計を防ぐ）。
+    {(experiment_id, user_id): 統計量} を返す。
+    ※ コレクショングループでの date の単一フィールドインデックスを有効にしておくこと。
+    """
+    docs = db.collection_group(data_type) \
+        .where("date", "==", date) \
+        .select(DAY_STATS_FIELDS) \
+        .stream()
+
+    buckets = {}
+    raw = {}
+    for doc in docs:
+        root, experiment_id = doc.reference.path.split("/")[:2]
+        data = doc.to_dict()
+        key = (experiment_id, data.get("user_id"))
+        if root == BUCKET_COLLECTION:
+            _, values = decode_bucket(data)
+            if len(values):
+                buckets[key] = merge_stats(buckets.get(key, _EMPTY_STATS), compute_stats(values))
+        elif root == RAW_COLLECTION:
+            raw[key] = merge_stats(raw.get(key, _EMPTY_STATS), compute_stats([data["value"]]))
+    return {**raw, **buckets}
+
+
+# クエリをページに分けて実行し、ドキュメントを順に返す（1回の読み込み数を page_size までに抑える）
+def paginate(query, page_size=PAGE_SIZE):
+    """
+    query は order_by で並び順を指定しておくこと。
+    """
+    query = query.limit(page_size)
+    last = None
+    while True:
+        page = list((query.start_after(last) if last is not None else query).stream())
+        yield from page
+        if len(page) < page_size:
+            return
+        last = page[-1]
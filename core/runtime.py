@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta, timezone
+from storage import get_storage
+
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+
+class RunContext:
+    """
+    Cloud Functions の呼び出しごとに作成する実行コンテキスト。
+    モジュールの読み込み時ではなく呼び出し時の時刻を基準にするため、ウォームインスタンスでも古い時間帯を参照しない。
+    ストレージ（Firestore クライアントなど）はプロセス内で共有されているものを使う。
+    """
+
+    def __init__(self, now=None, storage=None):
+        self.now = now or datetime.now(JST)
+        self._storage = storage
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            self._storage = get_storage()
+        return self._storage
+
+    # 今日の日付 (YYYY-MM-DD)
+    @property
+    def date(self):
+        return self.now.strftime("%Y-%m-%d")
+
+    # 前日の日付 (YYYY-MM-DD)
+    @property
+    def yesterday(self):
+        return (self.now - timedelta(days=1)).strftime("%Y-%m-%d")
+
+    @property
+    def hour(self):
+        return self.now.hour
+
+    # 現在の時の先頭の時刻 (例: 10:23 → 10:00)
+    @property
+    def hour_start(self):
+        return self.now.replace(minute=0, second=0, microsecond=0)
@@ -1,7 +1,7 @@
-import requests
+import http_client
 
 def send_dm(token, channel, text):
-    url = "https://slack.com/api/chat.postMessage"
+    url = f"{http_client.SLACK_API_BASE}/chat.postMessage"
     headers = {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
@@ -11,7 +11,7 @@ def send_dm(token, channel, text):
         "text": text
     }
     
-    response = requests.post(url, json=payload, headers=headers)
+    response = http_client.post(url, json=payload, headers=headers)
     
     # レスポンスの内容をログに出力
     print("Slack response:", response.json())
@@ -0,0 +1,438 @@
+import json
+import sqlite3
+import threading
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from storage import Storage, choose_tier, intervention_id, progress_id
+from transform_kernels import format_times
+
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+# 日本時間の UTC からのずれ（秒）。日付・時の区切りを SQL 内で計算するために使う
+JST_OFFSET = 9 * 3600
+
+# 他の接続が書き込み中の場合に待機する最大秒数
+BUSY_TIMEOUT = 30
+
+# テーブル定義
+# activity: 1データ点1行。主キー（実験ID, データタイプ, 時刻）の順で並ぶため、期間の読み込みは索引の範囲走査で済む
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS activity (
+    experiment_id TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (experiment_id, data_type, ts, user_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS summaries (
+    experiment_id TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    date TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    PRIMARY KEY (experiment_id, data_type, date, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS schedules (
+    date TEXT PRIMARY KEY,
+    hours TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS interventions (
+    experiment_id TEXT NOT NULL,
+    record_id TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    outcome TEXT,
+    message TEXT,
+    step_result TEXT,
+    sedentary_result TEXT,
+    source TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (experiment_id, record_id)
+);
+CREATE INDEX IF NOT EXISTS interventions_ts ON interventions (experiment_id, ts);
+CREATE INDEX IF NOT EXISTS interventions_hour ON interventions (hour, ts);
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS watermarks (
+    user_id TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    ts REAL NOT NULL,
+    PRIMARY KEY (user_id, data_type)
+);
+
+CREATE TABLE IF NOT EXISTS rate_limits (
+    user_id TEXT PRIMARY KEY,
+    remaining INTEGER NOT NULL,
+    reset_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS status (
+    experiment_id TEXT PRIMARY KEY,
+    last_ingested_at TEXT,
+    last_intervened_at TEXT,
+    last_backfilled_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS backfill_progress (
+    id TEXT PRIMARY KEY,
+    experiment_id TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    date TEXT NOT NULL,
+    written INTEGER NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS backfill_progress_experiment ON backfill_progress (experiment_id);
+"""
+
+# 統計量を計算する列（件数・合計・二乗和・最小・最大）
+STATS_COLUMNS = "COUNT(*), SUM(value), SUM(value * value), MIN(value), MAX(value)"
+
+# 介入記録の列
+INTERVENTION_COLUMNS = "experiment_id, record_id, ts, date, time, hour, outcome, message, step_result, sedentary_result, source, created_at"
+
+
+# "YYYY-MM-DD" の0時（JST）の Unix 時刻を返す
+def _day_start(date):
+    return int(datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=JST).timestamp())
+
+
+# 集計した列から統計量を作成する（偏差平方和は二乗和から求める）
+def _stats(count, total, squares, minimum, maximum):
+    mean = total / count
+    return {
+        "count": count,
+        "mean": mean,
+        "m2": max(squares - total * mean, 0.0),
+        "sum": total,
+        "min": minimum,
+        "max": maximum,
+    }
+
+
+# Unix 時刻の配列を [{"date", "time", "value"}] に変換する
+def _to_points(rows):
+    if not rows:
+        return []
+    ts = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)) + JST_OFFSET
+    days, seconds = np.divmod(ts, 86400)
+    dates = days.astype("datetime64[D]").astype(str).tolist()
+    return [
+        {"date": date, "time": time, "value": row[1]}
+        for date, time, row in zip(dates, format_times(seconds), rows)
+    ]
+
+
+# 介入記録の行を辞書に変換する
+def _to_interventions(rows):
+    return [
+        {
+            "record_id": record_id,
+            "experiment_id": experiment_id,
+            "timestamp": datetime.fromtimestamp(ts, JST),
+            "date": date,
+            "time": time,
+            "hour": hour,
+            "outcome": outcome,
+            "message": message,
+            "step_result": step_result,
+            "sedentary_result": sedentary_result,
+            "source": source,
+            "created_at": datetime.fromisoformat(created_at),
+        }
+        for experiment_id, record_id, ts, date, time, hour, outcome, message, step_result, sedentary_result, source,
+        created_at in rows
+    ]
+
+
+# ユーザ情報の datetime を JSON に保存できる形にする
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"{type(value).__name__} は保存できません")
+
+
+def _decode(value):
+    if set(value) == {"$datetime"}:
+        return datetime.fromisoformat(value["$datetime"])
+    return value
+
+
+class SQLiteStorage(Storage):
+    """
+    1つの SQLite ファイルに保存する実装（WAL モード）。1台で完結する運用やベンチマークに使う。
+    接続はスレッドごとに作成するため、path にはファイルのパスを指定すること（":memory:" は使えない）。
+    時間・日ごとの統計量はロールアップを保存せず、query_rollups の読み込み時に GROUP BY で集計する。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        # 以前のスキーマ（時刻が主キー）で作成した介入記録のテーブルは、記録IDを主キーにして作り直す
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(interventions)")}
+        migrate = bool(columns) and "record_id" not in columns
+        if migrate:
+            conn.executescript("ALTER TABLE interventions RENAME TO interventions_old; DROP INDEX IF EXISTS interventions_hour;")
+        conn.executescript(SCHEMA)
+        if migrate:
+            conn.executescript(
+                f"INSERT OR REPLACE INTO interventions ({INTERVENTION_COLUMNS}) "
+                "SELECT experiment_id, date || 'T' || printf('%02d', hour) || '-' || COALESCE(source, 'intervention'), "
+                "ts, date, time, hour, outcome, message, step_result, sedentary_result, COALESCE(source, 'intervention'), "
+                "created_at FROM interventions_old ORDER BY ts; DROP TABLE interventions_old;"
+            )
+        # 以前のスキーマで作成したファイルには列を追加する
+        if "last_backfilled_at" not in {row[1] for row in conn.execute("PRAGMA table_info(status)")}:
+            conn.execute("ALTER TABLE status ADD COLUMN last_backfilled_at TEXT")
+
+    # このスレッドの接続を返す
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- ユーザ ---
+
+    def list_users(self, fields=None):
+        users = []
+        for user_id, data in self._connect().execute("SELECT user_id, data FROM users ORDER BY user_id"):
+            user = json.loads(data, object_hook=_decode)
+            if fields:
+                user = {field: user[field] for field in fields if field in user}
+            users.append((user_id, user))
+        return users
+
+    def get_user(self, user_id):
+        row = self._connect().execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0], object_hook=_decode) if row else None
+
+    def set_user(self, user_id, data):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)",
+                         (user_id, json.dumps(data, default=_encode)))
+
+    def update_user(self, user_id, fields):
+        with self._connect() as conn:
+            row = conn.execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"ユーザ {user_id} は存在しません")
+            data = {**json.loads(row[0], object_hook=_decode), **fields}
+            conn.execute("UPDATE users SET data = ? WHERE user_id = ?", (json.dumps(data, default=_encode), user_id))
+
+    # --- 活動データ ---
+
+    def write_points(self, user_id, experiment_id, data_type, date, seconds, values):
+        ts = (np.asarray(seconds, dtype=np.int64) + _day_start(date)).tolist()
+        rows = zip([experiment_id] * len(ts), [data_type] * len(ts), ts, [user_id] * len(ts), values.tolist())
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO activity (experiment_id, data_type, ts, user_id, value) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(ts)
+
+    # 期間 [start_ts, end_ts) のデータ点を読み込む
+    def _read(self, experiment_id, data_type, start_ts, end_ts):
+        rows = self._connect().execute(
+            "SELECT ts, value FROM activity WHERE experiment_id = ? AND data_type = ? AND ts >= ? AND ts < ? ORDER BY ts",
+            (experiment_id, data_type, start_ts, end_ts),
+        ).fetchall()
+        return _to_points(rows)
+
+    def read_day(self, experiment_id, data_type, date):
+        start = _day_start(date)
+        return self._read(experiment_id, data_type, start, start + 86400)
+
+    def read_range(self, experiment_id, data_type, start, end):
+        return self._read(experiment_id, data_type, int(start.timestamp()), int(end.timestamp()))
+
+    def query_rollups(self, experiment_id, data_type, start, end, resolution):
+        tier = choose_tier(start, end, resolution)
+        if tier == "raw":
+            return tier, self.read_range(experiment_id, data_type, start, end), []
+
+        # JST の日・時の区切りごとに、区切りの先頭の Unix 時刻でまとめる
+        size = 86400 if tier == "day" else 3600
+        rows = self._connect().execute(
+            f"SELECT (ts + {JST_OFFSET}) / {size} * {size} - {JST_OFFSET} AS start, {STATS_COLUMNS} FROM activity "
+            "WHERE experiment_id = ? AND data_type = ? AND ts >= ? AND ts < ? GROUP BY start ORDER BY start",
+            (experiment_id, data_type, int(start.timestamp()), int(end.timestamp())),
+        ).fetchall()
+        # データ点から集計するため、集計値のない日付はない
+        return tier, [{"start": datetime.fromtimestamp(row[0], JST), **_stats(*row[1:])} for row in rows], []
+
+    def day_stats_by_user(self, experiment_ids, data_type, date):
+        if not experiment_ids:
+            return {}
+        start = _day_start(date)
+        placeholders = ", ".join("?" * len(experiment_ids))
+        rows = self._connect().execute(
+            f"SELECT experiment_id, user_id, {STATS_COLUMNS} FROM activity "
+            f"WHERE experiment_id IN ({placeholders}) AND data_type = ? AND ts >= ? AND ts < ? "
+            "GROUP BY experiment_id, user_id",
+            (*experiment_ids, data_type, start, start + 86400),
+        ).fetchall()
+        return {(row[0], row[1]): _stats(*row[2:]) for row in rows}
+
+    # --- 日次集計 ---
+
+    def write_summaries(self, data_type, date, summaries):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO summaries (experiment_id, data_type, date, user_id, summary) VALUES (?, ?, ?, ?, ?)",
+                [(experiment_id, data_type, date, user_id, json.dumps(summary))
+                 for (experiment_id, user_id), summary in summaries.items()],
+            )
+        return len(summaries)
+
+    def read_summaries(self, experiment_id, data_type, start_date, end_date):
+        rows = self._connect().execute(
+            "SELECT user_id, date, summary FROM summaries "
+            "WHERE experiment_id = ? AND data_type = ? AND date >= ? AND date <= ? ORDER BY date",
+            (experiment_id, data_type, start_date, end_date),
+        )
+        return [
+            {"user_id": user_id, "experiment_id": experiment_id, "data_type": data_type, "date": date,
+             **json.loads(summary)}
+            for user_id, date, summary in rows
+        ]
+
+    # --- 介入スケジュール・介入記録 ---
+
+    def get_schedule(self, date):
+        row = self._connect().execute("SELECT hours FROM schedules WHERE date = ?", (date,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_schedule(self, date, hours):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO schedules (date, hours) VALUES (?, ?)", (date, json.dumps(hours)))
+
+    def record_intervention(self, experiment_id, message, outcome, step_result=None, sedentary_result=None,
+                            source="intervention", now=None):
+        now = now or datetime.now(JST)
+        record = {
+            "experiment_id": experiment_id,
+            "timestamp": now,
+            "date": now.strftime("%Y-%m-%d"),
+            "time": now.strftime("%H:%M:%S"),
+            "hour": now.hour,
+            "outcome": outcome,
+            "message": message,
+            "step_result": step_result.value if step_result else None,
+            "sedentary_result": sedentary_result.value if sedentary_result else None,
+            "source": source,
+            "created_at": datetime.now(JST),
+        }
+        # 同じ時間帯・記録元の記録は置き換えるため、再実行しても重複しない
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO interventions ({INTERVENTION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (experiment_id, intervention_id(record["date"], now.hour, source), int(now.timestamp()), record["date"],
+                 record["time"], record["hour"], outcome, message, record["step_result"], record["sedentary_result"],
+                 source, record["created_at"].isoformat()),
+            )
+        return record
+
+    def interventions_for_date(self, experiment_id, date):
+        start = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=JST)
+        return self.query_history(experiment_id, start, start + timedelta(days=1))
+
+    def query_history(self, experiment_id, start, end):
+        rows = self._connect().execute(
+            f"SELECT {INTERVENTION_COLUMNS} FROM interventions WHERE experiment_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+            (experiment_id, int(start.timestamp()), int(end.timestamp())),
+        )
+        return _to_interventions(rows)
+
+    def query_all_experiments(self, start, end, hour=None):
+        query = f"SELECT {INTERVENTION_COLUMNS} FROM interventions WHERE ts >= ? AND ts < ?"
+        params = (int(start.timestamp()), int(end.timestamp()))
+        if hour is not None:
+            query += " AND hour = ?"
+            params += (hour,)
+        return _to_interventions(self._connect().execute(query + " ORDER BY ts", params))
+
+    # --- 取り込みの状態 ---
+
+    def get_watermarks(self, user_id):
+        rows = self._connect().execute("SELECT data_type, ts FROM watermarks WHERE user_id = ?", (user_id,))
+        return {data_type: datetime.fromtimestamp(ts, JST) for data_type, ts in rows}
+
+    def set_watermark(self, user_id, data_type, timestamp):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO watermarks (user_id, data_type, ts) VALUES (?, ?, ?)",
+                         (user_id, data_type, timestamp.timestamp()))
+
+    def load_rate_limits(self, user_ids):
+        conn = self._connect()
+        states = {}
+        for user_id in user_ids:
+            row = conn.execute("SELECT remaining, reset_at FROM rate_limits WHERE user_id = ?", (user_id,)).fetchone()
+            if row:
+                states[user_id] = {"remaining": row[0], "reset_at": row[1]}
+        return states
+
+    def save_rate_limits(self, states):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO rate_limits (user_id, remaining, reset_at) VALUES (?, ?, ?)",
+                [(user_id, state["remaining"], state["reset_at"]) for user_id, state in states.items()],
+            )
+
+    # 実験の更新時刻を記録する
+    def _touch(self, experiment_ids, field):
+        now = datetime.now(JST).isoformat()
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT INTO status (experiment_id, {field}) VALUES (?, ?) "
+                f"ON CONFLICT (experiment_id) DO UPDATE SET {field} = excluded.{field}",
+                [(experiment_id, now) for experiment_id in set(experiment_ids)],
+            )
+
+    def mark_ingested(self, experiment_ids):
+        self._touch(experiment_ids, "last_ingested_at")
+
+    def mark_intervened(self, experiment_id):
+        self._touch([experiment_id], "last_intervened_at")
+
+    def mark_backfilled(self, experiment_ids):
+        self._touch(experiment_ids, "last_backfilled_at")
+
+    def get_data_version(self, experiment_id):
+        row = self._connect().execute(
+            "SELECT last_ingested_at, last_intervened_at, last_backfilled_at FROM status WHERE experiment_id = ?",
+            (experiment_id,)
+        ).fetchone()
+        return tuple(str(value) for value in row) if row else None
+
+    def load_backfill_progress(self, experiment_ids):
+        conn = self._connect()
+        completed = set()
+        for experiment_id in experiment_ids:
+            rows = conn.execute("SELECT id FROM backfill_progress WHERE experiment_id = ?", (experiment_id,))
+            completed.update(row[0] for row in rows)
+        return completed
+
+    def mark_backfill_done(self, experiment_id, data_type, date, written):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO backfill_progress (id, experiment_id, data_type, date, written, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (progress_id(experiment_id, data_type, date), experiment_id, data_type, date, written,
+                 datetime.now(JST).isoformat()),
+            )
@@ -0,0 +1,230 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import timedelta
+
+# 保存先: "firestore"（既定）/ "sqlite"（1台で完結する運用やベンチマーク用）
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "firestore")
+
+# SQLite のデータベースファイルのパス
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "fitbit_tracker.sqlite3")
+
+
+# バックフィルの進捗のIDを作成する
+def progress_id(experiment_id, data_type, date):
+    return f"{experiment_id}_{data_type}_{date}"
+
+
+# 介入記録のIDを作成する（介入の時間帯と記録元ごとに1件。再実行しても同じIDになる）
+def intervention_id(date, hour, source):
+    return f"{date}T{hour:02d}-{source}"
+
+
+# 集計値の段階（粗い順）。raw は保存されているデータ点そのもの
+TIERS = [
+    ("day", timedelta(days=1)),
+    ("hour", timedelta(hours=1)),
+    ("raw", None),
+]
+
+
+# 時刻が段階の区切り（日は0時、時は00分）に揃っているか
+def _aligned(timestamp, size):
+    if size >= timedelta(days=1):
+        return timestamp == timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return timestamp == timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+# 期間 [start, end) と必要な解像度を満たす最も粗い段階を選ぶ
+def choose_tier(start, end, resolution):
+    """
+    段階の幅が resolution 以下で、start と end がその段階の区切りに揃っている場合にその段階を使う。
+    """
+    for tier, size in TIERS:
+        if size is None:
+            return tier
+        if size <= resolution and _aligned(start, size) and _aligned(end, size):
+            return tier
+
+
+class Storage(ABC):
+    """
+    このプロジェクトが使うデータの読み書きをまとめた抽象基底クラス。
+    実装していないメソッドがあるバックエンドはインスタンスを作成する時点でエラーになる。
+    Firestore（firestore_storage.FirestoreStorage）と SQLite（sqlite_storage.SQLiteStorage）で実装する。
+    日付は "YYYY-MM-DD"、時刻は JST の datetime で受け渡す。
+    統計量は baseline_store と同じ {"count", "mean", "m2", "sum", "min", "max"} の形式。
+    """
+
+    # --- ユーザ ---
+
+    # 全ユーザの [(user_id, ユーザ情報)] を返す（fields を指定した場合はそのフィールドだけ）
+    @abstractmethod
+    def list_users(self, fields=None):
+        raise NotImplementedError
+
+    # ユーザ情報を返す（存在しない場合は None）
+    @abstractmethod
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    # ユーザ情報を作成する（既存の場合は置き換える）
+    @abstractmethod
+    def set_user(self, user_id, data):
+        raise NotImplementedError
+
+    # ユーザ情報の一部を更新する
+    @abstractmethod
+    def update_user(self, user_id, fields):
+        raise NotImplementedError
+
+    # --- 活動データ ---
+
+    # 1日分のデータ点を追加する（同じ時刻のデータ点は置き換える）。保存した件数を返す
+    @abstractmethod
+    def write_points(self, user_id, experiment_id, data_type, date, seconds, values):
+        raise NotImplementedError
+
+    # 指定した日のデータ点 [{"date", "time", "value"}] を時刻順に返す
+    @abstractmethod
+    def read_day(self, experiment_id, data_type, date):
+        raise NotImplementedError
+
+    # 期間 [start, end) のデータ点 [{"date", "time", "value"}] を返す
+    @abstractmethod
+    def read_range(self, experiment_id, data_type, start, end):
+        raise NotImplementedError
+
+    # 期間 [start, end) の集計値を resolution 以下の間隔で返す（choose_tier で選んだ最も粗い段階から読み込む）
+    # (段階, 行, 集計値のない日付) を返す。日・時の段階の行は {"start", 統計量...} を時刻順に、raw の段階の行は {"date", "time", "value"}
+    # 集計値のない日付（ロールアップを保存する前の日など）は呼び出し側で元のデータや日次集計から補う
+    @abstractmethod
+    def query_rollups(self, experiment_id, data_type, start, end, resolution):
+        raise NotImplementedError
+
+    # 指定した日の実験・ユーザごとの統計量 {(experiment_id, user_id): 統計量} を返す
+    @abstractmethod
+    def day_stats_by_user(self, experiment_ids, data_type, date):
+        raise NotImplementedError
+
+    # --- 日次集計 ---
+
+    # 日次集計 {(experiment_id, user_id): 集計値} を保存する。保存した件数を返す
+    @abstractmethod
+    def write_summaries(self, data_type, date, summaries):
+        raise NotImplementedError
+
+    # 期間の日次集計を返す（両端の日を含む）
+    @abstractmethod
+    def read_summaries(self, experiment_id, data_type, start_date, end_date):
+        raise NotImplementedError
+
+    # --- 介入スケジュール・介入記録 ---
+
+    # 指定した日の介入時刻のリストを返す（スケジュールがない場合は None）
+    @abstractmethod
+    def get_schedule(self, date):
+        raise NotImplementedError
+
+    # 指定した日の介入時刻を保存する
+    @abstractmethod
+    def set_schedule(self, date, hours):
+        raise NotImplementedError
+
+    # 介入を記録する（同じ時間帯・記録元の記録は置き換える）
+    @abstractmethod
+    def record_intervention(self, experiment_id, message, outcome, step_result=None, sedentary_result=None,
+                            source="intervention", now=None):
+        raise NotImplementedError
+
+    # 指定した日の介入記録を時刻順に返す
+    @abstractmethod
+    def interventions_for_date(self, experiment_id, date):
+        raise NotImplementedError
+
+    # 実験の期間 [start, end) の介入記録を時刻順に返す
+    @abstractmethod
+    def query_history(self, experiment_id, start, end):
+        raise NotImplementedError
+
+    # 全実験の期間 [start, end) の介入記録を時刻順に返す（hour を指定した場合はその時間帯のみ）
+    @abstractmethod
+    def query_all_experiments(self, start, end, hour=None):
+        raise NotImplementedError
+
+    # --- 取り込みの状態 ---
+
+    # ユーザのデータタイプごとのウォーターマーク {data_type: datetime} を返す
+    @abstractmethod
+    def get_watermarks(self, user_id):
+        raise NotImplementedError
+
+    # ウォーターマークを更新する
+    @abstractmethod
+    def set_watermark(self, user_id, data_type, timestamp):
+        raise NotImplementedError
+
+    # ユーザごとのレート制限の状態 {user_id: {"remaining", "reset_at"}} を返す
+    @abstractmethod
+    def load_rate_limits(self, user_ids):
+        raise NotImplementedError
+
+    # ユーザごとのレート制限の状態を保存する
+    @abstractmethod
+    def save_rate_limits(self, states):
+        raise NotImplementedError
+
+    # データを取り込んだ実験の更新時刻を記録する
+    @abstractmethod
+    def mark_ingested(self, experiment_ids):
+        raise NotImplementedError
+
+    # 介入を記録した実験の更新時刻を記録する
+    @abstractmethod
+    def mark_intervened(self, experiment_id):
+        raise NotImplementedError
+
+    # バックフィルでデータを保存した実験の更新時刻を記録する
+    @abstractmethod
+    def mark_backfilled(self, experiment_ids):
+        raise NotImplementedError
+
+    # 実験のデータのバージョン（取り込み・介入・バックフィルの更新時刻の組）を返す
+    @abstractmethod
+    def get_data_version(self, experiment_id):
+        raise NotImplementedError
+
+    # バックフィルの完了済みのID（{experiment_id}_{data_type}_{date}）の集合を返す
+    @abstractmethod
+    def load_backfill_progress(self, experiment_ids):
+        raise NotImplementedError
+
+    # バックフィルの完了を記録する
+    @abstractmethod
+    def mark_backfill_done(self, experiment_id, data_type, date, written):
+        raise NotImplementedError
+
+
+# プロセス内で共有するストレージ
+_storage = None
+_storage_lock = threading.Lock()
+
+
+# STORAGE_BACKEND に応じたストレージを返す（2回目以降は同じものを返す）
+def get_storage():
+    global _storage
+    if _storage is not None:
+        return _storage
+
+    with _storage_lock:
+        if _storage is None:
+            if STORAGE_BACKEND == "sqlite":
+                from sqlite_storage import SQLiteStorage
+                _storage = SQLiteStorage(SQLITE_PATH)
+            elif STORAGE_BACKEND == "firestore":
+                from firebase_auth import initialize_firestore
+                from firestore_storage import FirestoreStorage
+                _storage = FirestoreStorage(initialize_firestore())
+            else:
+                raise ValueError(f"不明な STORAGE_BACKEND です: {STORAGE_BACKEND}")
+        return _storage
@@ -1,11 +1,10 @@
 import random
 from datetime import datetime, timezone, timedelta
-from firebase_admin import firestore
-from firebase_auth import initialize_firestore  # あなたのプロジェクトに合わせて調整
+from storage import get_storage
         
 def craete_time_block():
-    # Firestore 初期化
-    db = initialize_firestore()
+    # ストレージ（STORAGE_BACKEND で切り替え）
+    storage = get_storage()
 
     # 日本時間を取得
     JST = timezone(timedelta(hours=9))
@@ -24,15 +23,10 @@ def craete_time_block():
     intervene_hours = [random.choice(hours) for hours in time_blocks.values()]
     intervene_hours.sort()  # 昇順で見やすく
 
-    # Firestore に保存
-    doc_ref = db.collection("intervene_schedule").document(today_str)
-    doc_ref.set({
-        "date": today_str,
-        "hours": intervene_hours,
-        "timestamp": firestore.SERVER_TIMESTAMP
-    })
+    # 介入スケジュールとして保存
+    storage.set_schedule(today_str, intervene_hours)
 
-    print(f"{today_str} の介入時刻を Firestore に保存しました: {intervene_hours}")
+    print(f"{today_str} の介入時刻を保存しました: {intervene_hours}")
 
 if __name__ == "__main__":
     craete_time_block()
\ No newline at end of file
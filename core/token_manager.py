@@ -0,0 +1,137 @@
+import base64
+import threading
+from datetime import datetime, timedelta, timezone
+import http_client
+from metrics import METRICS
+
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+# 有効期限のこの時間前になったら、401 を待たずに先に更新する
+REFRESH_MARGIN = timedelta(minutes=5)
+
+
+# トークンの更新処理
+def refresh_access_token(refresh_token, client_id, client_secret):
+    url = f"{http_client.FITBIT_API_BASE}/oauth2/token"
+    # client_id と client_secret を Base64 エンコード
+    auth_string = f"{client_id}:{client_secret}"
+    auth_header = base64.b64encode(auth_string.encode()).decode()
+
+    headers = {
+        "Content-Type": "application/x-www-form-urlencoded",
+        "Authorization": f"Basic {auth_header}",  # ここでAuthorizationヘッダーを追加
+    }
+    data = {
+        "grant_type": "refresh_token",
+        "refresh_token": refresh_token,
+    }
+    response = http_client.post(url, headers=headers, data=data)
+    if response.status_code == 200:
+        return response.json()
+    else:
+        print("トークン更新エラー:", response.json())
+        return None
+
+
+# トークン取得・更新のレスポンスからユーザ情報に保存する項目を作成する
+def token_fields(token_response, now=None):
+    now = now or datetime.now(JST)
+    fields = {
+        "fitbit_access_token": token_response["access_token"],
+        "refresh_token": token_response["refresh_token"],
+        "token_expiration": token_response["expires_in"],
+        "token_expires_at": now + timedelta(seconds=token_response["expires_in"]),
+    }
+    # 認可されたスコープ（settings がなければ端末の一覧を取得しない）
+    if "scope" in token_response:
+        fields["fitbit_scope"] = token_response["scope"]
+    return fields
+
+
+class TokenManager:
+    """
+    ユーザごとのアクセストークンをプロセス内にキャッシュし、有効期限の前に更新する。
+    Fitbit のリフレッシュトークンは1回しか使えないため、更新はユーザごとに同時に1つだけ実行する。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._user_locks = {}
+        self._tokens = {}
+
+    # ユーザごとのロックを返す
+    def _user_lock(self, user_id):
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    # 保存されたユーザ情報の内容をキャッシュに登録する
+    def register(self, user_id, user_data):
+        """
+        キャッシュ済みのリフレッシュトークンと異なる場合は、他のプロセスが更新したものとして置き換える。
+        """
+        with self._user_lock(user_id):
+            cached = self._tokens.get(user_id)
+            if cached is None or cached["refresh_token"] != user_data["refresh_token"]:
+                self._tokens[user_id] = self._from_user_data(user_data)
+
+    @staticmethod
+    def _from_user_data(user_data):
+        expires_at = user_data.get("token_expires_at")
+        return {
+            "access_token": user_data["fitbit_access_token"],
+            "refresh_token": user_data["refresh_token"],
+            "client_id": user_data["fitbit_client_id"],
+            "client_secret": user_data["fitbit_client_secret"],
+            # 有効期限が保存されていない場合は 401 が返るまで有効とみなす
+            "expires_at": expires_at.astimezone(JST) if expires_at else None,
+        }
+
+    # 有効なアクセストークンを返す（期限が近ければ先に更新する）
+    def get_token(self, storage, user_id):
+        token = self._tokens[user_id]
+        if not self._expiring(token):
+            return token["access_token"]
+        return self.invalidate(storage, user_id, token["access_token"])
+
+    def _expiring(self, token):
+        return token["expires_at"] is not None and datetime.now(JST) >= token["expires_at"] - REFRESH_MARGIN
+
+    # 期限切れのトークンを更新して新しいアクセストークンを返す（失敗した場合は None）
+    def invalidate(self, storage, user_id, expired_token):
+        with self._user_lock(user_id):
+            token = self._tokens[user_id]
+            # 待っている間に他のスレッドが更新済みならそのトークンを使う
+            if token["access_token"] != expired_token and not self._expiring(token):
+                return token["access_token"]
+
+            # 他のプロセスが既に更新していないか保存されたユーザ情報を確認する
+            user_data = storage.get_user(user_id)
+            if user_data is not None:
+                stored = self._from_user_data(user_data)
+                if stored["refresh_token"] != token["refresh_token"]:
+                    self._tokens[user_id] = stored
+                    if stored["access_token"] != expired_token and not self._expiring(stored):
+                        return stored["access_token"]
+                    token = stored
+
+            with METRICS.stage("token_refresh") as stage:
+                token_response = refresh_access_token(token["refresh_token"], token["client_id"], token["client_secret"])
+                stage.error = not token_response
+            if not token_response:
+                return None
+
+            # 新しいトークンと有効期限を保存
+            fields = token_fields(token_response)
+            storage.update_user(user_id, fields)
+            token.update({
+                "access_token": fields["fitbit_access_token"],
+                "refresh_token": fields["refresh_token"],
+                "expires_at": fields["token_expires_at"],
+            })
+            self._tokens[user_id] = token
+            return token["access_token"]
+
+
+# プロセス内で共有するトークンマネージャ（ウォームインスタンスでも再利用される）
+TOKEN_MANAGER = TokenManager()
@@ -0,0 +1,74 @@
+import numpy as np
+
+# Fitbit の時刻文字列 "HH:MM:SS" の長さ
+TIME_WIDTH = 8
+
+# 各桁の位置と重み（秒に換算）: HH:MM:SS
+_DIGIT_WEIGHTS = np.array([36000, 3600, 0, 600, 60, 0, 10, 1], dtype=np.int32)
+
+
+# "HH:MM:SS" のリストを 0時からの秒数の配列に変換する
+def parse_times(times):
+    """
+    文字列を1文字ずつの uint8 配列として扱い、桁ごとの重みを掛けて秒数にする。
+    datetime への変換を行わないため、1日分（86,400点）でも数ミリ秒で終わる。
+    """
+    if len(times) == 0:
+        return np.empty(0, dtype=np.int32)
+    raw = "".join(times).encode("ascii")
+    if len(raw) != TIME_WIDTH * len(times):
+        raise ValueError("時刻は HH:MM:SS 形式である必要があります")
+    digits = np.frombuffer(raw, dtype=np.uint8).reshape(-1, TIME_WIDTH).astype(np.int32) - ord("0")
+    return digits @ _DIGIT_WEIGHTS
+
+
+# 0時からの秒数の配列を "HH:MM:SS" のリストに変換する
+def format_times(seconds):
+    seconds = np.asarray(seconds, dtype=np.int64)
+    chars = np.empty((len(seconds), TIME_WIDTH), dtype=np.uint8)
+    hours, rest = np.divmod(seconds, 3600)
+    minutes, secs = np.divmod(rest, 60)
+    for column, part in ((0, hours), (3, minutes), (6, secs)):
+        chars[:, column] = part // 10 + ord("0")
+        chars[:, column + 1] = part % 10 + ord("0")
+    chars[:, 2] = chars[:, 5] = ord(":")
+    text = chars.tobytes().decode("ascii")
+    return [text[i:i + TIME_WIDTH] for i in range(0, len(text), TIME_WIDTH)]
+
+
+# Fitbit のデータセット [{"time", "value"}] を (秒数, 値) の配列に変換する
+def to_arrays(dataset):
+    seconds = parse_times([data_point["time"] for data_point in dataset])
+    values = np.fromiter((data_point["value"] for data_point in dataset), dtype=np.float64, count=len(dataset))
+    # Fitbit は時刻順に返すが、念のため並び替える
+    if len(seconds) > 1 and np.any(np.diff(seconds) < 0):
+        order = np.argsort(seconds, kind="stable")
+        seconds, values = seconds[order], values[order]
+    return seconds, values
+
+
+# step 秒ごとの格子に線形補間する（心拍数の5秒リサンプリング）
+def resample_linear(seconds, values, step=5):
+    """
+    最初のデータ点以降の最初の格子点から最後のデータ点までを補間する。
+    データ点の範囲外に値を作らないため、欠損（NaN）は発生しない。
+    """
+    if len(seconds) == 0:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+    first = -(-int(seconds[0]) // step) * step
+    grid = np.arange(first, int(seconds[-1]) + 1, step, dtype=np.int32)
+    return grid, np.interp(grid, seconds, values)
+
+
+# 1時間ごとに値を合計する（座位時間の集計）
+def hourly_sum(seconds, values):
+    """
+    最初のデータ点の時から最後のデータ点の時までの各時の合計を返す（データのない時は0）。
+    返す秒数は各時の先頭（HH:00:00）。
+    """
+    if len(seconds) == 0:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+    hours = seconds // 3600
+    first = int(hours.min())
+    sums = np.bincount(hours - first, weights=values)
+    return (np.arange(len(sums), dtype=np.int32) + first) * 3600, sums
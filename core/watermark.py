@@ -0,0 +1,95 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+# ユーザ・データタイプごとの取得済み時刻を保存するコレクション名
+# ingestion_watermarks/{user_id} に {data_type: 最後に取得したデータの時刻} を保存する
+WATERMARK_COLLECTION = "ingestion_watermarks"
+
+# ウォーターマークがない場合（初回）に取得する時間
+DEFAULT_WINDOW = timedelta(hours=1)
+
+# 遅れて同期されたデータを拾い直すため、ウォーターマークより前から取得する時間
+LATE_SYNC_LOOKBACK = timedelta(minutes=int(os.environ.get("INGESTION_LOOKBACK_MINUTES", "60")))
+
+# 実行が止まっていた場合に遡って取得する最大時間
+MAX_CATCHUP = timedelta(hours=int(os.environ.get("INGESTION_MAX_CATCHUP_HOURS", "24")))
+
+
+# ユーザのウォーターマークを取得する
+def get_watermarks(db, user_id):
+    doc = db.collection(WATERMARK_COLLECTION).document(user_id).get()
+    if not doc.exists:
+        return {}
+    return {data_type: timestamp.astimezone(JST) for data_type, timestamp in doc.to_dict().items()}
+
+
+# ウォーターマークを更新する（他のデータタイプのフィールドは残す）
+def set_watermark(db, user_id, data_type, timestamp):
+    db.collection(WATERMARK_COLLECTION).document(user_id).set({data_type: timestamp}, merge=True)
+
+
+# ウォーターマークから取得する期間 [start, end] を決める
+def ingestion_window(watermark, now):
+    """
+    ウォーターマークから LATE_SYNC_LOOKBACK だけ遡り、時の先頭に揃えた時刻から現在までを取得する。
+    時の先頭に揃えることで、1時間ごとに集計するデータタイプも毎回1時間分まるごと書き直される。
+    """
+    start = (watermark or now - DEFAULT_WINDOW) - LATE_SYNC_LOOKBACK
+    start = max(start, now - MAX_CATCHUP)
+    return start.replace(minute=0, second=0, microsecond=0), now
+
+
+# 期間を日付ごとの (日付, 開始時刻, 終了時刻) に分割する（Fitbit APIは1日単位で時刻を指定するため）
+def split_by_date(start, end):
+    segments = []
+    current = start
+    while current <= end:
+        day_end = current.replace(hour=23, minute=59, second=0, microsecond=0)
+        segment_end = min(day_end, end)
+        segments.append((current.strftime("%Y-%m-%d"), current.strftime("%H:%M"), segment_end.strftime("%H:%M")))
+        current = day_end + timedelta(minutes=1)
+    return segments
+
+
+# 端末の一覧（/1/user/-/devices.json のレスポンス）から最後に同期した時刻を返す（端末がない場合は None）
+def last_sync_time(devices):
+    sync_times = [device["lastSyncTime"] for device in devices or [] if device.get("lastSyncTime")]
+    if not sync_times:
+        return None
+    return datetime.strptime(max(sync_times)[:19], "%Y-%m-%dT%H:%M:%S").replace(tzinfo=JST)
+
+
+# データセット内の、端末が最後に同期した時刻までの最後のデータ点の時刻を返す
+def last_timestamp(date, dataset, last_sync, now):
+    """
+    Fitbit の分単位のデータは、同期されていない時間も要求した終了時刻まで 0 で埋めて返す。
+    同期より後のデータ点までウォーターマークを進めると、LATE_SYNC_LOOKBACK より遅れて同期されたデータを
+    取得し直さなくなるため、last_sync より後のデータ点は使わない。
+    last_sync が None（端末の一覧を取得できない・settings のスコープがない場合）は now - LATE_SYNC_LOOKBACK までにする。
+    """
+    if not dataset or date == "unknown_date":
+        return None
+    limit = last_sync or now - LATE_SYNC_LOOKBACK
+    if date < limit.strftime("%Y-%m-%d"):
+        times = [data_point["time"] for data_point in dataset]
+    elif date == limit.strftime("%Y-%m-%d"):
+        limit_time = limit.strftime("%H:%M:%S")
+        times = [data_point["time"] for data_point in dataset if data_point["time"] <= limit_time]
+    else:
+        return None
+    if not times:
+        return None
+    return datetime.strptime(f"{date} {max(times)}", "%Y-%m-%d %H:%M:%S").replace(tzinfo=JST)
+
+
+# 日付のデータが揃っている（端末がその日の後に同期済み）か
+def is_complete_day(date, last_sync, now):
+    """
+    last_sync の日付より前の日だけを完了とする。
+    last_sync が None の場合は、遅れて同期される分を考えて前日より前の日だけを完了とする。
+    """
+    limit = last_sync or now - timedelta(days=1)
+    return date < limit.strftime("%Y-%m-%d")
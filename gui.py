@@ -6,30 +6,39 @@ import requests
 import pandas as pd
 import webbrowser
 import time
-from firebase_admin import firestore
 sys.path.append(os.path.join(os.path.dirname(__file__), "core"))
-from core.firebase_auth import initialize_firestore
-from core.fitbit_auth import generate_auth_url, get_access_token
-from datetime import datetime, timedelta
-from services.show_data import display_data_chart
+from fitbit_auth import generate_auth_url, get_access_token
+from token_manager import token_fields
+from endpoints import DATA_TYPES
+from firebase_auth import initialize_firestore
+from storage import STORAGE_BACKEND
+from datetime import datetime, timedelta, timezone
+from services.data_access import get_storage, load_charts_data
+from services.show_data import display_data_chart, display_range_chart
 
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
 
-# Firestoreにアカウント情報を登録する
-def save_user_data_to_firestore(db, user_id, token_response, experiment_id, slack_dm_id):
-    db.collection("users").document(experiment_id).set({
+# 実験の群（ユーザ情報の group に保存する）
+EXPERIMENT_GROUPS = {"A": "A: 通知のみ", "B": "B: 通知＋可視化"}
+
+
+# アカウント情報を登録する
+def save_user_data(storage, user_id, token_response, experiment_id, slack_dm_id, group):
+    storage.set_user(experiment_id, {
         "fitbit_client_id": st.session_state["CLIENT_ID"],
         "fitbit_client_secret": st.session_state["CLIENT_SECRET"],
-        "fitbit_access_token": token_response["access_token"],
-        "refresh_token": token_response["refresh_token"],
-        "token_expiration": token_response["expires_in"],
+        **token_fields(token_response),
         "experiment_id": experiment_id,
         "slack_dm_id": slack_dm_id,
+        # 実験の群（分析でグループ間の比較に使う）
+        "group": group,
     })
     st.success("アカウントが保存されました！")
 
 
 # アカウント作成画面
-def account_creation_screen(db):
+def account_creation_screen(storage):
     st.title("アカウント作成")
 
     # セッションで値を保持
@@ -52,6 +61,8 @@ def account_creation_screen(db):
     st.session_state["CLIENT_SECRET"] = st.text_input("Fitbit APIのクライアントシークレットを入力してください", value=st.session_state["CLIENT_SECRET"])
     REDIRECT_URI = "https://fitbittracker-bczlqhsg8z7tmzyjptxynr.streamlit.app/callback"  # 変更不要
     st.session_state["experiment_id"] = st.text_input("実験IDを入力してください", value=st.session_state["experiment_id"])
+    st.session_state["group"] = st.selectbox("実験の群を選択してください", list(EXPERIMENT_GROUPS), format_func=EXPERIMENT_GROUPS.get,
+                                             index=list(EXPERIMENT_GROUPS).index(st.session_state.get("group", "A")))
 
     # Fitbit認証URLの生成と表示
     if st.button("Fitbitに接続"):
@@ -84,7 +95,8 @@ def account_creation_screen(db):
                     REDIRECT_URI
                 )
                 if token_response:
-                    save_user_data_to_firestore(db, user_id, token_response, st.session_state["experiment_id"], st.session_state["slack_dm_id"])
+                    save_user_data(storage, user_id, token_response, st.session_state["experiment_id"], st.session_state["slack_dm_id"],
+                                   st.session_state["group"])
                     st.success("アカウントが作成されました！ログインしてください。")
                     st.session_state["logged_in"] = True
                     st.session_state["user_id"] = user_id
@@ -95,12 +107,11 @@ def account_creation_screen(db):
 
 
 # ログイン画面
-def login_screen(db):
+def login_screen(storage):
     st.title("ログイン")
     experiment_id = st.text_input("実験IDを入力してください")
     if st.button("ログイン"):
-        user_doc = db.collection("users").document(experiment_id).get()
-        if user_doc.exists:
+        if storage.get_user(experiment_id) is not None:
             st.success("ログイン成功！")
             st.session_state["logged_in"] = True
             st.session_state["experiment_id"] = experiment_id
@@ -113,12 +124,43 @@ def login_screen(db):
 # 初期データ設定
 DEFAULT_DATA_TYPES = ["heart", "steps", "minutesSedentary"]
 
+# 選択できるデータタイプ（取得しているデータタイプ。心拍数を最初に表示する）
+DATA_TYPE_OPTIONS = sorted(DATA_TYPES, key=lambda data_type: data_type != "heart")
+
+# 期間表示画面（1週間や実験期間の日ごとの推移）
+def range_screen(experiment_id, today):
+    st.markdown("### 📈 期間の推移")
+    col1, col2 = st.columns([2, 2])
+    with col1:
+        data_type = st.selectbox(
+            "データタイプを選択",
+            DATA_TYPE_OPTIONS,
+            key="range_data_type"
+        )
+    with col2:
+        selected_range = st.date_input("期間を選択", value=(today - timedelta(days=6), today), key="range_dates")
+
+    # 期間の終了日を選択中の場合は開始日だけが返る
+    if len(selected_range) != 2:
+        st.info("終了日を選択してください。")
+        return
+    start_date, end_date = selected_range
+    with st.spinner("データを取得中..."):
+        display_range_chart(experiment_id, data_type, start_date, end_date)
+
 # メイン画面
-def main_screen(db):
+def main_screen(storage):
     st.title("Fitbit Tracker")
 
     experiment_id = st.session_state["experiment_id"]
-    today = datetime.now().date()
+    # 日付の境界はデータと同じ日本時間にする（サーバのタイムゾーンによらない）
+    today = datetime.now(JST).date()
+
+    # 1日のデータと期間の推移のどちらを表示するか
+    view_mode = st.radio("表示", ["1日", "期間"], horizontal=True)
+    if view_mode == "期間":
+        range_screen(experiment_id, today)
+        return
 
     # 上部にナビゲーションバーを配置
     with st.container():
@@ -128,7 +170,7 @@ def main_screen(db):
         with col1:
             selected_data_type = st.selectbox(
                 "データタイプを選択",
-                ["heart", "steps", "calories", "distance", "floors", "active_minutes", "minutesSedentary"]
+                DATA_TYPE_OPTIONS
             )
         with col2:
             selected_date = st.date_input("日付を選択", value=today)
@@ -149,31 +191,40 @@ def main_screen(db):
 
     # 初期表示時はデフォルトの3つのデータを表示
     if st.session_state["show_default"]:
+        # 3つのグラフのデータを並列に取得してから描画する
+        with st.spinner("今日のデータを取得中..."):
+            charts, timings = load_charts_data(experiment_id, DEFAULT_DATA_TYPES, today)
+        st.caption(
+            f"データ取得: {timings['total']:.2f}秒"
+            f"（最も遅いクエリ {timings['slowest']:.2f}秒 / 順番に取得した場合 {timings['serial']:.2f}秒）"
+        )
+
         st.subheader("💓 今日の心拍数")
-        with st.spinner("心拍数データを取得中..."):
-            display_data_chart(db, experiment_id, data_type="heart", date=today)
+        display_data_chart(experiment_id, data_type="heart", date=today, chart_data=charts["heart"])
 
         st.markdown("---")
 
         st.subheader("🚶‍♂️ 今日の歩数")
-        with st.spinner("歩数データを取得中..."):
-            display_data_chart(db, experiment_id, data_type="steps", date=today)
+        display_data_chart(experiment_id, data_type="steps", date=today, chart_data=charts["steps"])
 
         st.markdown("---")
 
         st.subheader("🪑 今日の座位時間")
-        with st.spinner("座位時間データを取得中..."):
-            display_data_chart(db, experiment_id, data_type="minutesSedentary", date=today)
+        display_data_chart(experiment_id, data_type="minutesSedentary", date=today, chart_data=charts["minutesSedentary"])
     
     # 選択後のデータ表示
     if not st.session_state["show_default"]:
         st.header(f"{st.session_state['selected_date']} の {st.session_state['selected_data_type']} データ")
         with st.spinner(f"{st.session_state['selected_data_type']} データを取得中..."):
-            display_data_chart(db, experiment_id, data_type=st.session_state["selected_data_type"], date=st.session_state["selected_date"])
+            display_data_chart(experiment_id, data_type=st.session_state["selected_data_type"], date=st.session_state["selected_date"])
 
 # メイン関数
 def main():
-    db = initialize_firestore()
+    # Firestore の認証情報は Streamlit の secrets から渡す（2回目以降の再実行では初期化済みのクライアントを使う）
+    if STORAGE_BACKEND == "firestore":
+        initialize_firestore(dict(st.secrets["firebase"]))
+    # 再実行のたびに初期化しないよう、プロセス内で共有するストレージを使う
+    storage = get_storage()
 
     if "logged_in" not in st.session_state:
         st.session_state["logged_in"] = False
@@ -183,11 +234,11 @@ def main():
     if not st.session_state["logged_in"]:
         option = st.sidebar.selectbox("選択してください", ["ログイン", "アカウント作成"])
         if option == "ログイン":
-            login_screen(db)
+            login_screen(storage)
         elif option == "アカウント作成":
-            account_creation_screen(db)
+            account_creation_screen(storage)
     else:
-        main_screen(db)
+        main_screen(storage)
 
 
 if __name__ == "__main__":
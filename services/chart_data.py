@@ -0,0 +1,104 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "core"))
+from transform_kernels import parse_times
+
+# グラフの幅（ピクセル）
+CHART_WIDTH = 700
+
+# 1本のグラフに描画する最大の点数（1ピクセルあたり1点。これ以上は見た目が変わらない）
+MAX_POINTS = CHART_WIDTH
+
+# グラフの時刻は従来どおり 1900-01-01 の時刻として扱う（pd.to_datetime(format="%H:%M:%S") と同じ）
+_BASE_TIME = np.datetime64("1900-01-01T00:00:00")
+
+
+# Largest-Triangle-Three-Buckets で threshold 点に間引く（波形の山と谷を残す）
+def lttb(x, y, threshold):
+    """
+    選んだ点のインデックスを返す。最初と最後の点は必ず残す。
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        # 次のバケットの平均点
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        # 今のバケットのうち、前に選んだ点と次のバケットの平均点との三角形が最大になる点を選ぶ
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+# threshold / 2 個のバケットに分け、各バケットの最小値と最大値の点を残す
+def minmax_downsample(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 2:
+        return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    selected = []
+    for bucket in np.array_split(np.arange(n), threshold // 2):
+        values = y[bucket]
+        selected.extend((bucket[values.argmin()], bucket[values.argmax()]))
+    return np.unique(selected)
+
+
+# 取得したデータ [{"time", "value", ...}] を時刻順の (秒数, 値) の配列にする
+def to_series(data):
+    seconds = parse_times([data_point["time"] for data_point in data])
+    values = np.fromiter((data_point["value"] for data_point in data), dtype=np.float64, count=len(data))
+    order = np.argsort(seconds, kind="stable")
+    return seconds[order], values[order]
+
+
+# 秒数を描画用の時刻に変換する
+def _to_times(seconds):
+    return (_BASE_TIME + np.asarray(seconds, dtype="timedelta64[s]")).astype("datetime64[ns]")
+
+
+# 折れ線グラフのデータを作成する（点数は max_points 以下）
+def build_chart_frame(seconds, values, max_points=MAX_POINTS, method="lttb"):
+    downsample = lttb if method == "lttb" else minmax_downsample
+    index = downsample(seconds, values, max_points)
+    return pd.DataFrame({"time": _to_times(seconds[index]), "value": values[index]})
+
+
+# 介入の時刻に一番近いデータ点の値を付ける（時刻順に並べて1回の結合で行う）
+def attach_interventions(seconds, values, interventions):
+    """
+    間引く前のデータに結合するため、マーカーは元のデータの値の位置に表示される。
+    """
+    if not interventions or len(seconds) == 0:
+        return pd.DataFrame(columns=["time", "value", "message"])
+    markers = pd.DataFrame({
+        "time": pd.to_datetime([intervention["time"] for intervention in interventions], format="%H:%M:%S"),
+        "message": [intervention.get("message") for intervention in interventions],
+    }).sort_values("time")
+    series = pd.DataFrame({"time": _to_times(seconds), "value": values})
+    return pd.merge_asof(markers, series, on="time", direction="nearest")[["time", "value", "message"]]
+
+
+# グラフに渡すデータ（折れ線と介入点）を作成する
+def prepare_chart_data(data, interventions, max_points=MAX_POINTS, method="lttb"):
+    seconds, values = to_series(data)
+    return (
+        build_chart_frame(seconds, values, max_points, method),
+        attach_interventions(seconds, values, interventions),
+    )
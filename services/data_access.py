@@ -0,0 +1,171 @@
+import sys
+import os
+import threading
+import time
+import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "core"))
+from datetime import datetime, timedelta, timezone
+from metrics import METRICS
+from storage import get_storage
+from watermark import MAX_CATCHUP
+
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+# 更新時刻を確認する間隔（秒）。この間の再実行ではストレージを読まない
+VERSION_CHECK_TTL = 60
+
+# 同時に実行するクエリ数の上限
+MAX_CONCURRENT_QUERIES = 8
+
+# 期間表示で一度に表示できる最大の日数（読み込み数を制限する）
+MAX_RANGE_DAYS = 120
+
+# キャッシュする結果の数の上限（古いバージョンの今日のデータはここで追い出される）
+MAX_CACHE_ENTRIES = 256
+
+
+# 実験のデータのバージョン（取り込み・介入・バックフィルの更新時刻）を取得する
+@st.cache_data(ttl=VERSION_CHECK_TTL, show_spinner=False)
+def load_data_version(experiment_id):
+    return get_storage().get_data_version(experiment_id)
+
+
+# キャッシュのキーに使うバージョンを返す
+def cache_version(experiment_id, date_str):
+    """
+    定期の取り込みは MAX_CATCHUP まで遡って書き込むため（日付をまたいだ直後の前日の 23 時台など）、
+    その範囲の日付は取り込み・介入のたびにバージョンが変わり、新しいキーで読み直される。
+    それより前の日付はバックフィルでしか変わらないため、バックフィルの更新時刻だけをバージョンにする。
+    """
+    version = load_data_version(experiment_id) or (None, None, None)
+    settled = (datetime.now(JST) - MAX_CATCHUP).strftime("%Y-%m-%d")
+    if date_str < settled:
+        return ("past", version[2])
+    return version
+
+
+# 指定した日のデータを取得する
+@st.cache_data(max_entries=MAX_CACHE_ENTRIES, show_spinner=False)
+def load_day_data(experiment_id, data_type, date_str, version):
+    return get_storage().read_day(experiment_id, data_type, date_str)
+
+
+# 指定した日の介入データを取得する
+@st.cache_data(max_entries=MAX_CACHE_ENTRIES, show_spinner=False)
+def load_interventions(experiment_id, date_str, version):
+    return get_storage().interventions_for_date(experiment_id, date_str)
+
+
+# 指定した日の前の7日間の日次集計を取得する
+@st.cache_data(max_entries=MAX_CACHE_ENTRIES, show_spinner=False)
+def load_daily_summaries(experiment_id, data_type, date_str, version):
+    day = datetime.strptime(date_str, "%Y-%m-%d")
+    start_date = (day - timedelta(days=7)).strftime("%Y-%m-%d")
+    end_date = (day - timedelta(days=1)).strftime("%Y-%m-%d")
+    return get_storage().read_summaries(experiment_id, data_type, start_date, end_date)
+
+
+# 期間の日ごとの集計値を取得する（start_str, end_str は "YYYY-MM-DD" で両端を含む）
+@st.cache_data(max_entries=MAX_CACHE_ENTRIES, show_spinner=False)
+def load_range_data(experiment_id, data_type, start_str, end_str, version):
+    """
+    日の段階の集計値（Firestore では取り込み時に作成している日のロールアップ）を query_rollups で読み込む。
+    統計量のない日（導入前のデータ）は日次集計で補う。
+    [{"date", "mean", "sum", "min", "max", "count"}] を日付順に返す。
+    """
+    storage = get_storage()
+    start = datetime.strptime(start_str, "%Y-%m-%d").replace(tzinfo=JST)
+    end = datetime.strptime(end_str, "%Y-%m-%d").replace(tzinfo=JST) + timedelta(days=1)
+    _, rows, missing = storage.query_rollups(experiment_id, data_type, start, end, timedelta(days=1))
+    days = {}
+    for row in rows:
+        date = row["start"].strftime("%Y-%m-%d")
+        days[date] = {"date": date, **row}
+
+    if missing:
+        for summary in storage.read_summaries(experiment_id, data_type, missing[0], missing[-1]):
+            if summary["date"] in missing:
+                days[summary["date"]] = {
+                    "date": summary["date"],
+                    "mean": summary["average_value"],
+                    "sum": summary.get("sum"),
+                    "min": summary.get("min"),
+                    "max": summary.get("max"),
+                    "count": summary.get("count"),
+                }
+
+    fields = ("date", "mean", "sum", "min", "max", "count")
+    return [{field: days[date].get(field) for field in fields} for date in sorted(days)]
+
+
+# 期間の日ごとの集計値を取得する（期間は MAX_RANGE_DAYS までに切り詰める）
+def load_range(experiment_id, data_type, start_date, end_date):
+    start_date = max(start_date, end_date - timedelta(days=MAX_RANGE_DAYS - 1))
+    start_str = start_date.strftime("%Y-%m-%d")
+    end_str = end_date.strftime("%Y-%m-%d")
+    return load_range_data(experiment_id, data_type, start_str, end_str, cache_version(experiment_id, end_str))
+
+
+# Streamlit の実行コンテキストを引き継いだスレッドプールを作成する（ワーカーからキャッシュを使うため）
+def _executor(max_workers):
+    ctx = get_script_run_ctx()
+    return ThreadPoolExecutor(
+        max_workers=max_workers,
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx),
+    )
+
+
+# 処理時間を計測しながら関数を実行する
+def _timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+# 複数のデータタイプのグラフの表示に必要なデータを並列に取得する
+def load_charts_data(experiment_id, data_types, date):
+    """
+    ({data_type: {"data", "interventions", "daily_summaries"}}, 処理時間) を返す。
+    すべてのクエリを同時に実行するため、待ち時間は最も遅いクエリの時間になる。
+    処理時間は {"total": 全体, "slowest": 最も遅いクエリ, "serial": 各クエリの合計} の秒数。
+    """
+    started = time.perf_counter()
+    date_str = date.strftime("%Y-%m-%d")
+    version = cache_version(experiment_id, date_str)
+
+    # 介入データはデータタイプによらないため1回だけ取得する
+    tasks = {("interventions", None): (load_interventions, experiment_id, date_str, version)}
+    for data_type in data_types:
+        tasks[("data", data_type)] = (load_day_data, experiment_id, data_type, date_str, version)
+        tasks[("daily_summaries", data_type)] = (load_daily_summaries, experiment_id, data_type, date_str, version)
+
+    with _executor(min(len(tasks), MAX_CONCURRENT_QUERIES)) as executor:
+        futures = {key: executor.submit(_timed, *task) for key, task in tasks.items()}
+        results = {key: future.result() for key, future in futures.items()}
+
+    # クエリごとの処理時間と件数を記録する（キャッシュから返した場合も含む）
+    for (query, data_type), (result, elapsed) in results.items():
+        METRICS.record("query", elapsed, items=len(result), experiment_id=experiment_id, data_type=data_type, query=query)
+
+    interventions, _ = results[("interventions", None)]
+    charts = {
+        data_type: {
+            "data": results[("data", data_type)][0],
+            "interventions": interventions,
+            "daily_summaries": results[("daily_summaries", data_type)][0],
+        }
+        for data_type in data_types
+    }
+    elapsed = [elapsed for _, elapsed in results.values()]
+    timings = {"total": time.perf_counter() - started, "slowest": max(elapsed), "serial": sum(elapsed)}
+    METRICS.record("load_charts", timings["total"], items=len(tasks), experiment_id=experiment_id)
+    return charts, timings
+
+
+# グラフの表示に必要なデータをまとめて取得する
+def load_chart_data(experiment_id, data_type, date):
+    charts, _ = load_charts_data(experiment_id, [data_type], date)
+    return charts[data_type]
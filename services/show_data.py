@@ -3,60 +3,30 @@ import sys
 import os
 import streamlit as st
 import pandas as pd
-sys.path.append(os.path.join(os.path.dirname(__file__), "core"))
-from datetime import datetime, timedelta
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "core"))
+from metrics import METRICS
+from services.chart_data import CHART_WIDTH, prepare_chart_data
+from services.data_access import MAX_RANGE_DAYS, load_chart_data, load_range
 
 # データを可視化する関数
-def display_data_chart(db, experiment_id, data_type, date):
+def display_data_chart(experiment_id, data_type, date, chart_data=None):
+    """
+    chart_data を渡した場合は取得済みのデータで描画する（複数のグラフのデータを先にまとめて取得する場合）。
+    """
     formatted_date = date.strftime("%Y-%m-%d")
-    print(f"検索クエリ: activity_data/{experiment_id}/{data_type} where date == {formatted_date}") # デバッグ用
-    # 指定した日付のデータを取得
-    docs = db.collection("activity_data") \
-                .document(experiment_id) \
-                .collection(data_type) \
-                .where("date", "==", formatted_date) \
-                .stream()
-    data = [doc.to_dict() for doc in docs]
-    
-    # 介入データを取得
-    intervention_docs = db.collection("interventions") \
-                            .document(experiment_id) \
-                            .collection(formatted_date) \
-                            .stream()
-    print(f"検索クエリ: interventions/{experiment_id}/{formatted_date}")  # デバッグ用
-    intervention_data = [doc.to_dict() for doc in intervention_docs]
-
-    # 過去7日間の平均を計算
-    start_date = date - timedelta(days=7)
-    docs_avg = db.collection("daily_summary") \
-                    .document(experiment_id) \
-                    .collection(data_type) \
-                    .where("date", ">=", start_date.strftime("%Y-%m-%d")) \
-                    .where("date", "<", date.strftime("%Y-%m-%d")) \
-                    .stream()
-                            
-    data_avg = [doc.to_dict() for doc in docs_avg]
-    print("取得データ:", data_avg)  # デバッグ用
+    # 指定した日付のデータ・介入データ・過去7日間の日次集計を取得（キャッシュ済みなら Firestore は読まない）
+    if chart_data is None:
+        chart_data = load_chart_data(experiment_id, data_type, date)
+    data = chart_data["data"]
+    intervention_data = chart_data["interventions"]
+    data_avg = chart_data["daily_summaries"]
 
     if data:
         st.write(f"{formatted_date} の {data_type} データ")
-        df = pd.DataFrame(data)
-        df["time"] = pd.to_datetime(df["time"], format="%H:%M:%S")
-        df = df.sort_values(by="time")
-        
-        if intervention_data:
-            print("介入データ:", intervention_data)  # デバッグ用
-            df_intervention = pd.DataFrame(intervention_data)
-            df_intervention["time"] = pd.to_datetime(df_intervention["time"], format="%H:%M:%S")
-            
-            # 介入時間ごとに、一番近い `df` の値を取得
-            df_intervention["value"] = df_intervention["time"].apply(
-                lambda t: df.loc[(df["time"] - t).abs().idxmin(), "value"]
-                if not df.empty else None
-            )
-            df_intervention.dropna(inplace=True)  # NaN を削除（該当する値がなかった場合）
-        else:
-            df_intervention = pd.DataFrame(columns=["time", "message"])
+        # 描画する点数をグラフの幅までに間引き、介入点には一番近いデータ点の値を付ける
+        with METRICS.stage("chart", experiment_id=experiment_id, data_type=data_type) as stage:
+            df, df_intervention = prepare_chart_data(data, intervention_data)
+            stage.add(items=len(df))
 
         # 過去7日間の平均値を計算
         if data_avg:
@@ -70,7 +40,7 @@ def display_data_chart(db, experiment_id, data_type, date):
             x=alt.X("time:T", title="時間"),
             y=alt.Y("value:Q", title="値")
         ).properties(
-            width=700,  # グラフの幅
+            width=CHART_WIDTH,  # グラフの幅
             height=400  # グラフの高さ
         )
         
@@ -96,3 +66,33 @@ def display_data_chart(db, experiment_id, data_type, date):
         st.altair_chart(chart, use_container_width=True)
     else:
         st.error("データが見つかりませんでした。")
+
+
+# 期間の日ごとの集計値を可視化し、選んだ日の1日のデータを表示する関数
+def display_range_chart(experiment_id, data_type, start_date, end_date):
+    if (end_date - start_date).days + 1 > MAX_RANGE_DAYS:
+        st.warning(f"表示できる期間は {MAX_RANGE_DAYS} 日までです。直近の {MAX_RANGE_DAYS} 日を表示します。")
+    rows = load_range(experiment_id, data_type, start_date, end_date)
+    if not rows:
+        st.error("データが見つかりませんでした。")
+        return
+
+    st.write(f"{start_date} 〜 {end_date} の {data_type} データ（日ごとの集計）")
+    df = pd.DataFrame(rows)
+    df["date"] = pd.to_datetime(df["date"], format="%Y-%m-%d")
+
+    # 日ごとの最小〜最大の範囲と平均値を描画
+    base = alt.Chart(df).encode(x=alt.X("date:T", title="日付"))
+    band = base.mark_area(opacity=0.2, color="red").encode(y=alt.Y("min:Q", title="値"), y2="max:Q")
+    line = base.mark_line(color="red", point=True).encode(
+        y="mean:Q",
+        tooltip=[alt.Tooltip("date:T", title="日付"), "mean:Q", "sum:Q", "min:Q", "max:Q", "count:Q"]
+    )
+    chart = (band + line).properties(width=CHART_WIDTH, height=400)
+    st.altair_chart(chart, use_container_width=True)
+
+    # 選んだ日の1日のデータを表示（ドリルダウン）
+    dates = [row["date"] for row in rows]
+    selected = st.selectbox("詳細を表示する日", ["選択しない"] + dates[::-1])
+    if selected != "選択しない":
+        display_data_chart(experiment_id, data_type, pd.Timestamp(selected).date())
@@ -0,0 +1,29 @@
+import os
+import sys
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "core"))
+from analysis_mirror import SUMMARY_KEYS, write_partition
+
+
+# 以前の calculate_daily_mean が書き込んだ日次集計（自動ID で user_id を持たない）も書き出せる
+def test_write_partition_legacy_summary(tmp_path):
+    assert write_partition(tmp_path, [{"average_value": 3.0}], SUMMARY_KEYS) == 1
+
+    rows = [
+        {"user_id": None, "summary_id": "autoid1", "average_value": 1.0},
+        {"user_id": None, "summary_id": "autoid2", "average_value": 2.0},
+        {"user_id": "user1", "summary_id": "user1_2025-01-01", "average_value": 4.0},
+    ]
+    assert write_partition(tmp_path, rows, SUMMARY_KEYS) == 4
+
+    df = pd.read_parquet(os.path.join(tmp_path, "data.parquet"))
+    assert sorted(df["average_value"]) == [1.0, 2.0, 3.0, 4.0]
+
+
+# 同じユーザ・日の日次集計は新しいもので置き換える
+def test_write_partition_replaces_same_summary(tmp_path):
+    write_partition(tmp_path, [{"user_id": "user1", "summary_id": "user1_2025-01-01", "average_value": 1.0}], SUMMARY_KEYS)
+    write_partition(tmp_path, [{"user_id": "user1", "summary_id": "user1_2025-01-01", "average_value": 5.0}], SUMMARY_KEYS)
+
+    df = pd.read_parquet(os.path.join(tmp_path, "data.parquet"))
+    assert df["average_value"].tolist() == [5.0]
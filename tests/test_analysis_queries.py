@@ -0,0 +1,26 @@
+import os
+import sys
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "core"))
+from analysis_mirror import ACTIVITY_KEYS, partition_dir, write_partition
+from analysis_queries import connect, group_comparison
+
+
+# 群の対応表で、ユーザ情報に group のない参加者の群を補ってグループ間の比較ができる
+def test_group_comparison_with_groups_file(tmp_path):
+    root = str(tmp_path)
+    pd.DataFrame({"experiment_id": ["exp1", "exp2", "exp3", "exp4"], "group": ["A", None, None, None]}) \
+        .to_parquet(os.path.join(root, "participants.parquet"), index=False)
+    for i, experiment_id in enumerate(["exp1", "exp2", "exp3", "exp4"]):
+        for day in ("2025-01-01", "2025-01-02"):
+            rows = [{"user_id": "u", "time": "10:00:00", "second": 36000, "value": float(100 * (i + 1) + len(day))}]
+            write_partition(partition_dir(root, "activity", experiment_id=experiment_id, data_type="steps", date=day), rows, ACTIVITY_KEYS)
+    groups_file = os.path.join(root, "groups.csv")
+    pd.DataFrame({"experiment_id": ["exp2", "exp3", "exp4"], "group": ["A", "B", "B"]}).to_csv(groups_file, index=False)
+
+    assert group_comparison(connect(root))["groups"]["n"].tolist() == [1]
+
+    result = group_comparison(connect(root, groups_file))
+    assert result["groups"]["group"].tolist() == ["A", "B"]
+    assert result["groups"]["n"].tolist() == [2, 2]
+    assert result["t"] is not None
@@ -0,0 +1,39 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "core"))
+from intervention_features import load_window
+from runtime import RunContext
+
+JST = timezone(timedelta(hours=9))
+
+
+# 1月1日・2日だけロールアップがない（ロールアップを保存する前の日）ストレージ
+class PartialRollupStorage:
+    def __init__(self):
+        self.read_ranges = []
+
+    def query_rollups(self, experiment_id, data_type, start, end, resolution):
+        rows = []
+        hour_start = datetime(2025, 1, 3, tzinfo=JST)
+        while hour_start < end:
+            rows.append({"start": hour_start, "count": 60, "mean": 1.0, "m2": 0.0})
+            hour_start += resolution
+        return "hour", rows, ["2025-01-01", "2025-01-02"]
+
+    def read_range(self, experiment_id, data_type, start, end):
+        self.read_ranges.append((start, end))
+        return [{"date": "2025-01-01", "time": "10:00:00", "value": 5.0}, {"date": "2025-01-02", "time": "10:00:00", "value": 7.0}]
+
+
+# ロールアップのない日は元のデータから補い、連続する日は1回の読み込みにまとめる
+def test_load_window_fills_missing_days_from_points():
+    storage = PartialRollupStorage()
+    run = RunContext(now=datetime(2025, 1, 8, 10, 30, tzinfo=JST), storage=storage)
+    hourly = load_window(run, "exp1", "steps")
+
+    assert storage.read_ranges == [(datetime(2025, 1, 1, 10, tzinfo=JST), datetime(2025, 1, 3, tzinfo=JST))]
+    assert hourly[0] == (datetime(2025, 1, 1, 10, tzinfo=JST), {"count": 1, "mean": 5.0, "m2": 0.0, "sum": 5.0, "min": 5.0, "max": 5.0})
+    assert hourly[1][0] == datetime(2025, 1, 2, 10, tzinfo=JST)
+    assert hourly[2][0] == datetime(2025, 1, 3, tzinfo=JST)
+    assert hourly[-1][0] == datetime(2025, 1, 8, 10, tzinfo=JST)
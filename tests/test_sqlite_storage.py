@@ -0,0 +1,47 @@
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "core"))
+from sqlite_storage import SQLiteStorage
+
+JST = timezone(timedelta(hours=9))
+
+
+# 同じ秒に別の記録元が記録しても上書きせず、同じ時間帯・記録元の再実行は置き換える
+def test_record_intervention_per_slot_and_source(tmp_path):
+    storage = SQLiteStorage(os.path.join(tmp_path, "test.sqlite3"))
+    now = datetime(2025, 1, 1, 10, 5, 0, tzinfo=JST)
+    storage.record_intervention("exp1", "crawler", "sent", source="data_crawler", now=now)
+    storage.record_intervention("exp1", "first", "send_failed", now=now)
+    storage.record_intervention("exp1", "retry", "sent", now=now + timedelta(minutes=10))
+
+    records = storage.interventions_for_date("exp1", "2025-01-01")
+    assert sorted((record["record_id"], record["message"]) for record in records) == [
+        ("2025-01-01T10-data_crawler", "crawler"),
+        ("2025-01-01T10-intervention", "retry"),
+    ]
+    assert [record["message"] for record in storage.query_all_experiments(now, now + timedelta(hours=1), hour=10)] == \
+        ["crawler", "retry"]
+
+
+# 以前のスキーマ（時刻が主キー）の介入記録は記録IDを付けて移行する
+def test_migrates_interventions_table(tmp_path):
+    path = os.path.join(tmp_path, "old.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE interventions (
+            experiment_id TEXT NOT NULL, ts INTEGER NOT NULL, date TEXT NOT NULL, time TEXT NOT NULL,
+            hour INTEGER NOT NULL, outcome TEXT, message TEXT, step_result TEXT, sedentary_result TEXT,
+            source TEXT, created_at TEXT NOT NULL, PRIMARY KEY (experiment_id, ts)
+        );
+        CREATE INDEX interventions_hour ON interventions (hour, ts);
+    """)
+    ts = int(datetime(2025, 1, 1, 10, 5, tzinfo=JST).timestamp())
+    conn.execute("INSERT INTO interventions VALUES ('exp1', ?, '2025-01-01', '10:05:00', 10, 'sent', 'old', NULL, NULL, "
+                 "'intervention', '2025-01-01T10:05:00+09:00')", (ts,))
+    conn.commit()
+    conn.close()
+
+    records = SQLiteStorage(path).interventions_for_date("exp1", "2025-01-01")
+    assert [(record["record_id"], record["message"]) for record in records] == [("2025-01-01T10-intervention", "old")]
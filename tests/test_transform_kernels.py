@@ -0,0 +1,58 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "core"))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+import synthetic
+from baseline_store import compute_stats, mean_and_std, merge_all
+from legacy_transforms import aggregate_sedentary_data, resample_to_5s
+from transform_kernels import format_times, hourly_sum, resample_linear, to_arrays
+
+
+# 合成データの1日分のデータセット [{"time", "value"}]
+def synthetic_dataset(data_type, duration="1d"):
+    return synthetic.payloads(data_type, duration)[0][f"activities-{data_type}-intraday"]["dataset"]
+
+
+# 心拍数の5秒リサンプリングは従来の pandas の処理と同じ時刻・値になる
+# （従来の処理は time 列ごと補間するため pandas の FutureWarning が出るが、比較用なのでそのままにする）
+@pytest.mark.filterwarnings("ignore::FutureWarning")
+def test_resample_linear_matches_legacy():
+    for duration in ("1h", "1d"):
+        dataset = synthetic_dataset("heart", duration)
+        legacy = resample_to_5s(pd.DataFrame(dataset))
+        grid, values = resample_linear(*to_arrays(dataset), step=5)
+
+        assert format_times(grid) == legacy["time"].tolist()
+        assert np.allclose(values, legacy["value"].to_numpy(dtype=np.float64))
+
+
+# 座位時間の1時間集計は従来の pandas の処理と同じ時刻・値になる
+def test_hourly_sum_matches_legacy():
+    for duration in ("1h", "1d"):
+        dataset = synthetic_dataset("minutesSedentary", duration)
+        legacy = aggregate_sedentary_data(dataset)
+        hours, sums = hourly_sum(*to_arrays(dataset))
+
+        assert format_times(hours) == [record["time"] for record in legacy]
+        assert np.allclose(sums, [record["value"] for record in legacy])
+
+
+# 時間ごとの統計量を合成した結果は、全データ点の平均・不偏分散と一致する
+def test_merge_stats_matches_numpy():
+    points = synthetic.to_points(synthetic.payloads("steps", "7d"), "steps")
+    values = np.array([point["value"] for point in points])
+    # 取り込みと同じく、日・時ごとに統計量を作ってから合成する
+    groups = {}
+    for point in points:
+        groups.setdefault((point["date"], point["time"][:2]), []).append(point["value"])
+    merged = merge_all(compute_stats(group) for group in groups.values())
+
+    mean, std = mean_and_std(merged)
+    assert merged["count"] == len(values)
+    assert np.isclose(mean, values.mean())
+    assert np.isclose(std ** 2, np.var(values, ddof=1))
+    assert np.isclose(merged["sum"], values.sum())
+    assert (merged["min"], merged["max"]) == (values.min(), values.max())
@@ -0,0 +1,36 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "core"))
+from watermark import LATE_SYNC_LOOKBACK, is_complete_day, last_timestamp
+
+JST = timezone(timedelta(hours=9))
+
+# 要求した終了時刻まで 0 で埋められた分単位のデータ（8 時台だけ同期済み）
+DATASET = [{"time": f"{hour:02d}:{minute:02d}:00", "value": 5 if hour < 9 else 0} for hour in range(8, 12) for minute in range(60)]
+
+
+# 端末の最後の同期より後の 0 埋めのデータ点ではウォーターマークを進めない
+def test_last_timestamp_stops_at_last_sync():
+    now = datetime(2025, 1, 1, 12, 0, tzinfo=JST)
+    last_sync = datetime(2025, 1, 1, 9, 0, 30, tzinfo=JST)
+    assert last_timestamp("2025-01-01", DATASET, last_sync, now) == datetime(2025, 1, 1, 9, 0, tzinfo=JST)
+    assert last_timestamp("2024-12-31", DATASET, last_sync, now) == datetime(2024, 12, 31, 11, 59, tzinfo=JST)
+    assert last_timestamp("2025-01-02", DATASET, last_sync, now) is None
+
+
+# 同期時刻がわからない場合は 0 のデータ点に関係なく now - LATE_SYNC_LOOKBACK まで進める
+def test_last_timestamp_without_last_sync_uses_lookback():
+    now = datetime(2025, 1, 1, 11, 30, tzinfo=JST)
+    assert last_timestamp("2025-01-01", DATASET, None, now) == now - LATE_SYNC_LOOKBACK
+
+
+# 端末の最後の同期の日付（わからない場合は前日）より前の日だけを完了とする
+def test_is_complete_day():
+    now = datetime(2025, 1, 10, 12, 0, tzinfo=JST)
+    last_sync = datetime(2025, 1, 5, 8, 0, tzinfo=JST)
+    assert is_complete_day("2025-01-04", last_sync, now)
+    assert not is_complete_day("2025-01-05", last_sync, now)
+    assert is_complete_day("2025-01-08", None, now)
+    assert not is_complete_day("2025-01-09", None, now)
+    assert not is_complete_day("2025-01-10", None, now)